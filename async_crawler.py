@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+
+import aiohttp
+
+PAGES_DIR = "pages"
+URLS_FILE = "urls.txt"
+INDEX_FILE = "index.txt"
+MANIFEST_FILE = "crawl_manifest.json"
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Через сколько обработанных URL манифест и index.txt сохраняются на диск
+CHECKPOINT_EVERY = 500
+
+
+class HostLimiter:
+    """Ограничение параллельности и частоты запросов к одному хосту"""
+
+    def __init__(self, concurrency, rate):
+        self.concurrency = concurrency
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.semaphores = {}
+        self.locks = {}
+        self.next_slot = {}
+
+    async def acquire(self, host):
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.concurrency)
+            self.locks[host] = asyncio.Lock()
+            self.next_slot[host] = 0.0
+        await self.semaphores[host].acquire()
+        if self.interval:
+            # Старты запросов к хосту разводятся не чаще, чем раз в interval
+            async with self.locks[host]:
+                now = time.monotonic()
+                wait = self.next_slot[host] - now
+                self.next_slot[host] = max(now, self.next_slot[host]) + self.interval
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    def release(self, host):
+        self.semaphores[host].release()
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def write_page(filepath, text):
+    tmp_path = filepath + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, filepath)
+
+
+def retry_delay(attempt, backoff, retry_after=None):
+    if retry_after is not None and retry_after.isdigit():
+        return float(retry_after)
+    return backoff * (2 ** attempt) * (1 + random.random() / 2)
+
+
+async def fetch(session, limiter, url, entry, filepath, retries, backoff):
+    """Скачивает страницу, используя условный GET, если страница уже есть на диске"""
+    headers = {}
+    if entry and entry.get("file") == os.path.basename(filepath) and os.path.exists(filepath):
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    host = urlsplit(url).netloc
+    for attempt in range(retries + 1):
+        await limiter.acquire(host)
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304:
+                    return 304, None, response.headers
+                if response.status in RETRY_STATUSES and attempt < retries:
+                    delay = retry_delay(attempt, backoff, response.headers.get("Retry-After"))
+                else:
+                    response.raise_for_status()
+                    return response.status, await response.text(), response.headers
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == retries:
+                raise
+            delay = retry_delay(attempt, backoff)
+        finally:
+            limiter.release(host)
+        await asyncio.sleep(delay)
+
+
+async def crawl(urls, pages_dir=PAGES_DIR, index_file=INDEX_FILE, manifest_file=MANIFEST_FILE,
+                concurrency=64, per_host=4, rate=0.0, retries=3, backoff=0.5, timeout=10,
+                checkpoint_every=CHECKPOINT_EVERY):
+    """Конкурентно скачивает URL; неизменившиеся страницы не перезаписываются.
+
+    urls может быть любым итерируемым, в том числе ленивым: его читают concurrency постоянных
+    обработчиков через ограниченную очередь. Каждые checkpoint_every URL манифест и index.txt
+    сохраняются атомарно, так что прерванный обход не теряет уже скачанное.
+    """
+    os.makedirs(pages_dir, exist_ok=True)
+    manifest = load_manifest(manifest_file)
+    limiter = HostLimiter(per_host, rate)
+    stats = {"downloaded": 0, "not_modified": 0, "errors": 0}
+    index_lines = {}
+    queue = asyncio.Queue(maxsize=2 * concurrency)
+    processed = 0
+
+    def checkpoint():
+        write_page(index_file, "\n".join(index_lines[i] for i in sorted(index_lines)))
+        save_manifest(manifest_file, manifest)
+
+    async def process(i, url):
+        filename = f"{i}.html"
+        filepath = os.path.join(pages_dir, filename)
+        try:
+            status, text, headers = await fetch(
+                session, limiter, url, manifest.get(url), filepath, retries, backoff)
+            if status != 304:
+                write_page(filepath, text)
+        except Exception as e:
+            stats["errors"] += 1
+            print(f"Error: {url} -> {e}")
+            return
+
+        if status == 304:
+            stats["not_modified"] += 1
+        else:
+            manifest[url] = {
+                "file": filename,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+            }
+            stats["downloaded"] += 1
+        index_lines[i] = f"{filename} {url}"
+
+    async def worker():
+        nonlocal processed
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            await process(*item)
+            processed += 1
+            if processed % checkpoint_every == 0:
+                checkpoint()
+
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        for item in enumerate(urls, start=1):
+            await queue.put(item)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+    checkpoint()
+    return stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Конкурентный краулер с условными запросами")
+    parser.add_argument("--urls", default=URLS_FILE)
+    parser.add_argument("--pages-dir", default=PAGES_DIR)
+    parser.add_argument("--index", default=INDEX_FILE)
+    parser.add_argument("--manifest", default=MANIFEST_FILE)
+    parser.add_argument("--concurrency", type=int, default=64, help="всего соединений")
+    parser.add_argument("--per-host", type=int, default=4, help="соединений на один хост")
+    parser.add_argument("--rate", type=float, default=0.0, help="запросов в секунду на хост (0 — без ограничения)")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--backoff", type=float, default=0.5, help="начальная задержка повтора, с")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--checkpoint", type=int, default=CHECKPOINT_EVERY,
+                        help="сохранять манифест и index.txt каждые N URL")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    started = time.perf_counter()
+    with open(args.urls, "r", encoding="utf-8") as f:
+        urls = (line.strip() for line in f if line.strip())
+        stats = asyncio.run(crawl(
+            urls, args.pages_dir, args.index, args.manifest,
+            concurrency=args.concurrency, per_host=args.per_host, rate=args.rate,
+            retries=args.retries, backoff=args.backoff, timeout=args.timeout,
+            checkpoint_every=args.checkpoint))
+
+    print(f"Скачано: {stats['downloaded']}, не изменилось: {stats['not_modified']}, "
+          f"ошибок: {stats['errors']} за {time.perf_counter() - started:.1f} с")
@@ -0,0 +1,143 @@
+import sys
+import time
+import argparse
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+from vector_search import TFIDF_LEMMAS_DIR, lemmatizer, clean_and_lemmatize, load_url_map
+from term_vectors import CompactVectors
+
+TOP_K = 15
+# Сколько ячеек плотной матрицы «запросы × документы» держать в памяти за раз
+BATCH_CELLS = 1 << 24
+
+
+class SparseEngine:
+    """Матрица документ × лемма в формате CSR с L2-нормированными строками.
+
+    Запросы пакета собираются в такую же матрицу, и косинусы всех запросов со всеми документами
+    считаются одним разреженным произведением. Значения совпадают с vector_search
+    с точностью до округления (другой порядок суммирования).
+    """
+
+    def __init__(self, vectors):
+        self.terms = vectors.terms
+        self.idf = np.array(vectors.idf, dtype=np.float64)
+        self.doc_ids = vectors.doc_ids
+        # Место doc_id среди всех doc_id как строк: при равном score порядок тот же, что у кортежей
+        # (score, doc_id) в VectorIndex.top_k
+        self.doc_order = np.empty(len(self.doc_ids), dtype=np.int64)
+        self.doc_order[np.argsort(np.array(self.doc_ids, dtype=str), kind="stable")] = np.arange(len(self.doc_ids))
+
+        # Массивы CompactVectors уже лежат подряд: CSR собирается без поэлементного копирования в Python
+        indptr = np.zeros(len(vectors) + 1, dtype=np.int64)
+        np.cumsum([len(vector) for vector in vectors.vectors], out=indptr[1:])
+        indices = np.concatenate([np.frombuffer(v.term_ids, dtype=np.uint32) for v in vectors.vectors]
+                                 or [np.zeros(0, dtype=np.uint32)]).astype(np.int32)
+        data = np.concatenate([np.frombuffer(v.weights, dtype=np.float64) for v in vectors.vectors]
+                              or [np.zeros(0)])
+        matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(self.doc_ids), len(self.terms)))
+        matrix.sort_indices()
+        self.matrix = normalize_rows(matrix)
+        # Для произведения Q · Dᵀ транспонированная матрица нужна в CSR
+        self.matrix_t = self.matrix.T.tocsr()
+
+    def query_matrix(self, queries):
+        """Пакет запросов → CSR-матрица TF-IDF весов (TF — доля леммы в запросе, как в query_to_vector)"""
+        indptr = [0]
+        indices, data = [], []
+        for query in queries:
+            lemmas = clean_and_lemmatize(query)
+            for lemma, count in Counter(lemmas).items():
+                term_id = self.terms.get(lemma)
+                if term_id is not None:
+                    indices.append(term_id)
+                    data.append(count / len(lemmas))
+            indptr.append(len(indices))
+        indices = np.array(indices, dtype=np.int32)
+        data = np.array(data, dtype=np.float64) * self.idf[indices]
+        matrix = sparse.csr_matrix((data, indices, np.array(indptr, dtype=np.int64)),
+                                   shape=(len(queries), len(self.terms)))
+        return normalize_rows(matrix)
+
+    def search_batch(self, queries, k=TOP_K):
+        """Для каждого запроса — до k пар (score, doc_id) с положительным score, по убыванию score"""
+        q_matrix = self.query_matrix(queries)
+        n_docs = len(self.doc_ids)
+        k = min(k, n_docs)
+        rows_per_chunk = max(1, BATCH_CELLS // max(n_docs, 1))
+        results = []
+        for start in range(0, len(queries), rows_per_chunk):
+            scores = (q_matrix[start:start + rows_per_chunk] @ self.matrix_t).toarray()
+            results.extend(self._top_k(scores, k))
+        return results
+
+    def _top_k(self, scores, k):
+        """По убыванию score, при равенстве — по убыванию doc_id, как sorted(heap, reverse=True) в vector_search.
+
+        argpartition взял бы из документов с равным k-м score случайные, поэтому берутся все документы
+        не ниже k-го score, и среди них k лучших выбираются по тому же правилу.
+        """
+        if k <= 0:
+            return [[] for _ in range(len(scores))]
+        n_docs = scores.shape[1]
+        kth = np.partition(scores, n_docs - k, axis=1)[:, n_docs - k]
+        results = []
+        for row, threshold in zip(scores, kth):
+            cols = np.flatnonzero(row >= threshold) if threshold > 0 else np.flatnonzero(row > 0)
+            cols = cols[np.lexsort((-self.doc_order[cols], -row[cols]))[:k]]
+            results.append([(score, self.doc_ids[col]) for score, col in zip(row[cols].tolist(), cols.tolist())])
+        return results
+
+
+def normalize_rows(matrix):
+    """Делит каждую строку CSR-матрицы на её L2-норму; нулевые строки остаются нулевыми"""
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms) @ matrix
+
+
+def load_engine():
+    return SparseEngine(CompactVectors.from_dir(TFIDF_LEMMAS_DIR))
+
+
+def read_queries(path):
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        return [line.strip() for line in stream if line.strip()]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пакетный векторный поиск: все запросы одним произведением матриц")
+    parser.add_argument("queries", nargs="?", default="-", help="файл с запросами, по одному в строке (по умолчанию stdin)")
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--output", default="-", help="куда писать результаты в TSV (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    queries = read_queries(args.queries)
+    started = time.perf_counter()
+    engine = load_engine()
+    loaded = time.perf_counter()
+    results = engine.search_batch(queries, args.top_k)
+    finished = time.perf_counter()
+    url_map = load_url_map()
+
+    # Формат: номер запроса, ранг, документ, score, URL
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        for query_no, hits in enumerate(results, 1):
+            for rank, (score, doc_id) in enumerate(hits, 1):
+                out.write(f"{query_no}\t{rank}\t{doc_id}\t{score:.6f}\t{url_map.get(doc_id, f'pages/{doc_id}.html')}\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    lemmatizer.save()
+
+    elapsed = finished - loaded
+    print(f"Загрузка матрицы: {(loaded - started) * 1000:.1f} мс; {len(queries)} запросов за {elapsed * 1000:.1f} мс "
+          f"({len(queries) / elapsed if elapsed else 0:.0f} запросов/с)", file=sys.stderr)
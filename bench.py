@@ -0,0 +1,305 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import subprocess
+from itertools import accumulate
+
+import indexer
+import vector_search
+import boolean_search
+from lemmatizer import Lemmatizer, LOOKUP_FILE
+from binary_index import INDEX_BIN, BinaryIndex
+from text_utils import STOP_WORDS, clean_html, page_tokens, index_tokens
+from bitmap import Bitmap
+from metrics import peak_rss_mb
+
+BENCH_DIR = "bench_corpus"
+CORPUS_FILE = "corpus.json"
+RESULTS_FILE = "bench_results.json"
+BASELINE_FILE = "bench_baseline.json"
+# Замедление больше чем на 20% и больше чем на MIN_DELTA секунд считается регрессией
+THRESHOLD = 0.2
+MIN_DELTA = 0.005
+ZIPF_EXPONENT = 1.07
+# Сколько самых частых слов словаря — стоп-слова
+N_STOP_WORDS = 50
+
+CONSONANTS = "бвгджзклмнпрстфхцчшщ"
+VOWELS = "аеиоуыяю"
+# Окончания «как у» существительных, прилагательных и глаголов — у каждой основы несколько словоформ
+PARADIGMS = (
+    ("", "а", "у", "ом", "е", "ы", "ов", "ам", "ами", "ах"),
+    ("ый", "ая", "ое", "ого", "ому", "ым", "ой", "ую", "ые", "ых"),
+    ("ать", "аю", "ает", "ают", "ал", "ала", "али", "ающий"),
+)
+
+
+def make_vocabulary(size, rng):
+    """Основы из случайных слогов, у каждой — парадигма окончаний; стоп-слова занимают верх частотного списка"""
+    stems = set()
+    words = []
+    while len(words) < size:
+        stem = "".join(rng.choice(CONSONANTS) + rng.choice(VOWELS) for _ in range(rng.randint(2, 3)))
+        stem += rng.choice(CONSONANTS)
+        if stem not in stems:
+            stems.add(stem)
+            words.append((stem, rng.choice(PARADIGMS)))
+    stop_words = sorted(w for w in STOP_WORDS if w.isalpha() and w[0] >= "а")
+    rng.shuffle(stop_words)
+    return [(w, ("",)) for w in stop_words[:N_STOP_WORDS]] + words
+
+
+def zipf_weights(n):
+    return list(accumulate(1 / rank ** ZIPF_EXPONENT for rank in range(1, n + 1)))
+
+
+def sample_words(vocabulary, cum_weights, k, rng):
+    return [stem + rng.choice(endings) for stem, endings in rng.choices(vocabulary, cum_weights=cum_weights, k=k)]
+
+
+def make_page(vocabulary, cum_weights, n_words, rng):
+    words = sample_words(vocabulary, cum_weights, n_words, rng)
+    paragraphs = []
+    for start in range(0, len(words), 60):
+        paragraphs.append(f"<p class=\"text\">{' '.join(words[start:start + 60])}</p>")
+    title = " ".join(words[:6])
+    return (f"<!DOCTYPE html><html><head><title>{title}</title>"
+            f"<style>.text {{ margin: 0 }}</style>"
+            f"<script>window.data = {{id: {rng.randint(0, 10 ** 9)}}};</script></head>"
+            f"<body><h1>{title}</h1><!-- {words[-1]} -->{''.join(paragraphs)}</body></html>\n")
+
+
+def generate_corpus(directory, n_docs, vocab_size, doc_words, seed):
+    """Пишет pages/1.html … pages/N.html и index.txt; при тех же параметрах корпус переиспользуется"""
+    params = {"docs": n_docs, "vocab": vocab_size, "doc_words": doc_words, "seed": seed}
+    corpus_file = os.path.join(directory, CORPUS_FILE)
+    if os.path.exists(corpus_file):
+        with open(corpus_file, encoding="utf-8") as f:
+            if json.load(f) == params:
+                return False
+        shutil.rmtree(directory)
+
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocab_size, rng)
+    cum_weights = zipf_weights(len(vocabulary))
+    pages_dir = os.path.join(directory, indexer.PAGES_DIR)
+    os.makedirs(pages_dir)
+    with open(os.path.join(directory, vector_search.INDEX_TXT), "w", encoding="utf-8") as index_file:
+        for doc_id in range(1, n_docs + 1):
+            # Длины документов — логнормальные вокруг doc_words
+            n_words = max(10, int(rng.lognormvariate(0, 0.5) * doc_words))
+            with open(os.path.join(pages_dir, f"{doc_id}.html"), "w", encoding="utf-8") as f:
+                f.write(make_page(vocabulary, cum_weights, n_words, rng))
+            index_file.write(f"{doc_id}.html https://bench.example/{doc_id}\n")
+    with open(corpus_file, "w", encoding="utf-8") as f:
+        json.dump(params, f)
+    return True
+
+
+def make_queries(n, vocab_size, seed):
+    """Булевы и векторные запросы из того же словаря и с тем же ципфовским распределением, без стоп-слов"""
+    vocabulary = make_vocabulary(vocab_size, random.Random(seed))[N_STOP_WORDS:]
+    rng = random.Random(seed + 1)
+    cum_weights = zipf_weights(len(vocabulary))
+    boolean, vector = [], []
+    for _ in range(n):
+        a, b, c = sample_words(vocabulary, cum_weights, 3, rng)
+        boolean.append(rng.choice((f"{a} and {b}", f"{a} or {b}", f"{a} and not {b}", f"({a} or {b}) and {c}")))
+        vector.append(" ".join(sample_words(vocabulary, cum_weights, rng.randint(1, 4), rng)))
+    return boolean, vector
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+
+    def at(p):
+        return latencies[min(len(latencies) - 1, max(0, round(p / 100 * len(latencies)) - 1))]
+
+    return {"n": len(latencies), "mean_ms": sum(latencies) / len(latencies) * 1000,
+            "p50_ms": at(50) * 1000, "p90_ms": at(90) * 1000, "p99_ms": at(99) * 1000, "max_ms": latencies[-1] * 1000}
+
+
+class Stages:
+    """Время и пик памяти по этапам"""
+
+    def __init__(self, n_docs):
+        self.n_docs = n_docs
+        self.results = {}
+
+    def record(self, name, seconds):
+        own, children = peak_rss_mb()
+        self.results[name] = {"seconds": seconds, "per_doc_us": seconds / self.n_docs * 1e6,
+                              "peak_rss_mb": own, "children_peak_rss_mb": children}
+        print(f"  {name:<16}{seconds:>10.3f} с{seconds / self.n_docs * 1e6:>12.1f} мкс/док.{own:>10.1f} МБ")
+
+    def run(self, name, func, *args, **kwargs):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.record(name, time.perf_counter() - started)
+        return result
+
+
+def text_stages(stages, pages_dir):
+    """clean_html, токенизация и лемматизация, каждая со своим счётчиком времени, за один проход по страницам"""
+    lemmatizer = Lemmatizer(cache_file="")
+    timings = {"read_html": 0.0, "clean_html": 0.0, "tokenize": 0.0, "lemmatize": 0.0}
+    counts = {"tokens": 0, "html_bytes": 0}
+    clock = time.perf_counter
+    for _, path in indexer.page_files(pages_dir):
+        t0 = clock()
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        t1 = clock()
+        text = clean_html(html)
+        t2 = clock()
+        tokens = page_tokens(text) + index_tokens(text)
+        t3 = clock()
+        for token in tokens:
+            lemmatizer(token)
+        t4 = clock()
+        timings["read_html"] += t1 - t0
+        timings["clean_html"] += t2 - t1
+        timings["tokenize"] += t3 - t2
+        timings["lemmatize"] += t4 - t3
+        counts["tokens"] += len(tokens)
+        counts["html_bytes"] += len(html)
+    for name, seconds in timings.items():
+        stages.record(name, seconds)
+    counts["unique_tokens"] = len(lemmatizer.lemmas)
+    counts["lemmatizer_misses"] = lemmatizer.misses
+    return counts
+
+
+def time_queries(search, queries):
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        search(query)
+        latencies.append(time.perf_counter() - started)
+    return percentiles(latencies)
+
+
+def run_benchmark(args):
+    generated = generate_corpus(args.dir, args.docs, args.vocab, args.doc_words, args.seed)
+    print(f"Корпус {args.dir}: {args.docs} документов ({'сгенерирован' if generated else 'уже был'})")
+    boolean_queries, vector_queries = make_queries(args.queries, args.vocab, args.seed)
+
+    # Все артефакты — внутри каталога корпуса: скрипты проекта работают с относительными путями
+    home = os.getcwd()
+    os.chdir(args.dir)
+    try:
+        stages = Stages(args.docs)
+        print(f"  {'этап':<16}{'время':>12}{'на документ':>21}{'пик RSS':>13}")
+        counts = text_stages(stages, indexer.PAGES_DIR)
+
+        for directory in (indexer.TFIDF_TERMS_DIR, indexer.TFIDF_LEMMAS_DIR):
+            os.makedirs(directory, exist_ok=True)
+        results = stages.run("analyze", indexer.analyze_pages, indexer.PAGES_DIR, args.workers,
+                             lemmatizer=Lemmatizer(cache_file=""))
+        indexer.write_lemma_lookup(results, ".")
+        stages.run("tfidf", indexer.write_tfidf_files, results, ".")
+        stages.run("build_index", indexer.write_inverted_index, results, ".", json_export=False)
+        del results
+
+        stages.run("load_tfidf_data", vector_search.load_tfidf_data)
+        index = stages.run("load_index", vector_search.load_index)
+        url_map = vector_search.load_url_map()
+        # Словоформы корпуса — в словарь лемматизаторов запросов, как после indexer.py
+        for module in (vector_search, boolean_search):
+            module.lemmatizer.load_lookup(LOOKUP_FILE)
+
+        binary = BinaryIndex(INDEX_BIN)
+        universe = Bitmap.from_sorted(binary.doc_ids)
+        queries = {
+            "boolean": time_queries(lambda q: boolean_search.search(binary, universe, q), boolean_queries),
+            "vector": time_queries(lambda q: index.search_top_k(q, url_map, vector_search.TOP_K), vector_queries),
+        }
+        binary.close()
+    finally:
+        os.chdir(home)
+
+    for name, dist in queries.items():
+        print(f"  запросы {name:<8} p50 {dist['p50_ms']:.2f} мс, p90 {dist['p90_ms']:.2f} мс, "
+              f"p99 {dist['p99_ms']:.2f} мс, макс. {dist['max_ms']:.2f} мс")
+    return {"meta": meta(args), "counts": counts, "stages": stages.results, "queries": queries}
+
+
+def meta(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"docs": args.docs, "vocab": args.vocab, "doc_words": args.doc_words, "seed": args.seed,
+            "queries": args.queries, "workers": args.workers, "commit": commit,
+            "python": platform.python_version(), "platform": platform.platform(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def metrics(results):
+    """Плоский список сравниваемых величин (в секундах): этапы и перцентили задержек запросов"""
+    values = {f"stage.{name}": stage["seconds"] for name, stage in results["stages"].items()}
+    for name, dist in results["queries"].items():
+        for p in ("p50_ms", "p99_ms"):
+            values[f"query.{name}.{p[:-3]}"] = dist[p] / 1000
+    return values
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """Печатает сравнение с базой и возвращает список регрессий"""
+    keys = ("docs", "vocab", "doc_words", "seed", "queries")
+    if any(results["meta"][k] != baseline["meta"].get(k) for k in keys):
+        print("Параметры базы отличаются от текущего прогона — сравнение не имеет смысла")
+        return []
+    current, old = metrics(results), metrics(baseline)
+    regressions = []
+    print(f"\n  {'величина':<26}{'база, с':>12}{'сейчас, с':>12}{'изменение':>12}")
+    for name, value in current.items():
+        if name not in old:
+            continue
+        before = old[name]
+        change = (value - before) / before if before else 0.0
+        slower = change > threshold and value - before > MIN_DELTA
+        if slower:
+            regressions.append(name)
+        print(f"  {name:<26}{before:>12.4f}{value:>12.4f}{change * 100:>+11.1f}%{'  РЕГРЕССИЯ' if slower else ''}")
+    return regressions
+
+
+def save_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов индексации и поиска на синтетическом корпусе")
+    parser.add_argument("--docs", type=int, default=1000, help="документов в корпусе (1k … 1M)")
+    parser.add_argument("--vocab", type=int, default=20000, help="основ в словаре")
+    parser.add_argument("--doc-words", type=int, default=300, help="средняя длина документа в словах")
+    parser.add_argument("--queries", type=int, default=500, help="запросов каждого вида")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="процессов для indexer.analyze_pages")
+    parser.add_argument("--dir", default=BENCH_DIR, help="каталог корпуса и артефактов")
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="с чем сравнивать результаты")
+    parser.add_argument("--save-baseline", action="store_true", help="записать результаты как новую базу")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="допустимое замедление (доля)")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    save_json(args.output, results)
+    print(f"Результаты записаны в {args.output}")
+    if args.save_baseline:
+        save_json(args.baseline, results)
+        print(f"База записана в {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"Регрессии: {', '.join(regressions)}")
+            sys.exit(1)
@@ -0,0 +1,378 @@
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import shutil
+import argparse
+import tempfile
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from operator import sub
+
+INDEX_BIN = "inverted_index.bin"
+INDEX_JSON = "inverted_index.json"
+
+# Формат inverted_index.bin (всё little-endian, секции выровнены по 8 байт):
+#   заголовок HEADER
+#   doc_ids        — uint32[n_docs], отсортированные номера документов
+#   term_offsets   — uint64[n_terms + 1], смещения терминов в term_blob
+#   post_offsets   — uint64[n_terms + 1], смещения списков в post_blob
+#   doc_freqs      — uint32[n_terms]
+#   term_blob      — UTF-8 термины подряд, в порядке возрастания
+#   post_blob      — списки документов: разности соседних номеров в varint
+# Версия 2 добавляет позиции лемм (секции нулевые, если индекс собран без позиций):
+#   pos_offsets    — uint64[n_terms + 1], смещения позиций терминов в pos_blob
+#   pos_blob       — для каждого документа из списка термина: длина записи в байтах (varint),
+#                    ширина разностей (1, 2 или 4 байта), разности соседних позиций этой ширины;
+#                    по длине записи документы пропускаются без декодирования
+MAGIC = b"BIDX"
+VERSION = 2
+HEADER = struct.Struct("<4sIIIQQQQQQQQ")
+HEADER_V1 = struct.Struct("<4sIIIQQQQQQ")
+# Буфер копирования секций из временных файлов
+COPY_BUFFER = 1 << 20
+
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_postings(doc_ids):
+    """Разности соседних номеров документов (первый — сам номер) в varint"""
+    out = bytearray()
+    prev = 0
+    for doc_id in doc_ids:
+        encode_varint(doc_id - prev, out)
+        prev = doc_id
+    return out
+
+
+def decode_postings(buf, count):
+    """Список номеров документов в array('I'): 4 байта на номер вместо объекта int в списке"""
+    result = array("I", bytes(4 * count))
+    value = shift = pos = 0
+    prev = 0
+    for i in range(count):
+        while True:
+            byte = buf[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        prev += value
+        result[i] = prev
+        value = shift = 0
+    return result
+
+
+def read_varint(buf, pos):
+    """Число varint из buf начиная с pos и позиция за ним"""
+    value = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+# Ширина разности позиций в байтах → код типа array
+POSITION_WIDTHS = {1: "B", 2: "H", 4: "I"}
+
+
+def encode_positions(positions, out):
+    """Запись позиций одного документа: длина в байтах (varint), ширина разностей, разности.
+
+    Разности одной ширины (1, 2 или 4 байта на запись) декодируются целиком в C, а не по байту,
+    как varint; ширина выбирается по самой большой разности записи.
+    """
+    if len(positions) == 1:
+        deltas = positions
+    else:
+        deltas = [positions[0]]
+        deltas += map(sub, positions[1:], positions[:-1])
+    top = max(deltas)
+    width = 1 if top < 0x100 else 2 if top < 0x10000 else 4
+    data = array(POSITION_WIDTHS[width], deltas)
+    if sys.byteorder != "little":
+        data.byteswap()
+    encode_varint(1 + len(data) * width, out)
+    out.append(width)
+    out += data.tobytes()
+
+
+def decode_positions(buf):
+    return array("I", accumulate(array(POSITION_WIDTHS[buf[0]], buf[1:])))
+
+
+def _pad(f):
+    f.write(b"\0" * (-f.tell() % 8))
+
+
+def write_binary_index(path, index, all_doc_ids, positions=None):
+    """Пишет индекс {термин: [номера документов]} в компактный бинарный формат.
+
+    positions — {термин: {номер документа (int): [позиции по возрастанию]}} для фраз и NEAR
+    """
+    writer = BinaryIndexWriter(path, all_doc_ids, positions is not None)
+    for term in sorted(index):
+        postings = sorted({int(d) for d in index[term]})
+        term_positions = None
+        if positions is not None:
+            term_positions = bytearray()
+            for doc_id in postings:
+                encode_positions(positions[term][doc_id], term_positions)
+        writer.add(term, postings, term_positions)
+    writer.close()
+
+
+class BinaryIndexWriter:
+    """Пишет inverted_index.bin по одному термину в порядке возрастания.
+
+    Словарь, списки и позиции копятся во временных файлах рядом с индексом, в памяти — только массивы
+    смещений (по 8 байт на термин), так что размер индекса не ограничен памятью.
+    """
+
+    def __init__(self, path, all_doc_ids, with_positions=False):
+        self.path = path
+        self.doc_ids = array("I", sorted(int(d) for d in all_doc_ids))
+        self.term_offsets = array("Q", [0])
+        self.post_offsets = array("Q", [0])
+        self.doc_freqs = array("I")
+        self.pos_offsets = array("Q", [0]) if with_positions else None
+        directory = os.path.dirname(path) or "."
+        self._blobs = [tempfile.TemporaryFile(dir=directory) for _ in range(3 if with_positions else 2)]
+
+    def add(self, term, postings, positions=None):
+        """postings — номера документов по возрастанию; positions — их записи encode_positions подряд"""
+        key = term.encode("utf-8")
+        data = encode_postings(postings)
+        self._blobs[0].write(key)
+        self._blobs[1].write(data)
+        self.term_offsets.append(self.term_offsets[-1] + len(key))
+        self.post_offsets.append(self.post_offsets[-1] + len(data))
+        self.doc_freqs.append(len(postings))
+        if self.pos_offsets is not None:
+            self._blobs[2].write(positions)
+            self.pos_offsets.append(self.pos_offsets[-1] + len(positions))
+
+    def close(self):
+        arrays = [self.doc_ids, self.term_offsets, self.post_offsets, self.doc_freqs]
+        if self.pos_offsets is not None:
+            arrays.append(self.pos_offsets)
+        if sys.byteorder != "little":
+            for arr in arrays:
+                arr.byteswap()
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"\0" * HEADER.size)
+            sections = []
+            for data in arrays[:4] + self._blobs[:2]:
+                _pad(f)
+                sections.append(f.tell())
+                _write_section(f, data)
+            if self.pos_offsets is None:
+                sections += [0, 0]
+            else:
+                for data in (self.pos_offsets, self._blobs[2]):
+                    _pad(f)
+                    sections.append(f.tell())
+                    _write_section(f, data)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.doc_ids), len(self.doc_freqs), *sections))
+        os.replace(tmp_path, self.path)
+
+
+def _write_section(f, data):
+    """Массив, байты или временный файл с содержимым секции"""
+    if isinstance(data, (array, bytes, bytearray)):
+        f.write(data)
+        return
+    data.seek(0)
+    shutil.copyfileobj(data, f, COPY_BUFFER)
+    data.close()
+
+
+class BinaryIndex:
+    """Инвертированный индекс поверх mmap: открывается за O(1), списки декодируются по запросу"""
+
+    def __init__(self, path=INDEX_BIN):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = struct.unpack_from("<4sI", self._mm, 0)
+        if magic != MAGIC or version not in (1, VERSION):
+            raise ValueError(f"{path}: неизвестный формат индекса")
+        # Индекс версии 1 — без позиций
+        header = HEADER if version == VERSION else HEADER_V1
+        magic, version, n_docs, n_terms, *sections = header.unpack_from(self._mm, 0)
+        pos_offsets_at, self._pos_at = sections[6:] if version == VERSION else (0, 0)
+        if sys.byteorder != "little":
+            raise ValueError("Бинарный индекс читается только на little-endian машинах")
+
+        view = memoryview(self._mm)
+        doc_ids_at, term_offsets_at, post_offsets_at, doc_freqs_at, self._terms_at, self._post_at = sections[:6]
+        self.doc_ids = view[doc_ids_at:doc_ids_at + 4 * n_docs].cast("I")
+        self._term_offsets = view[term_offsets_at:term_offsets_at + 8 * (n_terms + 1)].cast("Q")
+        self._post_offsets = view[post_offsets_at:post_offsets_at + 8 * (n_terms + 1)].cast("Q")
+        self._doc_freqs = view[doc_freqs_at:doc_freqs_at + 4 * n_terms].cast("I")
+        self._n_terms = n_terms
+        self.has_positions = bool(pos_offsets_at)
+        self._pos_offsets = (view[pos_offsets_at:pos_offsets_at + 8 * (n_terms + 1)].cast("Q")
+                             if self.has_positions else None)
+
+    def __len__(self):
+        return self._n_terms
+
+    def term(self, i):
+        return self._term_bytes(i).decode("utf-8")
+
+    def _term_bytes(self, i):
+        return self._mm[self._terms_at + self._term_offsets[i]:self._terms_at + self._term_offsets[i + 1]]
+
+    def find(self, term):
+        """Номер термина в словаре (двоичный поиск) или -1"""
+        key = term.encode("utf-8")
+        terms = _TermKeys(self)
+        i = bisect_left(terms, key)
+        if i < self._n_terms and self._term_bytes(i) == key:
+            return i
+        return -1
+
+    def postings_at(self, i):
+        start = self._post_at + self._post_offsets[i]
+        end = self._post_at + self._post_offsets[i + 1]
+        return decode_postings(self._mm[start:end], self._doc_freqs[i])
+
+    def doc_freq(self, term):
+        i = self.find(term)
+        return self._doc_freqs[i] if i >= 0 else 0
+
+    def get(self, term, default=None):
+        i = self.find(term)
+        return self.postings_at(i) if i >= 0 else default
+
+    def __contains__(self, term):
+        return self.find(term) >= 0
+
+    def positions(self, term, doc_ids):
+        """Позиции термина в документах doc_ids (по возрастанию): {номер: array('I')}.
+
+        Записи остальных документов пропускаются по длине, их позиции не декодируются.
+        """
+        result = {}
+        i = self.find(term)
+        if i < 0 or not doc_ids:
+            return result
+        if not self.has_positions:
+            raise ValueError("индекс собран без позиций — перестройте его")
+        mm = self._mm
+        pos = self._pos_at + self._pos_offsets[i]
+        wanted = iter(doc_ids)
+        want = next(wanted)
+        for doc_id in self.postings_at(i):
+            while want < doc_id:
+                want = next(wanted, None)
+                if want is None:
+                    return result
+            length, pos = read_varint(mm, pos)
+            if doc_id == want:
+                result[doc_id] = decode_positions(mm[pos:pos + length])
+            pos += length
+        return result
+
+    def terms(self):
+        return (self.term(i) for i in range(self._n_terms))
+
+    def items(self):
+        return ((self.term(i), self.postings_at(i)) for i in range(self._n_terms))
+
+    def close(self):
+        for arr in (self.doc_ids, self._term_offsets, self._post_offsets, self._doc_freqs, self._pos_offsets):
+            if arr is not None:
+                arr.release()
+        self._mm.close()
+
+
+class _TermKeys:
+    """Последовательность байтовых ключей словаря для bisect без копирования словаря"""
+
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        return self._index._n_terms
+
+    def __getitem__(self, i):
+        return self._index._term_bytes(i)
+
+
+def export_json(index, json_path):
+    """Выгружает бинарный индекс в inverted_index.json (для отладки)"""
+    data = {
+        "index": {term: [str(d) for d in postings] for term, postings in index.items()},
+        "all_doc_ids": [str(d) for d in index.doc_ids],
+    }
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def convert_json(json_path, path):
+    with open(json_path, encoding="utf-8") as f:
+        data = json.load(f)
+    write_binary_index(path, data["index"], data["all_doc_ids"])
+
+
+def compare(json_path, path, query_terms):
+    """Сравнение размера и времени загрузки JSON и бинарного индекса"""
+    started = time.perf_counter()
+    with open(json_path, encoding="utf-8") as f:
+        data = json.load(f)
+    json_load = time.perf_counter() - started
+    started = time.perf_counter()
+    for term in query_terms:
+        set(data["index"].get(term, []))
+    json_lookup = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index = BinaryIndex(path)
+    bin_load = time.perf_counter() - started
+    started = time.perf_counter()
+    for term in query_terms:
+        set(index.get(term, []))
+    bin_lookup = time.perf_counter() - started
+    index.close()
+
+    print(f"{'':<10}{'размер, КБ':>12}{'загрузка, мс':>15}{'поиск ' + str(len(query_terms)) + ' терм., мс':>20}")
+    print(f"{'JSON':<10}{os.path.getsize(json_path) / 1024:>12.1f}{json_load * 1000:>15.2f}{json_lookup * 1000:>20.2f}")
+    print(f"{'binary':<10}{os.path.getsize(path) / 1024:>12.1f}{bin_load * 1000:>15.2f}{bin_lookup * 1000:>20.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бинарный инвертированный индекс")
+    parser.add_argument("--index", default=INDEX_BIN)
+    parser.add_argument("--json", default=INDEX_JSON)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--from-json", action="store_true", help="собрать бинарный индекс из JSON")
+    group.add_argument("--export-json", action="store_true", help="выгрузить бинарный индекс в JSON")
+    group.add_argument("--compare", nargs="*", metavar="TERM", help="сравнить размер и время загрузки")
+    args = parser.parse_args()
+
+    if args.from_json:
+        convert_json(args.json, args.index)
+        print(f"Записан {args.index}: {os.path.getsize(args.index) / 1024:.1f} КБ")
+    elif args.export_json:
+        binary = BinaryIndex(args.index)
+        export_json(binary, args.json)
+        binary.close()
+        print(f"Записан {args.json}")
+    else:
+        compare(args.json, args.index, args.compare or ["сочи", "олимпийский", "игра"])
@@ -0,0 +1,188 @@
+from array import array
+
+# Roaring-подобный битмап: номера документов делятся по старшим 16 битам на контейнеры,
+# контейнер — отсортированный array('H') младших битов (до ARRAY_LIMIT элементов)
+# или битовое множество на 65536 бит, хранящееся в Python int
+ARRAY_LIMIT = 4096
+CHUNK_BYTES = 65536 // 8
+
+
+def _bits_from_array(values):
+    buf = bytearray(CHUNK_BYTES)
+    for v in values:
+        buf[v >> 3] |= 1 << (v & 7)
+    return int.from_bytes(buf, "little")
+
+
+def _array_from_bits(bits):
+    result = array("H")
+    raw = bits.to_bytes(CHUNK_BYTES, "little")
+    for byte_no, byte in enumerate(raw):
+        if byte:
+            base = byte_no << 3
+            for bit in range(8):
+                if byte >> bit & 1:
+                    result.append(base | bit)
+    return result
+
+
+def _popcount(bits):
+    # int.bit_count() появился только в Python 3.10
+    return bin(bits).count("1")
+
+
+def _size(container):
+    return _popcount(container) if isinstance(container, int) else len(container)
+
+
+def _normalize(container):
+    """Выбирает представление контейнера по его заполненности; пустой контейнер — None"""
+    if isinstance(container, int):
+        n = _popcount(container)
+        if n == 0:
+            return None
+        return _array_from_bits(container) if n <= ARRAY_LIMIT else container
+    if not container:
+        return None
+    return _bits_from_array(container) if len(container) > ARRAY_LIMIT else container
+
+
+def _and(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return _normalize(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        return _normalize(array("H", [v for v in a if b >> v & 1]))
+    return _normalize(array("H", sorted(set(a).intersection(b))))
+
+
+def _or(a, b):
+    if isinstance(a, int) or isinstance(b, int) or len(a) + len(b) > ARRAY_LIMIT:
+        a = a if isinstance(a, int) else _bits_from_array(a)
+        b = b if isinstance(b, int) else _bits_from_array(b)
+        return _normalize(a | b)
+    return array("H", sorted(set(a).union(b)))
+
+
+def _andnot(a, b):
+    if isinstance(a, int):
+        b = b if isinstance(b, int) else _bits_from_array(b)
+        return _normalize(a & ~b)
+    if isinstance(b, int):
+        return _normalize(array("H", [v for v in a if not b >> v & 1]))
+    return _normalize(array("H", sorted(set(a).difference(b))))
+
+
+class Bitmap:
+    """Сжатое множество номеров документов с операциями AND / OR / AND NOT"""
+
+    __slots__ = ("containers",)
+
+    def __init__(self, containers=None):
+        self.containers = containers or {}
+
+    @classmethod
+    def from_sorted(cls, doc_ids):
+        """Строит битмап из возрастающей последовательности номеров"""
+        containers = {}
+        current_key = None
+        chunk = None
+        for doc_id in doc_ids:
+            key = doc_id >> 16
+            if key != current_key:
+                if chunk:
+                    containers[current_key] = _normalize(chunk)
+                current_key, chunk = key, array("H")
+            chunk.append(doc_id & 0xFFFF)
+        if chunk:
+            containers[current_key] = _normalize(chunk)
+        return cls(containers)
+
+    @classmethod
+    def from_iterable(cls, doc_ids):
+        return cls.from_sorted(sorted(int(d) for d in doc_ids))
+
+    def _combine(self, other, op, keys):
+        containers = {}
+        for key in keys:
+            container = op(self.containers.get(key), other.containers.get(key))
+            if container is not None:
+                containers[key] = container
+        return Bitmap(containers)
+
+    def __and__(self, other):
+        if isinstance(other, Complement):
+            return self - other.inner
+        keys = self.containers.keys() & other.containers.keys()
+        return self._combine(other, _and, keys)
+
+    def __or__(self, other):
+        if isinstance(other, Complement):
+            return Complement(other.inner - self)
+        keys = self.containers.keys() | other.containers.keys()
+        return self._combine(other, lambda a, b: b if a is None else a if b is None else _or(a, b), keys)
+
+    def __sub__(self, other):
+        def andnot(a, b):
+            return a if b is None else _andnot(a, b)
+        return self._combine(other, andnot, self.containers.keys())
+
+    def __invert__(self):
+        return Complement(self)
+
+    def __len__(self):
+        return sum(_size(c) for c in self.containers.values())
+
+    def __bool__(self):
+        return bool(self.containers)
+
+    def __contains__(self, doc_id):
+        container = self.containers.get(doc_id >> 16)
+        if container is None:
+            return False
+        low = doc_id & 0xFFFF
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        return low in container
+
+    def __iter__(self):
+        for key in sorted(self.containers):
+            container = self.containers[key]
+            if isinstance(container, int):
+                container = _array_from_bits(container)
+            base = key << 16
+            for low in container:
+                yield base | low
+
+    def to_list(self):
+        return list(self)
+
+    def materialize(self, universe):
+        return self
+
+
+class Complement:
+    """Ленивое дополнение битмапа до множества всех документов: само дополнение не строится"""
+
+    __slots__ = ("inner",)
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def __and__(self, other):
+        if isinstance(other, Complement):
+            return Complement(self.inner | other.inner)
+        return other - self.inner
+
+    def __or__(self, other):
+        if isinstance(other, Complement):
+            return Complement(self.inner & other.inner)
+        return Complement(self.inner - other)
+
+    def __invert__(self):
+        return self.inner
+
+    def materialize(self, universe):
+        """Превращает дополнение в обычный битмап — только для выдачи результата"""
+        return universe - self.inner
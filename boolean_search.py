@@ -1,159 +1,107 @@
 import os
-import json
 import re
-from collections import defaultdict
-import pymorphy2
+
+import metrics
+from lemmatizer import Lemmatizer, LOOKUP_FILE
+from binary_index import INDEX_BIN, BinaryIndex
+from text_utils import STOP_WORDS, index_token_positions
+from bitmap import Bitmap
+from query_cache import QueryCache, normalize_query
+import query_planner
+import segments
+import term_dict
+import snippets
 
 PAGES_DIR = "pages"
-INDEX_FILE = "inverted_index.json"
-
-morph = pymorphy2.MorphAnalyzer()
-
-
-STOP_WORDS = {
-    'и', 'в', 'во', 'не',
-    'что', 'он', 'на', 'я',
-    'с', 'со', 'как', 'а',
-    'то', 'все', 'она', 'так',
-    'его', 'но', 'да', 'ты',
-    'к', 'у', 'же', 'вы',
-    'за', 'бы', 'по',
-    'только', 'ее', 'мне',
-    'было', 'вот', 'от',
-    'меня', 'еще', 'нет', 'о',
-    'из', 'ему', 'теперь',
-    'когда', 'даже', 'ну',
-    'вдруг', 'ли', 'если',
-    'уже', 'или', 'ни',
-    'быть', 'был', 'него',
-    'до', 'вас', 'нибудь',
-    'опять', 'уж', 'вам',
-    'ведь', 'там', 'потом',
-    'себя', 'ничто', 'ей',
-    'может', 'они', 'тут',
-    'где', 'есть', 'надо',
-    'ней', 'для', 'мы',
-    'тебя', 'их', 'чем',
-    'была', 'сам', 'чтоб',
-    'без', 'будто', 'чего',
-    'раз', 'тоже', 'себе',
-    'под', 'будет', 'ж',
-    'тогда', 'кто', 'этот',
-    'того', 'потому', 'этого',
-    'какой', 'совсем', 'ним',
-    'здесь', 'этом', 'один',
-    'почти', 'мой', 'тем',
-    'чтобы', 'нее', 'сейчас',
-    'были', 'куда', 'зачем',
-    'всех', 'никогда',
-    'можно', 'при', 'наконец',
-    'два', 'об', 'другой',
-    'хоть', 'после', 'над',
-    'больше', 'тот', 'через',
-    'эти', 'нас', 'про',
-    'всего', 'них', 'какая',
-    'много', 'разве', 'три',
-    'эту', 'моя', 'впрочем',
-    'хорошо', 'свою', 'этой',
-    'перед', 'иногда',
-    'лучше', 'чуть', 'том',
-    'нельзя', 'такой', 'им',
-    'более', 'всегда',
-    'конечно', 'всю', 'между',
-    'the', 'and', 'or', 'but',
-    'if', 'in', 'on', 'at',
-    'to', 'of', 'for', 'with',
-    'by', 'from', 'as', 'is',
-    'are', 'was', 'were',
-    'be', 'have', 'has',
-    'had', 'do', 'does',
-    'did', 'this', 'that',
-    'these', 'those', 'it',
-    'its', 'their', 'our',
-    'we', 'you', 'he', 'she',
-    'they',
-    'amp', 'nbsp', 'hellip',
-    'ndash', 'mdash', 'laquo',
-    'raquo', 'quot', 'apos',
-    'lt', 'gt', 'http',
-    'https', 'www', 'com',
-    'ru', 'org', 'net', 'io',
-    'co', 'tv'
-}
-
-
-def clean_html(html):
-    """Хорошая очистка HTML"""
-    html = re.sub(r'<script.*?</script>|<style.*?</style>|<!--.*?-->', '', html, flags=re.DOTALL | re.I)
-    text = re.sub(r'<[^>]+>', ' ', html)
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
+
+# Словоформы корпуса лемматизируются по готовому словарю, pymorphy2 грузится только для новых слов
+lemmatizer = Lemmatizer(lookup_file=LOOKUP_FILE)
 
 
 def lemmatize(word):
-    return morph.parse(word)[0].normal_form
+    return lemmatizer(word)
 
 
-def tokenize(text):
-    tokens = re.findall(r'\b[а-яёa-z]{2,}\b', text.lower())
-    lemmas = []
-    for token in tokens:
-        if token in STOP_WORDS:
-            continue
-        lemma = lemmatize(token)
-        if lemma and lemma not in STOP_WORDS and len(lemma) >= 2:
-            lemmas.append(lemma)
-    return lemmas
+def index_generation():
+    """Поколение булева индекса: поколение манифеста сегментов, если они новее полной сборки,
+    или (mtime, размер) inverted_index.bin"""
+    if segments.is_active():
+        return segments.load_manifest(segments.SEGMENTS_DIR)["generation"]
+    if not os.path.exists(INDEX_BIN):
+        return None
+    stat = os.stat(INDEX_BIN)
+    return stat.st_mtime_ns, stat.st_size
 
 
 def build_index():
-    if os.path.exists(INDEX_FILE):
-        print(f" Индекс уже существует ({INDEX_FILE})")
-        with open(INDEX_FILE, encoding='utf-8') as f:
-            data = json.load(f)
-        return data['index'], data['all_doc_ids']
-
-    print("Строю инвертированный индекс...")
-
-    index = defaultdict(list)
-    all_doc_ids = []
-
-    for filename in sorted(os.listdir(PAGES_DIR)):
-        if not filename.endswith(".html"):
-            continue
-
-        doc_id = filename.replace(".html", "")
-        all_doc_ids.append(doc_id)
-
-        with open(os.path.join(PAGES_DIR, filename), encoding='utf-8') as f:
-            html = f.read()
-
-        text = clean_html(html)
-        lemmas = tokenize(text)
-
-        for lemma in set(lemmas):
-            index[lemma].append(doc_id)
-
-    for term in index:
-        index[term] = sorted(set(index[term]), key=int)
-
-    all_doc_ids = sorted(set(all_doc_ids), key=int)
-
-    data = {"index": dict(index), "all_doc_ids": all_doc_ids}
-
-    with open(INDEX_FILE, "w", encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-    print(f"Индекс создан: терминов={len(index):,}, документов={len(all_doc_ids)}")
-    return dict(index), all_doc_ids
-
-
-def tokenize_query(query):
-    tokens = re.findall(r'\(|\)|and|or|not|[а-яёa-z]+', query.lower())
+    """Готовый индекс: сегменты (python segments.py sync), если они новее inverted_index.bin, иначе
+    inverted_index.bin (python indexer.py). Страницы здесь не перечитываются — индекс обновляется
+    отдельным шагом. Источник выбирает segments.is_active, как и в vector_search.load_index."""
+    generation = index_generation()
+    if generation is None:
+        raise FileNotFoundError(f"Нет ни {segments.SEGMENTS_DIR}/, ни {INDEX_BIN}: соберите индекс "
+                                f"(python indexer.py или python segments.py sync)")
+    if isinstance(generation, int):
+        index = segments.SegmentedIndex(segments.SEGMENTS_DIR)
+        print(f"Индекс: поколение {index.generation}, сегментов={len(index.segments)}, документов={len(index.doc_ids)}")
+        return index, index.doc_ids
+    if segments.load_manifest(segments.SEGMENTS_DIR)["segments"]:
+        print(f"Сегменты в {segments.SEGMENTS_DIR}/ старше {INDEX_BIN} — используется полная сборка; "
+              f"чтобы вернуться к сегментам, выполните python segments.py sync")
+    index = BinaryIndex(INDEX_BIN)
+    index.generation = generation
+    print(f"Индекс: {INDEX_BIN}, документов={len(index.doc_ids)}")
+    return index, list(index.doc_ids)
+
+
+def open_texts(index):
+    """Тексты документов для сниппетов: у сегментов — их хранилища, к inverted_index.bin — doc_store.bin"""
+    return index if isinstance(index, segments.SegmentedIndex) else snippets.open_texts()
+
+
+def phrase_token(text):
+    """Фраза в кавычках → кортеж (лемма, смещение): слова считаются так же, как позиции при индексации"""
+    token_positions = {}
+    index_token_positions(text, token_positions)
+    phrase = []
+    for token, positions in token_positions.items():
+        lemma = lemmatize(token)
+        if lemma and lemma not in STOP_WORDS and len(lemma) >= 2:
+            phrase.extend((lemma, pos) for pos in positions)
+    phrase.sort(key=lambda item: item[1])
+    if not phrase:
+        return ()
+    # Смещения — от первого слова, попавшего в индекс
+    return tuple((lemma, pos - phrase[0][1]) for lemma, pos in phrase)
+
+
+def tokenize_query(query, dictionary=None, popularity=None):
+    """Леммы и операторы запроса; «"олимпийские игры"» — фраза, «a near/3 b» — не дальше 3 слов.
+
+    «олимп*», «*ский», «ол?мп» и «алимпийский~» (~1, ~2 — число опечаток) раскрываются по словарю лемм
+    dictionary (TermDictionary) в «(лемма or лемма …)»; popularity — какие леммы брать, если подходящих больше
+    MAX_EXPANSIONS. Шаблон, которому ничего не подошло, остаётся как есть и ничего не находит.
+    """
+    tokens = re.findall(r'"[^"]*"|\(|\)|\bnear/\d+|\b(?:and|or|not)\b|[а-яёa-z*?]*[а-яёa-z*](?:~\d?)?', query.lower())
     result = []
     for t in tokens:
-        if t in ("and", "or", "not", "(", ")"):
+        if t.startswith('"'):
+            phrase = phrase_token(t[1:-1])
+            if phrase:
+                result.append(phrase)
+        elif t in ("and", "or", "not", "(", ")") or t.startswith("near/"):
             result.append(t)
+        elif term_dict.is_pattern(t):
+            if dictionary is None:
+                raise ValueError(f"«{t}»: шаблоны и нечёткий поиск недоступны без словаря лемм")
+            lemmas = [lemma for lemma in dictionary.expand(t, popularity, lemmatize=lemmatize) if lemma not in STOP_WORDS]
+            if len(lemmas) > 1:
+                result.append("(")
+                for lemma in lemmas:
+                    result.extend((lemma, "or"))
+                result[-1] = ")"
+            else:
+                result.append(lemmas[0] if lemmas else t)
         else:
             lemma = lemmatize(t)
             if lemma and lemma not in STOP_WORDS:
@@ -161,8 +109,26 @@ def tokenize_query(query):
     return result
 
 
+def query_lemmas(query, index):
+    """Леммы запроса (и раскрытых шаблонов) для подсветки — без операторов"""
+    dictionary = term_dict.of(index) if term_dict.has_patterns(query) else None
+    lemmas = []
+    for token in tokenize_query(query, dictionary, index.doc_freq):
+        if isinstance(token, tuple):
+            lemmas.extend(lemma for lemma, _ in token)
+        elif token not in ("and", "or", "not", "(", ")") and not token.startswith("near/"):
+            lemmas.append(token)
+    return lemmas
+
+
+def precedence(token):
+    """Приоритет оператора (NEAR связывает сильнее всех) или 0 для операнда"""
+    if query_planner.near_distance(token) is not None:
+        return 4
+    return {"not": 3, "and": 2, "or": 1}.get(token, 0) if isinstance(token, str) else 0
+
+
 def shunting_yard(tokens):
-    precedence = {"not": 3, "and": 2, "or": 1}
     output = []
     stack = []
 
@@ -174,8 +140,8 @@ def shunting_yard(tokens):
                 output.append(stack.pop())
             if stack:
                 stack.pop()
-        elif token in precedence:
-            while stack and stack[-1] != "(" and precedence.get(stack[-1], 0) >= precedence[token]:
+        elif precedence(token):
+            while stack and stack[-1] != "(" and precedence(stack[-1]) >= precedence(token):
                 output.append(stack.pop())
             stack.append(token)
         else:
@@ -187,49 +153,87 @@ def shunting_yard(tokens):
     return output
 
 
-def evaluate_rpn(rpn, index, universe):
-    stack = []
-    for token in rpn:
-        if token not in ("and", "or", "not"):
-            stack.append(set(index.get(token, [])))
-        elif token == "not":
-            operand = stack.pop()
-            stack.append(universe - operand)
-        elif token == "and":
-            right = stack.pop()
-            left = stack.pop()
-            stack.append(left & right)
-        elif token == "or":
-            right = stack.pop()
-            left = stack.pop()
-            stack.append(left | right)
-    return sorted(stack[0], key=int) if stack else []
-
-
-def search(index, universe, query):
+def search(index, universe, query, show_plan=False, cache=None):
     if not query.strip():
         return []
-    tokens = tokenize_query(query)
-    rpn = shunting_yard(tokens)
-    results = evaluate_rpn(rpn, index, universe)
-    return results
+    # Словарь лемм строится при первом запросе с шаблоном и живёт, пока жив объект индекса
+    dictionary = term_dict.of(index) if term_dict.has_patterns(query) else None
+    if cache is None:
+        with metrics.timer("boolean.parse"):
+            tokens = tokenize_query(query, dictionary, index.doc_freq)
+            rpn = shunting_yard(tokens)
+        return query_planner.run(rpn, index, universe, show_plan)
+
+    # Кеш действителен только для того поколения индекса, по которому он заполнен
+    cache.sync(getattr(index, "generation", None))
+    text = normalize_query(query)
+    parsed = cache.parsed.get(text)
+    if parsed is None:
+        with metrics.timer("boolean.parse"):
+            rpn = shunting_yard(tokenize_query(query, dictionary, index.doc_freq))
+            tree = query_planner.build_tree(rpn)
+            parsed = (query_planner.canonical(tree) if tree is not None else "", rpn)
+        cache.parsed.put(text, parsed)
+    key, rpn = parsed
+    # Словоформы одного запроса приводят к одному ключу: «клеопатры and цезаря» = «цезарь and клеопатра»
+    results = None if show_plan else cache.results.get(key)
+    if results is None:
+        metrics.count("query_cache_misses")
+        results = query_planner.run(rpn, index, universe, show_plan, cache.subresults)
+        cache.results.put(key, results)
+    else:
+        metrics.count("query_cache_hits")
+    return list(results)
 
 
 if __name__ == "__main__":
-    index, all_doc_ids = build_index()
-    universe = set(all_doc_ids)
+    try:
+        index, all_doc_ids = build_index()
+    except FileNotFoundError as e:
+        raise SystemExit(str(e))
+    universe = Bitmap.from_sorted(all_doc_ids)
+    texts = open_texts(index)
+    if texts is None:
+        print(f"Нет {snippets.DOC_STORE} — результаты без фрагментов текста (пересоберите индекс: python indexer.py)")
+    cache = QueryCache()
 
     print("\n Булев поиск ПО ЛЕММАМ (AND / OR / NOT)")
     print("Пример: (клеопатра and цезарь) or помпей")
+    print('Фразы и близость: "олимпийские игры" and not сочи, клеопатра near/3 цезарь')
+    print("Шаблоны и опечатки: олимп* and игр?, алимпийский~ (до 2 опечаток), клеопатра~1")
+    print("Префикс explain печатает план запроса: explain сочи and not матч")
+    print("Команда stats — статистика кеша запросов, metrics — таймеры этапов")
     print("Введите exit / выход / quit для завершения\n")
 
     while True:
         query = input("Запрос: ").strip()
         if query.lower() in ("exit", "выход", "quit"):
+            lemmatizer.save()
             break
+        if query.lower() == "stats":
+            print(cache.report())
+            print("-" * 70)
+            continue
+        if query.lower() == "metrics":
+            print(metrics.prometheus_text() if metrics.enabled() else f"Инструментирование выключено ({metrics.ENV_ENABLED}=1)")
+            continue
 
-        results = search(index, universe, query)
+        show_plan = query.lower().startswith("explain ")
+        if show_plan:
+            query = query[len("explain "):]
+        try:
+            results = search(index, universe, query, show_plan, cache)
+        except ValueError as e:
+            print(f"Некорректный запрос: {e}")
+            print("-" * 70)
+            continue
+        metrics.log("query", engine="boolean", query=query, results=len(results))
         print(f"Найдено документов: {len(results)}")
         if results:
-            print("Первые 15:", results[:15])
+            # Фрагменты текста берутся из хранилищ текстов, страницы не перечитываются
+            page = [None] * len(results[:15])
+            if texts is not None:
+                page = snippets.page_snippets(results[:15], texts, snippets.Highlighter(query_lemmas(query, index)))
+            for doc_id, snippet in zip(results[:15], page):
+                print(f"[{doc_id}] {snippets.mark(*snippet) if snippet is not None else ''}")
         print("-" * 70)
\ No newline at end of file
@@ -0,0 +1,197 @@
+import os
+import sys
+import mmap
+import time
+import zlib
+import struct
+import argparse
+import tempfile
+from array import array
+from bisect import bisect_left
+
+import metrics
+from binary_index import _pad, _write_section
+
+DOC_STORE = "doc_store.bin"
+
+# Формат doc_store.bin (little-endian, секции выровнены по 8 байт):
+#   заголовок HEADER
+#   doc_ids        — uint32[n_docs], отсортированные номера документов
+#   doc_blocks     — uint32[n_docs], номер блока документа
+#   doc_offsets    — uint32[n_docs], начало текста документа в распакованном блоке (UTF-8, байты)
+#   doc_lengths    — uint32[n_docs], длина текста в байтах
+#   block_offsets  — uint64[n_blocks + 1], смещения сжатых блоков в block_blob
+#   block_blob     — блоки: очищенные тексты документов подряд, каждый блок сжат zlib отдельно
+# Документ целиком лежит в одном блоке: чтобы достать текст, распаковывается один блок, а не весь корпус
+MAGIC = b"DOCS"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIQQQQQQ")
+# Блок закрывается, как только в нём набирается столько байт текста
+BLOCK_BYTES = 1 << 16
+COMPRESS_LEVEL = 6
+
+
+def write_doc_store(path, texts):
+    """Пишет тексты [(номер документа, очищенный текст)] в хранилище из сжатых блоков; возвращает число блоков"""
+    writer = DocStoreWriter(path)
+    for doc_id, text in sorted((int(doc_id), text) for doc_id, text in texts):
+        writer.add(doc_id, text)
+    return writer.close()
+
+
+class DocStoreWriter:
+    """Пишет хранилище по одному документу (по возрастанию номеров): в памяти только текущий блок
+    и массивы смещений, сжатые блоки сразу уходят во временный файл"""
+
+    def __init__(self, path):
+        self.path = path
+        self.doc_ids = array("I")
+        self.doc_blocks = array("I")
+        self.doc_offsets = array("I")
+        self.doc_lengths = array("I")
+        self.block_offsets = array("Q", [0])
+        self.block = bytearray()
+        self._blob = tempfile.TemporaryFile(dir=os.path.dirname(path) or ".")
+
+    def _close_block(self):
+        data = zlib.compress(self.block, COMPRESS_LEVEL)
+        self._blob.write(data)
+        self.block_offsets.append(self.block_offsets[-1] + len(data))
+        self.block.clear()
+
+    def add(self, doc_id, text):
+        if len(self.block) >= BLOCK_BYTES:
+            self._close_block()
+        data = text.encode("utf-8")
+        self.doc_ids.append(int(doc_id))
+        self.doc_blocks.append(len(self.block_offsets) - 1)
+        self.doc_offsets.append(len(self.block))
+        self.doc_lengths.append(len(data))
+        self.block += data
+
+    def close(self):
+        """Дописывает файл; возвращает число блоков"""
+        if self.block:
+            self._close_block()
+        arrays = (self.doc_ids, self.doc_blocks, self.doc_offsets, self.doc_lengths, self.block_offsets)
+        if sys.byteorder != "little":
+            for arr in arrays:
+                arr.byteswap()
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"\0" * HEADER.size)
+            sections = []
+            for data in arrays + (self._blob,):
+                _pad(f)
+                sections.append(f.tell())
+                _write_section(f, data)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.doc_ids), len(self.block_offsets) - 1, *sections))
+        os.replace(tmp_path, self.path)
+        return len(self.block_offsets) - 1
+
+
+class DocStore:
+    """Очищенные тексты документов поверх mmap: текст одного документа — распаковка одного блока"""
+
+    def __init__(self, path=DOC_STORE):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_docs, n_blocks, *sections = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: неизвестный формат хранилища текстов")
+        if sys.byteorder != "little":
+            raise ValueError("Хранилище текстов читается только на little-endian машинах")
+        view = memoryview(self._mm)
+        doc_ids_at, blocks_at, offsets_at, lengths_at, block_offsets_at, self._blob_at = sections
+        self.doc_ids = view[doc_ids_at:doc_ids_at + 4 * n_docs].cast("I")
+        self._doc_blocks = view[blocks_at:blocks_at + 4 * n_docs].cast("I")
+        self._doc_offsets = view[offsets_at:offsets_at + 4 * n_docs].cast("I")
+        self._doc_lengths = view[lengths_at:lengths_at + 4 * n_docs].cast("I")
+        self._block_offsets = view[block_offsets_at:block_offsets_at + 8 * (n_blocks + 1)].cast("Q")
+        self.n_blocks = n_blocks
+        # Последний распакованный блок: соседние документы выдачи часто лежат в одном блоке
+        self._cached = (-1, b"")
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __contains__(self, doc_id):
+        return self._find(int(doc_id)) >= 0
+
+    def _find(self, doc_id):
+        i = bisect_left(self.doc_ids, doc_id)
+        return i if i < len(self.doc_ids) and self.doc_ids[i] == doc_id else -1
+
+    def _block(self, b):
+        if self._cached[0] != b:
+            with metrics.timer("doc_store.decompress"):
+                start = self._blob_at + self._block_offsets[b]
+                data = zlib.decompress(self._mm[start:self._blob_at + self._block_offsets[b + 1]])
+            self._cached = (b, data)
+        return self._cached[1]
+
+    def text(self, doc_id, default=None):
+        """Очищенный текст документа (как clean_html) или default"""
+        i = self._find(int(doc_id))
+        if i < 0:
+            return default
+        offset = self._doc_offsets[i]
+        return self._block(self._doc_blocks[i])[offset:offset + self._doc_lengths[i]].decode("utf-8")
+
+    def items(self):
+        """(номер документа, текст) по возрастанию номеров — блоки распаковываются по одному разу"""
+        for i, doc_id in enumerate(self.doc_ids):
+            offset = self._doc_offsets[i]
+            yield doc_id, self._block(self._doc_blocks[i])[offset:offset + self._doc_lengths[i]].decode("utf-8")
+
+    def close(self):
+        for arr in (self.doc_ids, self._doc_blocks, self._doc_offsets, self._doc_lengths, self._block_offsets):
+            arr.release()
+        self._mm.close()
+
+
+def check(path, pages_dir):
+    """Сверяет тексты хранилища с clean_html страниц и сравнивает время доступа"""
+    from text_utils import clean_html
+    from indexer import page_files
+
+    store = DocStore(path)
+    files = page_files(pages_dir)
+    mismatches = 0
+    html_time = store_time = 0.0
+    for doc_id, page_path in files:
+        started = time.perf_counter()
+        with open(page_path, encoding="utf-8") as f:
+            expected = clean_html(f.read())
+        html_time += time.perf_counter() - started
+        store._cached = (-1, b"")
+        started = time.perf_counter()
+        got = store.text(doc_id)
+        store_time += time.perf_counter() - started
+        mismatches += got != expected
+    raw = sum(store._doc_lengths)
+    size = os.path.getsize(path)
+    store.close()
+    n = max(len(files), 1)
+    print(f"Документов: {len(files)}, блоков: {store.n_blocks}, текст {raw / 1024:.0f} КБ → файл {size / 1024:.0f} КБ")
+    print(f"pages/ + clean_html: {html_time / n * 1000:.2f} мс/документ, хранилище: {store_time / n * 1000:.3f} мс/документ")
+    print(f"Расхождений с clean_html: {mismatches}")
+    return mismatches == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сжатое хранилище очищенных текстов документов")
+    parser.add_argument("command", choices=["check", "show"])
+    parser.add_argument("doc_id", nargs="?", help="номер документа для show")
+    parser.add_argument("--path", default=DOC_STORE)
+    parser.add_argument("--pages-dir", default="pages")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        raise SystemExit(0 if check(args.path, args.pages_dir) else 1)
+    store = DocStore(args.path)
+    text = store.text(args.doc_id)
+    print(text if text is not None else f"Документа {args.doc_id} нет в {args.path}")
+    store.close()
@@ -0,0 +1,501 @@
+import io
+import os
+import json
+import math
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict, Counter, namedtuple
+
+import metrics
+
+from lemmatizer import Lemmatizer, CACHE_FILE, LOOKUP_FILE
+from binary_index import INDEX_BIN, write_binary_index
+from tfidf_store import TFIDF_STORE, build_store
+from doc_store import DOC_STORE, write_doc_store
+from page_manifest import PAGES_MANIFEST, PAGE_CACHE_DIR, PageManifest
+from text_utils import STOP_WORDS, iter_segments, clean_text, page_tokens, index_token_positions
+
+PAGES_DIR = "pages"
+TOKENS_DIR = "tokens"
+LEMMAS_DIR = "lemmas"
+TFIDF_TERMS_DIR = "tfidf_terms"
+TFIDF_LEMMAS_DIR = "tfidf_lemmas"
+TOKENS_FILE = "tokens.txt"
+LEMMAS_FILE = "lemmas.txt"
+INDEX_FILE = "inverted_index.json"
+TFIDF_NORMS_FILE = "tfidf_norms.txt"
+TFIDF_BOUNDS_FILE = "tfidf_bounds.txt"
+
+# Результат разбора одной страницы: всё, что нужно заданиям 2, 3 и 4;
+# positions — позиции каждой леммы индекса в странице (для фраз и NEAR), text — очищенный текст (для сниппетов)
+PageResult = namedtuple("PageResult", ["doc_id", "term_counts", "index_lemmas", "lemma_of", "positions", "text"])
+
+
+def analyze_page(doc_id, html, lemmatize, with_index=True):
+    """Один проход по странице, переданной строкой: очистка, токенизация и лемматизация"""
+    return analyze_stream(doc_id, io.StringIO(html), lemmatize, with_index)
+
+
+def analyze_stream(doc_id, f, lemmatize, with_index=True):
+    """То же по открытому файлу: страница читается кусками, в памяти не лежит целиком"""
+    term_counts = Counter()
+    # Токен → его позиции; порядок ключей — порядок первого появления
+    token_positions = {}
+    position = 0
+    # Текст в исходном регистре нужен только индексу: из него собирается хранилище текстов
+    pieces = [] if with_index else None
+    segments = iter_segments(f, original=pieces)
+    while True:
+        # Время «clean» включает вложенное чтение html_read; собственное время этапа — без него
+        with metrics.timer("clean"):
+            segment = next(segments, None)
+        if segment is None:
+            break
+        with metrics.timer("tokenize"):
+            term_counts.update(page_tokens(segment))
+            if with_index:
+                position = index_token_positions(segment, token_positions, position)
+
+    with metrics.timer("lemmatize"):
+        lemma_of = {}
+        for token in term_counts:
+            lemma_of[token] = lemmatize(token)
+
+        # Повторы токена дают ту же лемму, поэтому достаточно различных токенов в порядке первого появления
+        lemma_positions = {}
+        for token, positions in token_positions.items():
+            lemma = lemma_of.get(token)
+            if lemma is None:
+                lemma = lemma_of[token] = lemmatize(token)
+            if lemma and lemma not in STOP_WORDS and len(lemma) >= 2:
+                if lemma in lemma_positions:
+                    # Несколько словоформ одной леммы: позиции сливаются в один отсортированный список
+                    lemma_positions[lemma] = sorted(lemma_positions[lemma] + positions)
+                else:
+                    lemma_positions[lemma] = positions
+
+    metrics.count("pages")
+    metrics.count("tokens", sum(term_counts.values()))
+    metrics.count("lemmatize_calls", len(lemma_of))
+    text = clean_text(pieces) if with_index else None
+    return PageResult(doc_id, term_counts, list(lemma_positions), lemma_of, lemma_positions, text)
+
+
+def analyze_file(doc_id, path, lemmatize, with_index=True):
+    with open(path, encoding="utf-8") as f:
+        return analyze_stream(doc_id, f, lemmatize, with_index)
+
+
+def page_files(pages_dir):
+    return [(filename.replace(".html", ""), os.path.join(pages_dir, filename))
+            for filename in sorted(os.listdir(pages_dir)) if filename.endswith(".html")]
+
+
+# В каждом процессе пула — свой Lemmatizer (и свой MorphAnalyzer)
+_worker_lemmatizer = None
+
+
+def _init_worker(cache_file):
+    global _worker_lemmatizer
+    _worker_lemmatizer = Lemmatizer(cache_file)
+
+
+def _analyze_file(task):
+    doc_id, path, with_index = task
+    hits, misses = _worker_lemmatizer.hits, _worker_lemmatizer.misses
+    result = analyze_file(doc_id, path, _worker_lemmatizer, with_index)
+    return result, _worker_lemmatizer.hits - hits, _worker_lemmatizer.misses - misses, metrics.drain()
+
+
+def analyze_pages(pages_dir, workers=1, with_index=True, lemmatizer=None):
+    """Разбирает все страницы каталога"""
+    return analyze_files(page_files(pages_dir), workers, with_index, lemmatizer)
+
+
+def analyze_files(files, workers=1, with_index=True, lemmatizer=None):
+    """Разбирает страницы [(doc_id, путь)]; при workers > 1 — в пуле процессов.
+
+    pool.map сохраняет порядок страниц, поэтому результат не зависит от числа процессов.
+    Новые леммы и счётчики кеша из процессов пула собираются в lemmatizer.
+    """
+    return list(iter_analyzed(files, workers, with_index, lemmatizer))
+
+
+def iter_analyzed(files, workers=1, with_index=True, lemmatizer=None, window=None):
+    """То же, что analyze_files, но результаты выдаются по одному, в порядке files.
+
+    window — сколько страниц на процесс пула разбирается впрок: без него пул разбирает всё сразу
+    и готовые результаты копятся в памяти, пока их не заберут.
+    """
+    if lemmatizer is None:
+        lemmatizer = Lemmatizer()
+    if workers <= 1:
+        for doc_id, path in files:
+            hits, misses = lemmatizer.hits, lemmatizer.misses
+            result = analyze_file(doc_id, path, lemmatizer, with_index)
+            metrics.count("lemma_cache_hits", lemmatizer.hits - hits)
+            metrics.count("lemma_cache_misses", lemmatizer.misses - misses)
+            yield result
+        return
+
+    tasks = [(doc_id, path, with_index) for doc_id, path in files]
+    batch = len(tasks) if window is None else window * workers
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(lemmatizer.cache_file,)) as pool:
+        for start in range(0, len(tasks), max(batch, 1)):
+            part = tasks[start:start + batch]
+            chunksize = max(1, len(part) // (workers * 4))
+            for result, hits, misses, delta in pool.map(_analyze_file, part, chunksize=chunksize):
+                lemmatizer.remember(result.lemma_of)
+                lemmatizer.hits += hits
+                lemmatizer.misses += misses
+                metrics.count("lemma_cache_hits", hits)
+                metrics.count("lemma_cache_misses", misses)
+                metrics.merge(delta)
+                yield result
+
+
+def analyze_incremental(files, output_dir=".", workers=1, with_index=True, lemmatizer=None, dedup=False):
+    """Разбирает только страницы, текст которых изменился; остальные берутся из page_cache/.
+
+    Возвращает (результаты в порядке files, заново разобранные, номера выбывших страниц). Выбывают удалённые
+    из pages/ и, при dedup, точные и почти дубликаты: они не разбираются и в результаты не попадают, так что
+    каждая группа индексируется один раз. Документные частоты и IDF вызывающий всё равно считает заново
+    по всем результатам — разбора страниц это не требует.
+    """
+    manifest = PageManifest(output_dir)
+    with metrics.timer("manifest"):
+        _, deleted = manifest.scan(files)
+        # Дубликаты записываются в манифест всегда, а из индекса исключаются только при dedup
+        duplicates = manifest.duplicates()
+    skipped = duplicates if dedup else {}
+
+    results, todo = {}, []
+    for doc_id, path in files:
+        if doc_id in skipped:
+            continue
+        fields = manifest.load(doc_id, with_index)
+        if fields is None:
+            todo.append((doc_id, path))
+        else:
+            term_counts, *rest = fields
+            results[doc_id] = PageResult(doc_id, Counter(term_counts), *rest)
+    fresh = []
+    for result in iter_analyzed(todo, workers, with_index, lemmatizer):
+        manifest.store(result.doc_id, (dict(result.term_counts), *result[2:]))
+        results[result.doc_id] = result
+        fresh.append(result)
+    manifest.save()
+
+    metrics.count("pages_reused", len(results) - len(fresh))
+    print(f"Страниц: {len(files)}, разобрано заново: {len(fresh)}, из кеша: {len(results) - len(fresh)}, "
+          f"дубликатов: {len(duplicates)}{'' if dedup else ' (индексируются)'}")
+    return [results[doc_id] for doc_id, _ in files if doc_id in results], fresh, deleted + list(skipped)
+
+
+def remove_page_files(doc_ids, output_dir):
+    """Удаляет файлы заданий 2 и 4 страниц, которых больше нет в индексе (удалённых и дубликатов)"""
+    for doc_id in doc_ids:
+        for directory, suffix in ((TOKENS_DIR, "tokens"), (LEMMAS_DIR, "lemmas"),
+                                  (TFIDF_TERMS_DIR, "terms"), (TFIDF_LEMMAS_DIR, "lemmas")):
+            path = os.path.join(output_dir, directory, f"{doc_id}_{suffix}.txt")
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def write_page_files(result, output_dir):
+    """tokens/N_tokens.txt и lemmas/N_lemmas.txt (задание 2)"""
+    sorted_page_tokens = sorted(result.term_counts)
+    with open(os.path.join(output_dir, TOKENS_DIR, f"{result.doc_id}_tokens.txt"), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(sorted_page_tokens) + '\n')
+
+    page_lemma_groups = defaultdict(list)
+    for token in sorted_page_tokens:
+        page_lemma_groups[result.lemma_of[token]].append(token)
+
+    with open(os.path.join(output_dir, LEMMAS_DIR, f"{result.doc_id}_lemmas.txt"), 'w', encoding='utf-8') as f:
+        for lemma in sorted(page_lemma_groups):
+            toks = sorted(set(page_lemma_groups[lemma]))
+            f.write(f"{lemma} {' '.join(toks)}\n")
+
+
+def add_lemma_groups(groups, result):
+    """Добавляет в groups (лемма → множество токенов) токены страницы — для tokens.txt и lemmas.txt"""
+    for token in result.term_counts:
+        groups[result.lemma_of[token]].add(token)
+
+
+def write_fresh_page_files(results, fresh, output_dir):
+    """write_page_files для заново разобранных страниц: у страниц из кеша файлы остались от прошлой сборки
+    (если страница тогда не была исключена как дубликат). Возвращает записанные результаты"""
+    fresh_ids = {result.doc_id for result in fresh}
+    written = []
+    for result in results:
+        if result.doc_id in fresh_ids or not os.path.exists(
+                os.path.join(output_dir, TOKENS_DIR, f"{result.doc_id}_tokens.txt")):
+            write_page_files(result, output_dir)
+            written.append(result)
+    return written
+
+
+def write_global_files(results, output_dir):
+    """tokens.txt и lemmas.txt"""
+    global_lemma_groups = defaultdict(set)
+    for result in results:
+        add_lemma_groups(global_lemma_groups, result)
+    return write_lemma_groups(global_lemma_groups, output_dir)
+
+
+def write_lemma_groups(global_lemma_groups, output_dir):
+    """tokens.txt и lemmas.txt по группам add_lemma_groups; возвращает (токенов, лемм)"""
+    all_tokens = set().union(*global_lemma_groups.values())
+
+    with open(os.path.join(output_dir, TOKENS_FILE), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(sorted(all_tokens)) + '\n')
+
+    with open(os.path.join(output_dir, LEMMAS_FILE), 'w', encoding='utf-8') as f:
+        for lemma in sorted(global_lemma_groups):
+            toks = sorted(global_lemma_groups[lemma])
+            f.write(f"{lemma} {' '.join(toks)}\n")
+
+    return len(all_tokens), len(global_lemma_groups)
+
+
+def add_lemma_forms(forms_by_lemma, result):
+    """Добавляет в forms_by_lemma (лемма → множество словоформ) все словоформы страницы, включая латиницу"""
+    for token, lemma in result.lemma_of.items():
+        if lemma:
+            forms_by_lemma[lemma].add(token)
+
+
+def write_lemma_lookup(results, output_dir):
+    """Словарь словоформа → лемма для быстрого старта поиска (все словоформы корпуса, включая латиницу)"""
+    forms_by_lemma = defaultdict(set)
+    for result in results:
+        add_lemma_forms(forms_by_lemma, result)
+    write_lemma_forms(forms_by_lemma, output_dir)
+
+
+def read_lemma_forms(output_dir):
+    """lemma_lookup.txt обратно в лемма → множество словоформ (пусто, если файла нет)"""
+    forms_by_lemma = defaultdict(set)
+    path = os.path.join(output_dir, LOOKUP_FILE)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                lemma, *forms = line.split()
+                forms_by_lemma[lemma].update(forms)
+    return forms_by_lemma
+
+
+def write_lemma_forms(forms_by_lemma, output_dir):
+    with open(os.path.join(output_dir, LOOKUP_FILE), 'w', encoding='utf-8') as f:
+        for lemma in sorted(forms_by_lemma):
+            f.write(f"{lemma} {' '.join(sorted(forms_by_lemma[lemma]))}\n")
+
+
+def lemma_counts_of(result):
+    lemma_counts = Counter()
+    for token, count in result.term_counts.items():
+        lemma_counts[result.lemma_of[token]] += count
+    return lemma_counts
+
+
+def tfidf_values(counts, df, N, total_terms):
+    """[(ключ, idf, tf-idf)] документа строками с 6 знаками — в том виде, в каком они лежат в tfidf_*/"""
+    values = []
+    for key, freq in counts.items():
+        tf = freq / total_terms
+        idf = math.log(N / df[key])
+        values.append((key, f"{idf:.6f}", f"{tf * idf:.6f}"))
+    return values
+
+
+def write_doc_tfidf(doc_id, term_counts, lemma_counts, df_terms, df_lemmas, N, output_dir, bounds=None, vector=None):
+    """tfidf_terms/N_terms.txt и tfidf_lemmas/N_lemmas.txt одного документа; возвращает норму вектора лемм.
+
+    Если передан bounds, в нём обновляется максимум нормированного веса каждой леммы (для MaxScore);
+    в vector складываются веса лемм в том виде, в каком они записаны в файл (для TfidfStoreWriter).
+    """
+    total_terms = sum(term_counts.values())
+
+    with open(os.path.join(output_dir, TFIDF_TERMS_DIR, f"{doc_id}_terms.txt"), "w", encoding="utf-8") as f:
+        for term, idf, tfidf in tfidf_values(term_counts, df_terms, N, total_terms):
+            f.write(f"{term} {idf} {tfidf}\n")
+
+    weights = []
+    with open(os.path.join(output_dir, TFIDF_LEMMAS_DIR, f"{doc_id}_lemmas.txt"), "w", encoding="utf-8") as f:
+        for lemma, idf, tfidf in tfidf_values(lemma_counts, df_lemmas, N, total_terms):
+            weights.append(float(tfidf))
+            f.write(f"{lemma} {idf} {tfidf}\n")
+
+    # Норма считается по значениям в том виде, в каком их прочитает vector_search, — совпадает побитно
+    norm = math.sqrt(sum(v * v for v in weights))
+    if vector is not None:
+        vector.update(zip(lemma_counts, weights))
+    if bounds is not None and norm:
+        for lemma, weight in zip(lemma_counts, weights):
+            bounds[lemma] = max(bounds.get(lemma, 0.0), weight / norm)
+    return norm
+
+
+def write_float_table(path, values, key=None):
+    """Файл «ключ число», числа записаны без потери точности"""
+    with open(path, "w", encoding="utf-8") as f:
+        for name in sorted(values, key=key):
+            f.write(f"{name} {values[name]!r}\n")
+
+
+def read_float_table(path):
+    values = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                name, value = line.split()
+                values[name] = float(value)
+    return values
+
+
+def write_norms(norms, output_dir):
+    """tfidf_norms.txt: «документ норма вектора лемм»"""
+    write_float_table(os.path.join(output_dir, TFIDF_NORMS_FILE), norms, key=int)
+
+
+def read_norms(output_dir="."):
+    return read_float_table(os.path.join(output_dir, TFIDF_NORMS_FILE))
+
+
+def write_bounds(bounds, output_dir):
+    """tfidf_bounds.txt: «лемма max(вес / норма документа)» — верхняя граница вклада леммы в косинус"""
+    write_float_table(os.path.join(output_dir, TFIDF_BOUNDS_FILE), bounds)
+
+
+def read_bounds(output_dir="."):
+    return read_float_table(os.path.join(output_dir, TFIDF_BOUNDS_FILE))
+
+
+def write_tfidf_files(results, output_dir):
+    """tfidf_terms/ и tfidf_lemmas/ (задание 4)"""
+    document_frequency_terms = defaultdict(int)
+    document_frequency_lemmas = defaultdict(int)
+    doc_lemma_counts = {}
+
+    for result in results:
+        doc_lemma_counts[result.doc_id] = lemma_counts_of(result)
+        for term in result.term_counts:
+            document_frequency_terms[term] += 1
+        for lemma in doc_lemma_counts[result.doc_id]:
+            document_frequency_lemmas[lemma] += 1
+
+    N = len(results)
+
+    norms, bounds = {}, {}
+    for result in results:
+        norms[result.doc_id] = write_doc_tfidf(
+            result.doc_id, result.term_counts, doc_lemma_counts[result.doc_id],
+            document_frequency_terms, document_frequency_lemmas, N, output_dir, bounds)
+    write_norms(norms, output_dir)
+    write_bounds(bounds, output_dir)
+    build_store(os.path.join(output_dir, TFIDF_LEMMAS_DIR), os.path.join(output_dir, TFIDF_STORE))
+
+
+def write_inverted_index(results, output_dir, json_export=True):
+    """inverted_index.bin (с позициями лемм) и, для отладки, inverted_index.json без позиций (задание 3)"""
+    index = defaultdict(list)
+    positions = defaultdict(dict)
+    for result in results:
+        for lemma in result.index_lemmas:
+            index[lemma].append(result.doc_id)
+            positions[lemma][int(result.doc_id)] = result.positions[lemma]
+
+    for term in index:
+        index[term] = sorted(set(index[term]), key=int)
+    all_doc_ids = sorted({result.doc_id for result in results}, key=int)
+
+    write_binary_index(os.path.join(output_dir, INDEX_BIN), index, all_doc_ids, positions)
+    if json_export:
+        data = {"index": dict(index), "all_doc_ids": all_doc_ids}
+        with open(os.path.join(output_dir, INDEX_FILE), "w", encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    return len(index), len(all_doc_ids)
+
+
+def build(pages_dir=PAGES_DIR, output_dir=".", workers=1, cache_file=CACHE_FILE, json_export=True,
+          incremental=False, dedup=False):
+    """Строит все артефакты заданий 2–4 за один проход по pages/.
+
+    incremental — разбирать только страницы с изменившимся текстом (analyze_incremental), dedup — то же,
+    и группы одинаковых и почти одинаковых страниц индексируются один раз.
+    """
+    for directory in (TOKENS_DIR, LEMMAS_DIR, TFIDF_TERMS_DIR, TFIDF_LEMMAS_DIR):
+        os.makedirs(os.path.join(output_dir, directory), exist_ok=True)
+
+    lemmatizer = Lemmatizer(cache_file)
+    with metrics.timer("analyze"):
+        if incremental or dedup:
+            results, fresh, removed = analyze_incremental(
+                page_files(pages_dir), output_dir, workers, lemmatizer=lemmatizer, dedup=dedup)
+        else:
+            results = fresh = analyze_pages(pages_dir, workers, lemmatizer=lemmatizer)
+            removed = []
+    lemmatizer.save()
+
+    with metrics.timer("page_write"):
+        remove_page_files(removed, output_dir)
+        write_fresh_page_files(results, fresh, output_dir)
+    with metrics.timer("global_write"):
+        n_tokens, n_lemmas = write_global_files(results, output_dir)
+        write_lemma_lookup(results, output_dir)
+    with metrics.timer("tfidf_write"):
+        write_tfidf_files(results, output_dir)
+    with metrics.timer("index_write"):
+        n_terms, n_docs = write_inverted_index(results, output_dir, json_export)
+    with metrics.timer("doc_store_write"):
+        n_blocks = write_doc_store(os.path.join(output_dir, DOC_STORE), ((r.doc_id, r.text) for r in results))
+
+    print(f"Документов: {n_docs}")
+    print(f"Уникальных токенов всего: {n_tokens}")
+    print(f"Групп лемм всего: {n_lemmas}")
+    print(f"Индекс: терминов={n_terms:,}")
+    print(f"Хранилище текстов: блоков={n_blocks}")
+    print(lemmatizer.stats())
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Единый проход индексации: токены, леммы, TF-IDF и индекс")
+    parser.add_argument("--pages-dir", default=PAGES_DIR)
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--workers", type=int, default=1, help="число процессов для разбора страниц")
+    parser.add_argument("--lemma-cache", default=CACHE_FILE, help="файл кеша лемм ('' — без кеша на диске)")
+    parser.add_argument("--no-json", action="store_true", help="не выгружать inverted_index.json")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"разбирать только страницы с изменившимся текстом ({PAGES_MANIFEST}, {PAGE_CACHE_DIR}/)")
+    parser.add_argument("--dedup", action="store_true", help="индексировать одинаковые и почти одинаковые страницы один раз (включает --incremental)")
+    parser.add_argument("--memory-mb", type=float, metavar="MB",
+                        help="строить в ограниченной памяти (SPIMI): буферы списков не больше MB, остальное — прогоны на диске")
+    parser.add_argument("--metrics", action="store_true",
+                        help=f"собрать таймеры и счётчики этапов: JSON в журнал, снимок Prometheus в {metrics.METRICS_FILE}")
+    parser.add_argument("--profile", action="append", default=[], metavar="STAGE",
+                        help=f"снять cProfile с этапа (clean, tokenize, lemmatize, …) в {metrics.PROFILES_DIR}/")
+    parser.add_argument("--trace-memory", action="append", default=[], metavar="STAGE",
+                        help=f"снять tracemalloc с этапа в {metrics.PROFILES_DIR}/")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.metrics or args.profile or args.trace_memory:
+        metrics.configure(args.metrics, profile=args.profile, trace=args.trace_memory)
+    started = time.perf_counter()
+    if args.memory_mb:
+        import spimi
+        spimi.build(args.pages_dir, args.output_dir, args.workers, args.lemma_cache, not args.no_json, args.memory_mb)
+    else:
+        build(args.pages_dir, args.output_dir, args.workers, args.lemma_cache, not args.no_json,
+              args.incremental, args.dedup)
+    print(f"Индексация заняла {time.perf_counter() - started:.1f} с")
+    if metrics.enabled():
+        metrics.log("index_build", seconds=time.perf_counter() - started, **metrics.snapshot())
+        metrics.write_prometheus(os.path.join(args.output_dir, metrics.METRICS_FILE))
@@ -0,0 +1,105 @@
+import os
+import json
+
+import metrics
+
+CACHE_FILE = "lemma_cache.json"
+LOOKUP_FILE = "lemma_lookup.txt"
+
+
+def analyzer_version():
+    """Версия pymorphy2 и словаря — ключ, которым помечается кеш на диске"""
+    from importlib import metadata
+    parts = []
+    for dist in ("pymorphy2", "pymorphy2-dicts-ru"):
+        try:
+            parts.append(f"{dist}=={metadata.version(dist)}")
+        except metadata.PackageNotFoundError:
+            parts.append(f"{dist}==?")
+    return ";".join(parts)
+
+
+class Lemmatizer:
+    """Лемматизация pymorphy2 с мемоизацией в памяти и кешем словоформа → лемма на диске.
+
+    Всё загружается лениво: словарь lookup_file (словоформы корпуса, пишется indexer.py) читается сразу,
+    кеш на диске — при первом промахе, а MorphAnalyzer создаётся только для слов, которых нет нигде.
+    """
+
+    def __init__(self, cache_file=CACHE_FILE, lookup_file=None):
+        self.cache_file = cache_file
+        self.version = None
+        self.lemmas = {}
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self._morph = None
+        self._cache_loaded = not cache_file
+        if lookup_file:
+            self.load_lookup(lookup_file)
+
+    @property
+    def morph(self):
+        if self._morph is None:
+            import pymorphy2
+            self._morph = pymorphy2.MorphAnalyzer()
+        return self._morph
+
+    def __call__(self, token):
+        lemma = self.lemmas.get(token)
+        if lemma is None and not self._cache_loaded:
+            self.load()
+            lemma = self.lemmas.get(token)
+        if lemma is not None:
+            self.hits += 1
+            return lemma
+        self.misses += 1
+        with metrics.timer("morph"):
+            lemma = self.lemmas[token] = self.morph.parse(token)[0].normal_form
+        self.dirty = True
+        return lemma
+
+    def remember(self, lemma_of):
+        """Добавляет в кеш пары, посчитанные в другом процессе"""
+        for token, lemma in lemma_of.items():
+            if token not in self.lemmas:
+                self.lemmas[token] = lemma
+                self.dirty = True
+
+    def load_lookup(self, path):
+        """Читает словарь в формате lemmas.txt: «лемма словоформа словоформа …»"""
+        if not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                lemma, *forms = line.split()
+                for form in forms:
+                    self.lemmas[form] = lemma
+
+    def load(self):
+        self._cache_loaded = True
+        self.version = analyzer_version()
+        if not os.path.exists(self.cache_file):
+            return
+        with open(self.cache_file, encoding="utf-8") as f:
+            data = json.load(f)
+        # Кеш от другой версии анализатора или словаря может давать другие леммы
+        if data.get("version") == self.version:
+            for token, lemma in data["lemmas"].items():
+                self.lemmas.setdefault(token, lemma)
+
+    def save(self):
+        if not self.cache_file or not self.dirty:
+            return
+        if not self._cache_loaded:
+            self.load()
+        tmp_path = f"{self.cache_file}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "lemmas": self.lemmas}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_file)
+        self.dirty = False
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"Кеш лемматизации: попаданий {self.hits}, промахов {self.misses} ({rate:.1f}% попаданий)"
@@ -0,0 +1,95 @@
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+
+import aiohttp
+
+from text_utils import STOP_WORDS
+from search_server import HOST, PORT, DEFAULT_LIMIT
+
+BOUNDS_FILE = "tfidf_bounds.txt"
+
+
+def read_lemmas(path=BOUNDS_FILE):
+    with open(path, encoding="utf-8") as f:
+        return [line.split()[0] for line in f if line.strip()]
+
+
+def make_queries(n, mode, seed=0):
+    """Запросы с перекошенной (ципфовской) частотой: немногие встречаются в большинстве запросов"""
+    rng = random.Random(seed)
+    # Операторы и стоп-слова в роли операндов дали бы некорректные булевы запросы
+    lemmas = [lemma for lemma in read_lemmas() if lemma not in STOP_WORDS and lemma not in ("and", "or", "not")]
+    rng.shuffle(lemmas)
+    weights = [1 / rank for rank in range(1, len(lemmas) + 1)]
+    join = " and " if mode == "boolean" else " "
+    return [join.join(rng.choices(lemmas, weights, k=rng.randint(1, 3))) for _ in range(n)]
+
+
+def percentile(sorted_values, p):
+    """Перцентиль по ближайшему рангу"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def run(url, queries, mode, concurrency, batch, limit):
+    latencies = []
+    statuses = Counter()
+    answered = 0
+    position = 0
+
+    async def client(session):
+        nonlocal position, answered
+        while position < len(queries):
+            chunk = queries[position:position + batch]
+            position += batch
+            started = time.perf_counter()
+            if batch == 1:
+                request = session.get(f"{url}/search", params={"q": chunk[0], "mode": mode, "limit": limit})
+            else:
+                request = session.post(f"{url}/search/batch", json={"queries": chunk, "mode": mode, "limit": limit})
+            async with request as response:
+                await response.read()
+                statuses[response.status] += 1
+            if response.status == 200:
+                latencies.append(time.perf_counter() - started)
+                answered += len(chunk)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return latencies, statuses, answered, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест search_server.py: пропускная способность и задержки")
+    parser.add_argument("--url", default=f"http://{HOST}:{PORT}")
+    parser.add_argument("--mode", choices=("boolean", "vector"), default="boolean")
+    parser.add_argument("--requests", type=int, default=2000, help="сколько запросов отправить")
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных клиентов")
+    parser.add_argument("--batch", type=int, default=1, help="запросов в одном HTTP-запросе (/search/batch)")
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    parser.add_argument("--queries", help="файл с запросами, по одному в строке (по умолчанию — синтетические)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            pool = [line.strip() for line in f if line.strip()]
+        queries = [pool[i % len(pool)] for i in range(args.requests)]
+    else:
+        queries = make_queries(args.requests, args.mode, args.seed)
+
+    latencies, statuses, answered, elapsed = asyncio.run(
+        run(args.url.rstrip("/"), queries, args.mode, args.concurrency, args.batch, args.limit))
+    latencies.sort()
+    print(f"Запросов: {len(queries)} за {elapsed:.2f} с, обработано {answered / elapsed:.0f} запросов/с "
+          f"(HTTP-ответы: {', '.join(f'{status}: {n}' for status, n in sorted(statuses.items()))})")
+    print(f"Задержка HTTP-запроса: p50 {percentile(latencies, 50) * 1000:.1f} мс, "
+          f"p99 {percentile(latencies, 99) * 1000:.1f} мс, макс. {latencies[-1] * 1000 if latencies else 0:.1f} мс")
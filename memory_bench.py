@@ -0,0 +1,69 @@
+import gc
+import argparse
+import tracemalloc
+from collections import defaultdict
+
+from binary_index import INDEX_BIN, BinaryIndex
+from term_vectors import TFIDF_LEMMAS_DIR, CompactVectors
+from vector_search import VectorIndex, load_tfidf_data
+
+
+def measure(build):
+    """Сколько байт кучи удерживает результат build() (по tracemalloc)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size, result
+
+
+def vectors_before():
+    """Прежнее представление: словарь словарей {документ: {лемма: вес}} и списки (документ, вес)"""
+    doc_vectors, idf_dict = load_tfidf_data()
+    postings = defaultdict(list)
+    for doc_id, vector in doc_vectors.items():
+        for lemma, weight in vector.items():
+            postings[lemma].append((doc_id, weight))
+    return doc_vectors, idf_dict, postings
+
+
+def vectors_after():
+    return VectorIndex.from_compact(CompactVectors.from_dir(TFIDF_LEMMAS_DIR))
+
+
+def boolean_before(index_path):
+    """Прежнее представление: {термин: [номер документа строкой]}"""
+    binary = BinaryIndex(index_path)
+    index = {term: [str(d) for d in postings] for term, postings in binary.items()}
+    binary.close()
+    return index
+
+
+def boolean_after(index_path):
+    binary = BinaryIndex(index_path)
+    index = dict(binary.items())
+    binary.close()
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Память на один элемент списков: прежнее и компактное представление")
+    parser.add_argument("--index", default=INDEX_BIN)
+    args = parser.parse_args()
+
+    n_vector = CompactVectors.from_dir(TFIDF_LEMMAS_DIR).n_postings()
+    binary = BinaryIndex(args.index)
+    n_boolean = sum(binary.doc_freq(term) for term in binary.terms())
+    binary.close()
+
+    rows = [
+        ("векторы TF-IDF", n_vector, measure(vectors_before)[0], measure(vectors_after)[0]),
+        ("булев индекс", n_boolean, measure(lambda: boolean_before(args.index))[0],
+         measure(lambda: boolean_after(args.index))[0]),
+    ]
+    print(f"{'':<16}{'элементов':>10}{'было, КБ':>11}{'стало, КБ':>11}{'было, Б/эл.':>13}{'стало, Б/эл.':>14}")
+    for name, n, before, after in rows:
+        print(f"{name:<16}{n:>10}{before / 1024:>11.1f}{after / 1024:>11.1f}{before / n:>13.1f}{after / n:>14.1f}")
@@ -0,0 +1,256 @@
+import os
+import sys
+import json
+import time
+import atexit
+import cProfile
+import tracemalloc
+from collections import Counter
+
+# Инструментирование включается переменной окружения (её наследуют процессы пула) или configure()
+ENV_ENABLED = "SEARCH_METRICS"
+ENV_LOG = "SEARCH_METRICS_LOG"
+ENV_PROFILE = "SEARCH_PROFILE"
+ENV_TRACEMALLOC = "SEARCH_TRACEMALLOC"
+PROFILES_DIR = "profiles"
+METRICS_FILE = "metrics.prom"
+PREFIX = "search"
+TRACEMALLOC_TOP = 20
+
+_enabled = False
+_log_file = None
+_profile_stages = set()
+_trace_stages = set()
+
+# Таймеры: этап → [вызовов, время с вложенными этапами, собственное время, максимум одного вызова]
+_timers = {}
+_counters = Counter()
+_stack = []
+_profiles = {}
+_profiling = False
+_traces = {}
+
+
+class _NullTimer:
+    """Таймер выключенного инструментирования: один общий объект, ничего не делает"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("name", "started", "children", "profile", "trace")
+
+    def __init__(self, name):
+        self.name = name
+        self.children = 0.0
+        self.profile = None
+        self.trace = None
+
+    def __enter__(self):
+        global _profiling
+        if self.name in _profile_stages and not _profiling:
+            self.profile = _profiles.setdefault(self.name, cProfile.Profile())
+            _profiling = True
+            self.profile.enable()
+        if self.name in _trace_stages and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.trace = tracemalloc.take_snapshot()
+        _stack.append(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        global _profiling
+        elapsed = time.perf_counter() - self.started
+        _stack.pop()
+        if _stack:
+            _stack[-1].children += elapsed
+        _add(self.name, elapsed, elapsed - self.children)
+        if self.profile is not None:
+            self.profile.disable()
+            _profiling = False
+        if self.trace is not None:
+            _record_trace(self.name, self.trace)
+        return False
+
+
+def _add(name, elapsed, own):
+    stats = _timers.get(name)
+    if stats is None:
+        stats = _timers[name] = [0, 0.0, 0.0, 0.0]
+    stats[0] += 1
+    stats[1] += elapsed
+    stats[2] += own
+    if elapsed > stats[3]:
+        stats[3] = elapsed
+
+
+def _record_trace(name, before):
+    """Запоминает пик памяти этапа и самые «тяжёлые» строки того вызова, где пик был наибольшим"""
+    peak = tracemalloc.get_traced_memory()[1]
+    diff = tracemalloc.take_snapshot().compare_to(before, "lineno")
+    tracemalloc.stop()
+    if peak >= _traces.get(name, (0, None))[0]:
+        _traces[name] = (peak, [str(stat) for stat in diff[:TRACEMALLOC_TOP]])
+
+
+def enabled():
+    return _enabled
+
+
+def configure(enabled=True, log_file=None, profile=(), trace=()):
+    """Включает инструментирование в этом процессе и в процессах, которые он запустит.
+
+    profile / trace — этапы, которые снимаются cProfile / tracemalloc; результаты пишутся в profiles/
+    при выходе из процесса (только в этом процессе: в пуле процессов используйте --workers 1).
+    """
+    global _enabled, _log_file
+    _enabled = enabled or bool(profile) or bool(trace)
+    _log_file = log_file
+    _profile_stages.update(profile)
+    _trace_stages.update(trace)
+    if _enabled:
+        os.environ[ENV_ENABLED] = "1"
+        if log_file:
+            os.environ[ENV_LOG] = log_file
+    if profile or trace:
+        atexit.register(write_profiles)
+
+
+def timer(name):
+    """with metrics.timer("clean"): … — время этапа; без инструментирования — общий пустой объект"""
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(name)
+
+
+def observe(name, seconds):
+    """Готовая длительность этапа — для кода, где with timer() не подходит (например, через await:
+    вложенность таймеров общая на поток и у одновременных корутин перепуталась бы)"""
+    if _enabled:
+        _add(name, seconds, seconds)
+
+
+def count(name, n=1):
+    if _enabled:
+        _counters[name] += n
+
+
+def peak_rss_mb():
+    """Пик RSS процесса и, отдельно, его завершившихся дочерних процессов (ru_maxrss в Linux — в КБ)"""
+    import resource
+    scale = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 2 ** 20
+    return round(own, 1), round(children, 1)
+
+
+def snapshot():
+    return {"timers": {name: {"count": s[0], "seconds": s[1], "self_seconds": s[2], "max_seconds": s[3]}
+                       for name, s in _timers.items()},
+            "counters": dict(_counters)}
+
+
+def reset():
+    _timers.clear()
+    _counters.clear()
+
+
+def drain():
+    """Накопленное с прошлого вызова (для передачи из процесса пула в главный) или None"""
+    if not _enabled or not (_timers or _counters):
+        return None
+    delta = snapshot()
+    reset()
+    return delta
+
+
+def merge(delta):
+    """Добавляет результат drain() другого процесса"""
+    if not delta:
+        return
+    for name, s in delta["timers"].items():
+        stats = _timers.get(name)
+        if stats is None:
+            stats = _timers[name] = [0, 0.0, 0.0, 0.0]
+        stats[0] += s["count"]
+        stats[1] += s["seconds"]
+        stats[2] += s["self_seconds"]
+        stats[3] = max(stats[3], s["max_seconds"])
+    _counters.update(delta["counters"])
+
+
+def log(event, **fields):
+    """Структурированная запись журнала: одна JSON-строка в stderr или в файл SEARCH_METRICS_LOG"""
+    if not _enabled:
+        return
+    line = json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, ensure_ascii=False)
+    if _log_file:
+        with open(_log_file, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    else:
+        print(line, file=sys.stderr)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text():
+    """Снимок в текстовом формате Prometheus"""
+    lines = [f"# HELP {PREFIX}_stage_seconds Время этапа вместе с вложенными этапами",
+             f"# TYPE {PREFIX}_stage_seconds summary"]
+    for name, s in sorted(_timers.items()):
+        lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{_label(name)}"}} {s[1]:.9f}')
+        lines.append(f'{PREFIX}_stage_seconds_count{{stage="{_label(name)}"}} {s[0]}')
+    lines += [f"# HELP {PREFIX}_stage_self_seconds_total Время этапа без вложенных этапов",
+              f"# TYPE {PREFIX}_stage_self_seconds_total counter"]
+    for name, s in sorted(_timers.items()):
+        lines.append(f'{PREFIX}_stage_self_seconds_total{{stage="{_label(name)}"}} {s[2]:.9f}')
+    lines += [f"# HELP {PREFIX}_stage_max_seconds Самый долгий вызов этапа",
+              f"# TYPE {PREFIX}_stage_max_seconds gauge"]
+    for name, s in sorted(_timers.items()):
+        lines.append(f'{PREFIX}_stage_max_seconds{{stage="{_label(name)}"}} {s[3]:.9f}')
+    lines += [f"# HELP {PREFIX}_events_total Счётчики событий",
+              f"# TYPE {PREFIX}_events_total counter"]
+    for name, value in sorted(_counters.items()):
+        lines.append(f'{PREFIX}_events_total{{event="{_label(name)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path=METRICS_FILE):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp_path, path)
+
+
+def write_profiles(directory=PROFILES_DIR):
+    """profiles/<этап>.prof (смотреть python -m pstats) и profiles/<этап>.tracemalloc.txt"""
+    if not _profiles and not _traces:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for name, profile in _profiles.items():
+        profile.dump_stats(os.path.join(directory, f"{name}.prof"))
+    for name, (peak, top) in _traces.items():
+        with open(os.path.join(directory, f"{name}.tracemalloc.txt"), "w", encoding="utf-8") as f:
+            f.write(f"Пик памяти этапа {name}: {peak / 1024:.1f} КБ\n")
+            f.write("\n".join(top) + "\n")
+
+
+def _split(value):
+    return {item.strip() for item in (value or "").split(",") if item.strip()}
+
+
+if os.environ.get(ENV_ENABLED) or os.environ.get(ENV_PROFILE) or os.environ.get(ENV_TRACEMALLOC):
+    configure(bool(os.environ.get(ENV_ENABLED)), os.environ.get(ENV_LOG),
+              _split(os.environ.get(ENV_PROFILE)), _split(os.environ.get(ENV_TRACEMALLOC)))
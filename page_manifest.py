@@ -0,0 +1,182 @@
+import os
+import re
+import json
+import zlib
+import marshal
+import hashlib
+import argparse
+
+import metrics
+from text_utils import iter_text, clean_text
+
+PAGES_MANIFEST = "pages_manifest.json"
+PAGE_CACHE_DIR = "page_cache"
+
+# Шингл — SHINGLE_WORDS слов подряд; сигнатура — SIGNATURE_BINS корзин MinHash с одной перестановкой
+SHINGLE_WORDS = 5
+SIGNATURE_BINS = 64
+# Кандидаты в почти дубликаты ищутся по LSH: совпадение хотя бы одной полосы из SIGNATURE_BINS / LSH_BANDS корзин
+LSH_BANDS = 16
+# Страницы с оценкой сходства Жаккара по шинглам не ниже этой — почти дубликаты
+NEAR_DUPLICATE = 0.9
+EMPTY_BIN = 0xFFFFFFFF
+READ_CHUNK = 1 << 20
+WORD_RE = re.compile(r'\w+')
+
+
+def extract_text(path):
+    """Очищенный текст страницы — тот же, что PageResult.text и clean_html"""
+    with open(path, encoding="utf-8") as f:
+        return clean_text(iter_text(f))
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def file_hash(path):
+    """Хеш байтов файла: страница, перекачанная без изменений, отсеивается без извлечения текста"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def signature(text):
+    """MinHash шинглов текста с одной перестановкой: хеш шингла попадает в корзину hash % SIGNATURE_BINS,
+    в корзине остаётся минимум. Один хеш на шингл вместо SIGNATURE_BINS."""
+    words = WORD_RE.findall(text.lower())
+    bins = [EMPTY_BIN] * SIGNATURE_BINS
+    for i in range(max(len(words) - SHINGLE_WORDS, 0) + 1 if words else 0):
+        h = zlib.crc32(" ".join(words[i:i + SHINGLE_WORDS]).encode("utf-8"))
+        b, value = h % SIGNATURE_BINS, h // SIGNATURE_BINS
+        if value < bins[b]:
+            bins[b] = value
+    return bins
+
+
+def similarity(a, b):
+    """Оценка сходства Жаккара по сигнатурам: доля совпавших корзин среди непустых хотя бы в одной"""
+    same = filled = 0
+    for x, y in zip(a, b):
+        if x != EMPTY_BIN or y != EMPTY_BIN:
+            filled += 1
+            same += x == y
+    return same / filled if filled else 1.0
+
+
+class PageManifest:
+    """pages_manifest.json: по каждой странице (mtime, размер) и хеш файла, хеш очищенного текста, сигнатура
+    шинглов и, у дубликатов, номер страницы, которая индексируется вместо них.
+
+    Файл хешируется, только если у него сменились mtime или размер, а текст извлекается, только если
+    сменился и хеш файла; перекачанная страница с тем же текстом изменённой не считается. Разбор страниц (PageResult без Counter) кешируется
+    в page_cache/ вместе с хешем текста, по которому он сделан.
+    """
+
+    def __init__(self, output_dir="."):
+        self.path = os.path.join(output_dir, PAGES_MANIFEST)
+        self.cache_dir = os.path.join(output_dir, PAGE_CACHE_DIR)
+        self.pages = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.pages = json.load(f)
+
+    def save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.pages, f)
+        os.replace(tmp_path, self.path)
+
+    def _cache_file(self, doc_id):
+        return os.path.join(self.cache_dir, f"{doc_id}.bin")
+
+    def scan(self, files):
+        """Обновляет записи страниц [(doc_id, путь)]; возвращает (с новым текстом, удалённые)"""
+        changed, seen = [], set()
+        for doc_id, path in files:
+            seen.add(doc_id)
+            st = os.stat(path)
+            entry = self.pages.get(doc_id)
+            if entry is not None and entry["mtime"] == st.st_mtime_ns and entry["size"] == st.st_size:
+                continue
+            with metrics.timer("manifest.hash"):
+                raw = file_hash(path)
+                if entry is None or entry["file_hash"] != raw:
+                    text = extract_text(path)
+                    digest = text_hash(text)
+                    if entry is None or entry["hash"] != digest:
+                        with metrics.timer("manifest.signature"):
+                            entry = {"hash": digest, "signature": signature(text)}
+                        changed.append(doc_id)
+            entry.update(mtime=st.st_mtime_ns, size=st.st_size, file_hash=raw)
+            self.pages[doc_id] = entry
+        deleted = [doc_id for doc_id in self.pages if doc_id not in seen]
+        for doc_id in deleted:
+            del self.pages[doc_id]
+            if os.path.exists(self._cache_file(doc_id)):
+                os.remove(self._cache_file(doc_id))
+        metrics.count("pages_text_changed", len(changed))
+        return changed, deleted
+
+    def duplicates(self, threshold=NEAR_DUPLICATE):
+        """{дубликат: страница, которая индексируется вместо него} — точные (тот же хеш текста) и почти
+        дубликаты (сходство сигнатур не ниже threshold). Из группы индексируется страница с меньшим номером."""
+        rows = SIGNATURE_BINS // LSH_BANDS
+        originals, bands, result = {}, {}, {}
+        for doc_id in sorted(self.pages, key=int):
+            entry = self.pages[doc_id]
+            bins = entry["signature"]
+            keys = [(band, tuple(bins[band * rows:(band + 1) * rows])) for band in range(LSH_BANDS)]
+            original = originals.get(entry["hash"])
+            if original is None:
+                candidates = sorted({other for key in keys for other in bands.get(key, ())}, key=int)
+                original = next((other for other in candidates
+                                 if similarity(bins, self.pages[other]["signature"]) >= threshold), None)
+            if original is not None:
+                result[doc_id] = entry["duplicate_of"] = original
+                continue
+            entry.pop("duplicate_of", None)
+            originals[entry["hash"]] = doc_id
+            for key in keys:
+                bands.setdefault(key, []).append(doc_id)
+        metrics.count("pages_duplicates", len(result))
+        return result
+
+    def load(self, doc_id, with_index=True):
+        """Сохранённые поля разбора страницы (последнее — текст, None у разбора без индекса), если разбор
+        сделан по её нынешнему тексту и, при with_index, с данными индекса; иначе None"""
+        path = self._cache_file(doc_id)
+        entry = self.pages.get(doc_id)
+        if entry is None or not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            digest, fields = marshal.load(f)
+        if digest != entry["hash"] or (with_index and fields[-1] is None):
+            return None
+        return fields
+
+    def store(self, doc_id, fields):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self._cache_file(doc_id), "wb") as f:
+            marshal.dump((self.pages[doc_id]["hash"], fields), f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Манифест страниц: хеши текста и дубликаты")
+    parser.add_argument("--pages-dir", default="pages")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--threshold", type=float, default=NEAR_DUPLICATE, help="порог сходства почти дубликатов")
+    args = parser.parse_args()
+
+    from indexer import page_files
+    manifest = PageManifest(args.output_dir)
+    changed, deleted = manifest.scan(page_files(args.pages_dir))
+    duplicates = manifest.duplicates(args.threshold)
+    manifest.save()
+    print(f"Страниц: {len(manifest.pages)}, с новым текстом: {len(changed)}, удалено: {len(deleted)}")
+    for doc_id, original in sorted(duplicates.items(), key=lambda item: int(item[0])):
+        kind = "точный" if manifest.pages[doc_id]["hash"] == manifest.pages[original]["hash"] else "почти"
+        similar = similarity(manifest.pages[doc_id]["signature"], manifest.pages[original]["signature"])
+        print(f"{doc_id} → {original} ({kind} дубликат, сходство {similar:.2f})")
@@ -0,0 +1,124 @@
+import sys
+from array import array
+from collections import OrderedDict
+
+from bitmap import Bitmap, Complement
+
+MAX_ENTRIES = 1024
+MAX_BYTES = 64 << 20
+# Подвыражения булевых запросов: их много, но каждое обычно небольшое
+SUB_MAX_ENTRIES = 4096
+SUB_MAX_BYTES = 32 << 20
+
+
+def size_of(value):
+    """Оценка объёма значения в байтах — для ограничения кеша по памяти"""
+    if isinstance(value, Bitmap):
+        return sys.getsizeof(value.containers) + sum(
+            sys.getsizeof(c) for c in value.containers.values())
+    if isinstance(value, Complement):
+        return size_of(value.inner)
+    if isinstance(value, array):
+        return sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(size_of(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """LRU с ограничением по числу записей и по объёму; сбрасывается при смене поколения индекса"""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def sync(self, generation):
+        """Записи, посчитанные по другому поколению индекса, больше не действительны"""
+        if generation != self.generation:
+            if self.entries:
+                self.invalidations += 1
+            self.clear()
+            self.generation = generation
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, size=None):
+        if size is None:
+            size = size_of(value)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        self.entries[key] = (value, size)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {"entries": len(self.entries), "bytes": self.bytes, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hit_rate(), "evictions": self.evictions, "invalidations": self.invalidations}
+
+
+class QueryCache:
+    """Кеш перед поисковым движком.
+
+    parsed     — нормализованный текст запроса → лемматизированный ключ (без повторной лемматизации);
+    results    — ключ → готовая выдача, словоформы одного запроса делят одну запись;
+    subresults — канонический вид подвыражения булева запроса → битмап, общий для разных запросов.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES,
+                 sub_max_entries=SUB_MAX_ENTRIES, sub_max_bytes=SUB_MAX_BYTES):
+        self.parsed = LRUCache(max_entries, max_bytes)
+        self.results = LRUCache(max_entries, max_bytes)
+        self.subresults = LRUCache(sub_max_entries, sub_max_bytes)
+
+    def sync(self, generation):
+        for cache in (self.parsed, self.results, self.subresults):
+            cache.sync(generation)
+
+    def stats(self):
+        return {"parsed": self.parsed.stats(), "results": self.results.stats(),
+                "subresults": self.subresults.stats()}
+
+    def report(self):
+        lines = []
+        for name, stats in self.stats().items():
+            lines.append(f"{name:<11} записей {stats['entries']:>5}, {stats['bytes'] / 1024:>8.1f} КБ, "
+                         f"попаданий {stats['hits']}, промахов {stats['misses']} "
+                         f"({stats['hit_rate'] * 100:.1f}%), вытеснено {stats['evictions']}, "
+                         f"сбросов {stats['invalidations']}")
+        return "\n".join(lines)
+
+
+def normalize_query(query):
+    """Текст запроса без различий в регистре и пробелах"""
+    return " ".join(query.lower().split())
@@ -0,0 +1,365 @@
+import math
+from bisect import bisect_left
+from itertools import repeat
+from operator import sub
+
+import metrics
+from bitmap import Bitmap, Complement
+
+
+class Term:
+    __slots__ = ("term", "size", "cost", "key")
+
+    def __init__(self, term):
+        self.term = term
+
+
+class Not:
+    __slots__ = ("child", "size", "cost", "key")
+
+    def __init__(self, child):
+        self.child = child
+
+
+class And:
+    """Пересечение positives за вычетом объединения negatives (a and not b → разность)"""
+    __slots__ = ("positives", "negatives", "size", "cost", "key")
+
+    def __init__(self, positives, negatives):
+        self.positives = positives
+        self.negatives = negatives
+
+
+class Or:
+    __slots__ = ("children", "size", "cost", "key")
+
+    def __init__(self, children):
+        self.children = children
+
+
+class Phrase:
+    """Леммы подряд: terms[i] стоит на offsets[i] позиций дальше terms[0] (пропуски — стоп-слова фразы)"""
+    __slots__ = ("terms", "offsets", "size", "cost", "key")
+
+    def __init__(self, terms, offsets):
+        self.terms = terms
+        self.offsets = offsets
+
+
+class Near:
+    """Операнды (леммы, фразы или NEAR) не дальше distance слов друг от друга, в любом порядке"""
+    __slots__ = ("left", "right", "distance", "size", "cost", "key")
+
+    def __init__(self, left, right, distance):
+        self.left = left
+        self.right = right
+        self.distance = distance
+
+
+def near_distance(token):
+    """k оператора near/k или None, если token — не NEAR"""
+    if isinstance(token, str) and token.startswith("near/"):
+        return int(token[len("near/"):])
+    return None
+
+
+def positional_terms(node):
+    """Различные леммы позиционного поддерева"""
+    if isinstance(node, Term):
+        return [node.term]
+    if isinstance(node, Phrase):
+        return list(dict.fromkeys(node.terms))
+    return list(dict.fromkeys(positional_terms(node.left) + positional_terms(node.right)))
+
+
+def build_tree(rpn):
+    """Дерево запроса из ОПЗ; вложенные AND/OR одного вида сразу сливаются в n-арные узлы.
+
+    Фраза в ОПЗ — кортеж пар (лемма, смещение от первого слова), NEAR — оператор «near/k».
+    """
+    stack = []
+    for token in rpn:
+        distance = near_distance(token)
+        if (token in ("not", "and", "or") or distance is not None) and len(stack) < (1 if token == "not" else 2):
+            raise ValueError(f"у оператора {token} не хватает операндов")
+        if distance is not None:
+            right = stack.pop()
+            left = stack.pop()
+            if not all(isinstance(node, (Term, Phrase, Near)) for node in (left, right)):
+                raise ValueError(f"{token} применяется только к словам и фразам")
+            stack.append(Near(left, right, distance))
+        elif isinstance(token, tuple):
+            terms = [term for term, _ in token]
+            stack.append(Term(terms[0]) if len(token) == 1 else Phrase(terms, [offset for _, offset in token]))
+        elif token == "not":
+            child = stack.pop()
+            stack.append(child.child if isinstance(child, Not) else Not(child))
+        elif token in ("and", "or"):
+            right = stack.pop()
+            left = stack.pop()
+            stack.append(_merge(token, left, right))
+        else:
+            stack.append(Term(token))
+    return stack[0] if stack else None
+
+
+def _merge(op, left, right):
+    if op == "or":
+        children = []
+        for node in (left, right):
+            children.extend(node.children if isinstance(node, Or) else [node])
+        return Or(children)
+
+    positives, negatives = [], []
+    for node in (left, right):
+        if isinstance(node, And):
+            positives.extend(node.positives)
+            negatives.extend(node.negatives)
+        elif isinstance(node, Not):
+            negatives.append(node.child)
+        else:
+            positives.append(node)
+    return And(positives, negatives)
+
+
+def canonical(node):
+    """Канонический вид поддерева — ключ кеша подвыражений; операнды AND/OR упорядочены,
+    поэтому «a and b» и «b and a» дают один ключ. Ключи проставляются во всех узлах"""
+    if isinstance(node, Term):
+        node.key = node.term
+    elif isinstance(node, Phrase):
+        node.key = f"phrase({','.join(f'{term}@{offset}' for term, offset in zip(node.terms, node.offsets))})"
+    elif isinstance(node, Near):
+        node.key = f"near/{node.distance}({','.join(sorted((canonical(node.left), canonical(node.right))))})"
+    elif isinstance(node, Not):
+        node.key = f"not({canonical(node.child)})"
+    elif isinstance(node, Or):
+        node.key = f"or({','.join(sorted(canonical(c) for c in node.children))})"
+    else:
+        positives = ",".join(sorted(canonical(c) for c in node.positives))
+        negatives = ",".join(sorted(canonical(c) for c in node.negatives))
+        node.key = f"and({positives};{negatives})"
+    return node.key
+
+
+def _doc_freq(index, term):
+    if hasattr(index, "doc_freq"):
+        return index.doc_freq(term)
+    return len(index.get(term, []))
+
+
+def plan(node, index, n_docs):
+    """Оценивает размер результата и стоимость каждого узла и упорядочивает операнды по ним"""
+    if isinstance(node, Term):
+        node.size = _doc_freq(index, node.term)
+        node.cost = node.size
+    elif isinstance(node, (Phrase, Near)):
+        if isinstance(node, Near):
+            plan(node.left, index, n_docs)
+            plan(node.right, index, n_docs)
+        # Как AND своих лемм (оценка размера сверху) плюс слияние позиций в каждом кандидате
+        sizes = sorted(_doc_freq(index, term) for term in positional_terms(node))
+        node.size = sizes[0]
+        node.cost = sizes[0] * (1 + sum(math.log2(size + 2) for size in sizes[1:]) + len(sizes))
+    elif isinstance(node, Not):
+        plan(node.child, index, n_docs)
+        node.size = n_docs - node.child.size
+        node.cost = node.child.cost
+    elif isinstance(node, Or):
+        for child in node.children:
+            plan(child, index, n_docs)
+        node.children.sort(key=lambda c: c.size)
+        node.size = min(n_docs, sum(c.size for c in node.children))
+        node.cost = sum(c.cost for c in node.children) + node.size
+    else:
+        for child in node.positives + node.negatives:
+            plan(child, index, n_docs)
+        # Начинаем с самого редкого операнда; вычитаем сначала самые большие множества
+        node.positives.sort(key=lambda c: c.size)
+        node.negatives.sort(key=lambda c: -c.size)
+        if node.positives:
+            smallest = node.positives[0].size
+            node.size = smallest
+            # Галопирующее пересечение: ~ |меньший| * log |больший| на каждый следующий операнд
+            node.cost = node.positives[0].cost + sum(
+                c.cost if not isinstance(c, Term) else smallest * math.log2(c.size + 2)
+                for c in node.positives[1:])
+        else:
+            node.size = n_docs - max(c.size for c in node.negatives)
+            node.cost = 0
+        node.cost += sum(c.cost for c in node.negatives)
+    return node
+
+
+def gallop_intersect(small, large):
+    """Пересечение отсортированных списков: для каждого элемента меньшего — экспоненциальный поиск в большем"""
+    result = []
+    lo = 0
+    n = len(large)
+    for x in small:
+        bound = 1
+        while lo + bound < n and large[lo + bound] < x:
+            bound *= 2
+        lo = bisect_left(large, x, lo + bound // 2, min(lo + bound + 1, n))
+        if lo == n:
+            break
+        if large[lo] == x:
+            result.append(x)
+    return result
+
+
+def _spans(node, positions, doc_id):
+    """Вхождения позиционного поддерева в документ: отсортированные (первая позиция, последняя позиция)"""
+    if isinstance(node, Term):
+        return [(p, p) for p in positions[node.term].get(doc_id, ())]
+    if isinstance(node, Phrase):
+        # Пересечение списков позиций, сдвинутых на смещение слова во фразе: остаются начала фразы
+        starts = set(positions[node.terms[0]].get(doc_id, ()))
+        for term, offset in zip(node.terms[1:], node.offsets[1:]):
+            if not starts:
+                return []
+            starts.intersection_update(map(sub, positions[term].get(doc_id, ()), repeat(offset)))
+        return [(p, p + node.offsets[-1]) for p in sorted(starts)]
+
+    left = _spans(node.left, positions, doc_id)
+    right = _spans(node.right, positions, doc_id) if left else []
+    if not right:
+        return []
+    k = node.distance
+    right_starts = [start for start, _ in right]
+    longest = max(end - start for start, end in right)
+    result = set()
+    for l_start, l_end in left:
+        # Кандидаты справа: начало не дальше k слов после левого и не раньше, чем позволяет самая длинная правая часть
+        i = bisect_left(right_starts, l_start - k - longest)
+        while i < len(right) and right[i][0] <= l_end + k:
+            r_start, r_end = right[i]
+            i += 1
+            if (r_start, r_end) != (l_start, l_end) and max(r_start - l_end, l_start - r_end) <= k:
+                result.add((min(l_start, r_start), max(l_end, r_end)))
+    return sorted(result)
+
+
+def execute_positional(node, index):
+    """Фраза или NEAR: сначала пересечение списков документов, затем позиции только у оставшихся кандидатов"""
+    postings = sorted((index.get(term, []) for term in positional_terms(node)), key=len)
+    candidates = postings[0]
+    for other in postings[1:]:
+        if not candidates:
+            break
+        candidates = gallop_intersect(candidates, other)
+    if not candidates:
+        return Bitmap.from_sorted([])
+    positions = {}
+    for term in positional_terms(node):
+        positions[term] = index.positions(term, candidates)
+    return Bitmap.from_sorted([doc_id for doc_id in candidates if _spans(node, positions, doc_id)])
+
+
+def execute(node, index, cache=None):
+    """Выполняет план; результат — Bitmap или ленивое дополнение Complement.
+
+    cache — LRUCache подвыражений: результаты узлов AND/OR (ключ — canonical) переиспользуются
+    между запросами. Битмапы не изменяются на месте, поэтому их можно отдавать из кеша как есть.
+    """
+    if isinstance(node, Term):
+        return Bitmap.from_sorted(index.get(node.term, []))
+    if isinstance(node, Not):
+        return ~execute(node.child, index, cache)
+    if cache is None:
+        return _execute(node, index, None)
+    result = cache.get(node.key)
+    if result is None:
+        result = _execute(node, index, cache)
+        cache.put(node.key, result)
+    return result
+
+
+def _execute(node, index, cache):
+    if isinstance(node, (Phrase, Near)):
+        return execute_positional(node, index)
+    if isinstance(node, Or):
+        result = execute(node.children[0], index, cache)
+        for child in node.children[1:]:
+            result = result | execute(child, index, cache)
+        return result
+
+    terms = [c for c in node.positives if isinstance(c, Term)]
+    others = [c for c in node.positives if not isinstance(c, Term)]
+    result = None
+    if terms:
+        postings = index.get(terms[0].term, [])
+        for term in terms[1:]:
+            if not postings:
+                break
+            postings = gallop_intersect(postings, index.get(term.term, []))
+        result = Bitmap.from_sorted(postings)
+    for child in others:
+        if result is not None and not result:
+            break
+        value = execute(child, index, cache)
+        result = value if result is None else result & value
+
+    if result is None:
+        # Только отрицания: not a and not b = not (a or b)
+        excluded = execute(node.negatives[0], index, cache)
+        for child in node.negatives[1:]:
+            excluded = excluded | execute(child, index, cache)
+        return ~excluded
+
+    for child in node.negatives:
+        if isinstance(result, Bitmap) and not result:
+            break
+        result = result & ~execute(child, index, cache)
+    return result
+
+
+def explain(node, indent=0):
+    """Текстовое описание выбранного плана с оценками размера и стоимости"""
+    pad = "  " * indent
+    if isinstance(node, Term):
+        return f"{pad}TERM {node.term} (df={node.size})"
+    if isinstance(node, Phrase):
+        return f"{pad}PHRASE \"{' '.join(node.terms)}\" (≤{node.size} док., cost≈{node.cost:.0f})"
+    if isinstance(node, Near):
+        lines = [f"{pad}NEAR/{node.distance} (≤{node.size} док., cost≈{node.cost:.0f})"]
+        lines.extend(explain(c, indent + 1) for c in (node.left, node.right))
+        return "\n".join(lines)
+    if isinstance(node, Not):
+        lines = [f"{pad}NOT (≈{node.size} док., cost≈{node.cost:.0f})"]
+        lines.append(explain(node.child, indent + 1))
+    elif isinstance(node, Or):
+        lines = [f"{pad}OR (≈{node.size} док., cost≈{node.cost:.0f})"]
+        lines.extend(explain(c, indent + 1) for c in node.children)
+    else:
+        kind = "AND" if node.positives else "AND-NOT"
+        gallop = sum(isinstance(c, Term) for c in node.positives) > 1
+        lines = [f"{pad}{kind} (≈{node.size} док., cost≈{node.cost:.0f}{', галопирующее пересечение' if gallop else ''})"]
+        lines.extend(explain(c, indent + 1) for c in node.positives)
+        if node.negatives:
+            lines.append(f"{pad}  MINUS")
+            lines.extend(explain(c, indent + 2) for c in node.negatives)
+    return "\n".join(lines)
+
+
+def run(rpn, index, universe, show_plan=False, cache=None):
+    """Строит план по ОПЗ, при необходимости печатает его и выполняет"""
+    return run_tree(build_tree(rpn), index, universe, show_plan, cache)
+
+
+def run_tree(tree, index, universe, show_plan=False, cache=None):
+    if tree is None:
+        return []
+    if cache is not None:
+        canonical(tree)
+    if not isinstance(universe, Bitmap):
+        universe = Bitmap.from_iterable(universe)
+    with metrics.timer("boolean.plan"):
+        plan(tree, index, len(universe))
+    if show_plan:
+        print(explain(tree))
+    with metrics.timer("boolean.evaluate"):
+        result = execute(tree, index, cache)
+        if isinstance(result, Complement):
+            result = result.materialize(universe)
+        return result.to_list()
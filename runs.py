@@ -0,0 +1,104 @@
+import os
+import heapq
+import struct
+import tempfile
+from itertools import groupby
+from operator import itemgetter
+
+import metrics
+
+# Столько прогонов сливается за один проход; если их больше, слияние идёт в несколько проходов
+MERGE_FAN_IN = 64
+# Оценка памяти на ключ в буфере сверх самих данных: запись словаря, строка, список и bytearray полей
+ENTRY_OVERHEAD = 200
+READ_BUFFER = 1 << 16
+
+
+class Runs:
+    """Частичные списки в духе SPIMI: ключ (строка) → n_fields полей-байтов, которые дописываются по мере
+    поступления документов.
+
+    Пока оценка объёма буфера меньше budget байт, всё лежит в памяти; дальше буфер сбрасывается в каталог
+    directory прогоном, отсортированным по ключу, и начинается заново. merged() сливает прогоны k-путевым
+    слиянием: для каждого ключа поля всех прогонов склеиваются в порядке их записи — документы поступают
+    по возрастанию номеров, поэтому склейка и есть итоговый список. budget=None — без сброса на диск.
+    """
+
+    def __init__(self, n_fields, budget=None, directory=None):
+        self.n_fields = n_fields
+        self.budget = budget
+        self.directory = directory
+        self.record = struct.Struct(f"<I{n_fields}Q")
+        self.buffer = {}
+        self.size = 0
+        self.paths = []
+        # Сколько раз буфер сбрасывался на диск
+        self.flushed = 0
+
+    def add(self, key, *fields):
+        entry = self.buffer.get(key)
+        if entry is None:
+            entry = self.buffer[key] = [bytearray() for _ in range(self.n_fields)]
+            self.size += ENTRY_OVERHEAD + len(key)
+        for part, data in zip(entry, fields):
+            part += data
+            self.size += len(data)
+        if self.budget is not None and self.size >= self.budget:
+            self.flush()
+
+    def flush(self):
+        """Сбрасывает буфер на диск отсортированным прогоном"""
+        if not self.buffer:
+            return
+        with metrics.timer("spimi.flush"):
+            self.paths.append(self._write(
+                (key, self.buffer[key]) for key in sorted(self.buffer)))
+        metrics.count("spimi_runs")
+        self.flushed += 1
+        self.buffer = {}
+        self.size = 0
+
+    def _write(self, records):
+        fd, path = tempfile.mkstemp(prefix="run_", suffix=".bin", dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            for key, fields in records:
+                data = key.encode("utf-8")
+                f.write(self.record.pack(len(data), *map(len, fields)))
+                f.write(data)
+                for part in fields:
+                    f.write(part)
+        return path
+
+    def _read(self, path):
+        """Записи прогона (ключ, поля); файл удаляется, когда прочитан"""
+        with open(path, "rb", READ_BUFFER) as f:
+            while True:
+                header = f.read(self.record.size)
+                if not header:
+                    break
+                key_length, *lengths = self.record.unpack(header)
+                key = f.read(key_length).decode("utf-8")
+                yield key, [f.read(length) for length in lengths]
+        os.remove(path)
+
+    def _merge(self, paths):
+        # heapq.merge при равных ключах отдаёт записи в порядке прогонов — порядок документов сохраняется
+        records = heapq.merge(*(self._read(path) for path in paths), key=itemgetter(0))
+        for key, group in groupby(records, key=itemgetter(0)):
+            yield key, [b"".join(parts) for parts in zip(*(fields for _, fields in group))]
+
+    def merged(self):
+        """(ключ, [поле, …]) по возрастанию ключей; каждое поле — байты всех прогонов подряд"""
+        if not self.paths:
+            for key in sorted(self.buffer):
+                yield key, self.buffer[key]
+            self.buffer = {}
+            return
+        self.flush()
+        with metrics.timer("spimi.merge"):
+            while len(self.paths) > MERGE_FAN_IN:
+                # Соседние прогоны сливаются группами, чтобы порядок документов между группами не нарушился
+                self.paths = [self._write(self._merge(self.paths[i:i + MERGE_FAN_IN]))
+                              for i in range(0, len(self.paths), MERGE_FAN_IN)]
+        paths, self.paths = self.paths, []
+        yield from self._merge(paths)
@@ -0,0 +1,286 @@
+import os
+import json
+import math
+import time
+import asyncio
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from aiohttp import web
+
+import metrics
+import boolean_search
+import vector_search
+import snippets
+from bitmap import Bitmap
+from query_cache import QueryCache
+
+HOST = "127.0.0.1"
+PORT = 8080
+MODES = ("boolean", "vector")
+DEFAULT_LIMIT = 15
+MAX_LIMIT = 1000
+MAX_BATCH = 256
+# Сколько запросов может одновременно ждать обработчиков; сверх этого сервер отвечает 503
+MAX_PENDING = 256
+# Как часто процесс-обработчик проверяет, не сменилось ли поколение индекса, с
+RELOAD_INTERVAL = 1.0
+
+
+class Engines:
+    """Оба движка в процессе-обработчике: индекс открывается один раз, кеш запросов — свой у процесса"""
+
+    def __init__(self):
+        self.url_map = vector_search.load_url_map()
+        self.caches = {mode: QueryCache() for mode in MODES}
+        self.boolean = None
+        self.universe = None
+        self.texts = None
+        self.vector = None
+        self.checked = 0.0
+        self.reload()
+
+    def reload(self):
+        """Переоткрывает индекс, у которого сменилось поколение; кеши сбросятся сами при следующем запросе"""
+        if self.boolean is None or self.boolean.generation != boolean_search.index_generation():
+            old, old_texts = self.boolean, self.texts
+            self.boolean, doc_ids = boolean_search.build_index()
+            self.universe = Bitmap.from_sorted(doc_ids)
+            self.texts = boolean_search.open_texts(self.boolean)
+            if old is not None:
+                old.close()
+            if old_texts is not None and old_texts is not old:
+                old_texts.close()
+        if self.vector is None or self.vector.generation != vector_search.index_generation():
+            old = self.vector
+            self.vector = vector_search.load_index()
+            if old is not None:
+                old.close()
+        self.checked = time.monotonic()
+
+    def url(self, doc_id):
+        return self.url_map.get(doc_id, f"pages/{doc_id}.html")
+
+    def search(self, mode, query, offset, limit, with_snippets=False):
+        if time.monotonic() - self.checked > RELOAD_INTERVAL:
+            self.reload()
+        if mode == "boolean":
+            doc_ids = boolean_search.search(self.boolean, self.universe, query, cache=self.caches[mode])
+            result = {"total": len(doc_ids), "has_more": len(doc_ids) > offset + limit,
+                      "results": [{"doc_id": doc_id, "url": self.url(str(doc_id))}
+                                  for doc_id in doc_ids[offset:offset + limit]]}
+        else:
+            # Для векторного поиска полный размер выдачи не считается: top-k на одну позицию больше страницы
+            hits = self.vector.search_top_k(query, self.url_map, offset + limit + 1, self.caches[mode])
+            result = {"total": None, "has_more": len(hits) > offset + limit,
+                      "results": [{"doc_id": int(doc_id), "score": score, "url": url}
+                                  for score, doc_id, url in hits[offset:offset + limit]]}
+        if with_snippets:
+            self.add_snippets(mode, query, result["results"])
+        return result
+
+    def add_snippets(self, mode, query, results):
+        """snippet и highlights (позиции подсвеченных словоформ в snippet) — по хранилищу текстов индекса"""
+        if mode == "boolean":
+            lemmas = boolean_search.query_lemmas(query, self.boolean)
+        else:
+            lemmas = vector_search.query_to_vector(query, self.vector.idf_dict, self.vector.dictionary_for(query))
+        if self.texts is None:
+            page = [None] * len(results)
+        else:
+            page = snippets.page_snippets([r["doc_id"] for r in results], self.texts, snippets.Highlighter(lemmas))
+        for r, snippet in zip(results, page):
+            r["snippet"], r["highlights"] = snippet if snippet is not None else (None, [])
+
+
+_engines = None
+
+
+def _init_worker():
+    global _engines
+    _engines = Engines()
+
+
+def _search_one(mode, query, offset, limit, with_snippets):
+    # Некорректный запрос пакета получает свою ошибку и не роняет остальные
+    try:
+        return _engines.search(mode, query, offset, limit, with_snippets)
+    except ValueError as e:
+        return {"error": f"некорректный запрос: {e}"}
+
+
+def _search_many(mode, queries, offset, limit, with_snippets):
+    # Таймеры этапов процесса-обработчика уходят в главный процесс вместе с ответом
+    return [_search_one(mode, query, offset, limit, with_snippets) for query in queries], metrics.drain()
+
+
+def _ready():
+    return os.getpid()
+
+
+class SearchService:
+    """Приём запросов на event loop, подсчёт score в пуле процессов, отказ 503 при переполнении очереди"""
+
+    def __init__(self, workers, max_pending=MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.stats = Counter()
+        self.pool = ProcessPoolExecutor(workers, initializer=_init_worker)
+
+    async def start(self):
+        # Обработчики запускаются и загружают индекс до первого запроса
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, _ready) for _ in range(self.workers)))
+        print(f"Обработчиков запущено: {self.workers}")
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    async def search(self, mode, queries, offset, limit, with_snippets=False):
+        """Пакет делится между обработчиками поровну; порядок ответов совпадает с порядком запросов"""
+        # Пустая очередь принимает пакет любого размера, иначе большие пакеты никогда бы не прошли
+        if self.pending and self.pending + len(queries) > self.max_pending:
+            self.stats["rejected"] += 1
+            metrics.count("http_rejected")
+            raise json_error(web.HTTPServiceUnavailable, "сервер перегружен, повторите запрос позже",
+                             headers={"Retry-After": "1"})
+        self.pending += len(queries)
+        self.stats["requests"] += 1
+        self.stats["queries"] += len(queries)
+        try:
+            loop = asyncio.get_running_loop()
+            size = math.ceil(len(queries) / self.workers)
+            started = time.perf_counter()
+            parts = await asyncio.gather(*(
+                loop.run_in_executor(self.pool, _search_many, mode, queries[i:i + size], offset, limit, with_snippets)
+                for i in range(0, len(queries), size)))
+            metrics.observe(f"http.{mode}", time.perf_counter() - started)
+        finally:
+            self.pending -= len(queries)
+        results = []
+        for part, delta in parts:
+            metrics.merge(delta)
+            results.extend(part)
+        return results
+
+
+def json_error(error_class, message, **kwargs):
+    return error_class(content_type="application/json",
+                       text=json.dumps({"error": message}, ensure_ascii=False), **kwargs)
+
+
+def bad_request(message):
+    return json_error(web.HTTPBadRequest, message)
+
+
+def parse_params(params):
+    """mode, offset, limit и нужны ли сниппеты — из параметров запроса или JSON-тела"""
+    mode = params.get("mode", "boolean")
+    if mode not in MODES:
+        raise bad_request(f"mode: одно из {', '.join(MODES)}")
+    try:
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", DEFAULT_LIMIT))
+    except (TypeError, ValueError):
+        raise bad_request("offset и limit должны быть целыми числами")
+    if offset < 0 or not 0 < limit <= MAX_LIMIT:
+        raise bad_request(f"offset >= 0, 0 < limit <= {MAX_LIMIT}")
+    with_snippets = params.get("snippets", False) in (True, 1, "1", "true")
+    return mode, offset, limit, with_snippets
+
+
+async def read_json(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise bad_request("тело запроса должно быть JSON-объектом")
+    if not isinstance(body, dict):
+        raise bad_request("тело запроса должно быть JSON-объектом")
+    return body
+
+
+async def handle_search(request):
+    """GET /search?q=...&mode=boolean|vector&offset=0&limit=15&snippets=1 или POST с теми же полями в JSON"""
+    params = request.query if request.method == "GET" else await read_json(request)
+    query = params.get("q", "")
+    if not isinstance(query, str) or not query.strip():
+        raise bad_request("пустой запрос q")
+    mode, offset, limit, with_snippets = parse_params(params)
+    started = time.perf_counter()
+    result, = await request.app["service"].search(mode, [query], offset, limit, with_snippets)
+    if "error" in result:
+        raise bad_request(result["error"])
+    metrics.log("query", engine=mode, query=query, offset=offset, limit=limit, results=len(result["results"]),
+                ms=round((time.perf_counter() - started) * 1000, 3))
+    return web.json_response({"query": query, "mode": mode, "offset": offset, "limit": limit, **result,
+                              "took_ms": round((time.perf_counter() - started) * 1000, 3)})
+
+
+async def handle_batch(request):
+    """POST /search/batch {"queries": [...], "mode": ..., "offset": ..., "limit": ..., "snippets": ...};
+    у некорректного запроса вместо выдачи — {"query": ..., "error": ...}, остальные отвечаются как обычно"""
+    body = await read_json(request)
+    queries = body.get("queries")
+    if (not isinstance(queries, list) or not queries or len(queries) > MAX_BATCH
+            or not all(isinstance(q, str) and q.strip() for q in queries)):
+        raise bad_request(f"queries: от 1 до {MAX_BATCH} непустых строк")
+    mode, offset, limit, with_snippets = parse_params(body)
+    started = time.perf_counter()
+    results = await request.app["service"].search(mode, queries, offset, limit, with_snippets)
+    return web.json_response({"mode": mode, "offset": offset, "limit": limit,
+                              "results": [{"query": q, **r} for q, r in zip(queries, results)],
+                              "took_ms": round((time.perf_counter() - started) * 1000, 3)})
+
+
+async def handle_metrics(request):
+    """Снимок таймеров и счётчиков главного процесса и обработчиков в формате Prometheus"""
+    if not metrics.enabled():
+        raise json_error(web.HTTPNotFound, f"инструментирование выключено, запустите с {metrics.ENV_ENABLED}=1")
+    return web.Response(text=metrics.prometheus_text(), content_type="text/plain")
+
+
+async def handle_health(request):
+    service = request.app["service"]
+    return web.json_response({"status": "ok", "workers": service.workers, "pending": service.pending,
+                              "max_pending": service.max_pending, **service.stats})
+
+
+def make_app(workers, max_pending=MAX_PENDING):
+    app = web.Application()
+    service = SearchService(workers, max_pending)
+    app["service"] = service
+
+    async def on_startup(app):
+        await service.start()
+
+    async def on_cleanup(app):
+        service.close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_get("/search", handle_search)
+    app.router.add_post("/search", handle_search)
+    app.router.add_post("/search/batch", handle_batch)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP/JSON сервер булева и векторного поиска")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="процессов для подсчёта score")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING,
+                        help="сколько запросов может ждать обработчиков, дальше — 503")
+    args = parser.parse_args()
+
+    # Индекс собирается заранее (indexer.py или segments.py sync), сервер и обработчики только читают его
+    try:
+        index, _ = boolean_search.build_index()
+    except FileNotFoundError as e:
+        raise SystemExit(str(e))
+    index.close()
+    web.run_app(make_app(args.workers, args.max_pending), host=args.host, port=args.port)
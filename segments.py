@@ -0,0 +1,449 @@
+import os
+import json
+import math
+import time
+import fcntl
+import heapq
+import argparse
+import threading
+from array import array
+from itertools import groupby
+from collections import Counter
+
+import metrics
+from binary_index import INDEX_BIN, BinaryIndex, write_binary_index
+from doc_store import DocStore, write_doc_store
+from tfidf_store import TFIDF_STORE, build_store
+from indexer import (PAGES_DIR, TFIDF_TERMS_DIR, TFIDF_LEMMAS_DIR, analyze_files, page_files,
+                     lemma_counts_of, tfidf_values, write_doc_tfidf, write_norms, write_bounds,
+                     add_lemma_forms, read_lemma_forms, write_lemma_forms)
+from term_vectors import CompactVectors
+from lemmatizer import Lemmatizer
+from page_manifest import extract_text, text_hash
+
+SEGMENTS_DIR = "index_segments"
+MANIFEST = "manifest.json"
+PAGES_STATE = "pages.json"
+LOCK_FILE = ".lock"
+
+# Политика слияния: сегменты одного «яруса» (по log_MERGE_FACTOR числа документов) сливаются,
+# когда их набирается MERGE_FACTOR; сегмент, в котором удалена большая часть документов, переписывается
+MERGE_FACTOR = 4
+MAX_DELETED_RATIO = 0.5
+
+_merge_lock = threading.Lock()
+
+
+def _path(segments_dir, name):
+    return os.path.join(segments_dir, name)
+
+
+def _load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class _DirLock:
+    """Межпроцессная блокировка каталога сегментов на время фиксации изменений"""
+
+    def __init__(self, segments_dir):
+        self.path = _path(segments_dir, LOCK_FILE)
+
+    def __enter__(self):
+        self.f = open(self.path, "w")
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+def load_manifest(segments_dir):
+    return _load_json(_path(segments_dir, MANIFEST), {"generation": 0, "next_segment": 1, "segments": []})
+
+
+def _docs_file(segments_dir, name):
+    return _path(segments_dir, f"{name}.docs.json")
+
+
+def _texts_file(segments_dir, name):
+    return _path(segments_dir, f"{name}.text.bin")
+
+
+def _open_texts(segments_dir, name):
+    """Тексты сегмента или None — у сегментов, записанных до хранилища текстов, его нет"""
+    path = _texts_file(segments_dir, name)
+    return DocStore(path) if os.path.exists(path) else None
+
+
+def _write_segment(segments_dir, name, postings, docs, positions=None, texts=()):
+    """Сегмент — бинарный индекс (binary_index) с позициями лемм, статистика его документов для TF-IDF
+    и очищенные тексты документов (doc_store)"""
+    write_binary_index(_path(segments_dir, f"{name}.bin"), postings, [int(d) for d in docs], positions)
+    write_doc_store(_texts_file(segments_dir, name), texts)
+    _save_json(_docs_file(segments_dir, name), docs)
+
+
+def _tier(n_docs):
+    return int(math.log(max(n_docs, 1), MERGE_FACTOR))
+
+
+class SegmentedIndex:
+    """Индекс из нескольких сегментов: списки документов сливаются, удалённые документы отбрасываются"""
+
+    def __init__(self, segments_dir=SEGMENTS_DIR):
+        while True:
+            manifest = load_manifest(segments_dir)
+            try:
+                self.segments = [
+                    (BinaryIndex(_path(segments_dir, f"{segment['name']}.bin")), set(segment["deleted"]))
+                    for segment in manifest["segments"]]
+                self.texts = [_open_texts(segments_dir, segment["name"]) for segment in manifest["segments"]]
+                break
+            except FileNotFoundError:
+                # Фоновое слияние успело удалить сегмент — перечитываем манифест
+                continue
+        self.generation = manifest["generation"]
+        self.doc_ids = sorted(d for binary, deleted in self.segments for d in binary.doc_ids if d not in deleted)
+        self.term_dictionary = None
+
+    def get(self, term, default=None):
+        lists = []
+        for binary, deleted in self.segments:
+            postings = binary.get(term)
+            if postings:
+                lists.append(array("I", (d for d in postings if d not in deleted)) if deleted else postings)
+        if not lists:
+            return default
+        return lists[0] if len(lists) == 1 else array("I", heapq.merge(*lists))
+
+    def positions(self, term, doc_ids):
+        """Позиции термина в живых документах doc_ids; старые версии документа в других сегментах пропускаются"""
+        result = {}
+        for binary, deleted in self.segments:
+            result.update(binary.positions(term, [d for d in doc_ids if d not in deleted] if deleted else doc_ids))
+        return result
+
+    def terms(self):
+        """Леммы всех сегментов по возрастанию, без повторов (леммы только удалённых документов тоже)"""
+        return (term for term, _ in groupby(heapq.merge(*(binary.terms() for binary, _ in self.segments))))
+
+    def text(self, doc_id, default=None):
+        """Очищенный текст живой версии документа"""
+        for (_, deleted), store in zip(self.segments, self.texts):
+            if store is not None and int(doc_id) not in deleted:
+                text = store.text(doc_id)
+                if text is not None:
+                    return text
+        return default
+
+    def doc_freq(self, term):
+        """Оценка сверху: удалённые, но ещё не вычищенные слиянием документы тоже считаются"""
+        return sum(binary.doc_freq(term) for binary, _ in self.segments)
+
+    def __contains__(self, term):
+        return bool(self.get(term))
+
+    def close(self):
+        for binary, _ in self.segments:
+            binary.close()
+        for store in self.texts:
+            if store is not None:
+                store.close()
+
+
+def scan_changes(pages_dir, pages_state):
+    """Сравнивает pages/ с запомненными (mtime, размер): добавленные, изменённые и удалённые страницы.
+
+    Страница с новым mtime, но прежним хешем очищенного текста (перекачанная без изменений) изменённой
+    не считается: в pages_state у неё только обновляются mtime и размер. Возвращает
+    (изменённые, удалённые, число таких обновлённых записей).
+    """
+    changed, seen = [], set()
+    refreshed = 0
+    for doc_id, path in page_files(pages_dir):
+        seen.add(doc_id)
+        st = os.stat(path)
+        state = pages_state.get(doc_id)
+        if state is None or state["mtime"] != st.st_mtime_ns or state["size"] != st.st_size:
+            if state is not None and state.get("hash") == text_hash(extract_text(path)):
+                state.update(mtime=st.st_mtime_ns, size=st.st_size)
+                refreshed += 1
+            else:
+                changed.append((doc_id, path))
+    deleted = [doc_id for doc_id in pages_state if doc_id not in seen]
+    return changed, deleted, refreshed
+
+
+def sync(pages_dir=PAGES_DIR, segments_dir=SEGMENTS_DIR, output_dir=".", workers=1,
+         lemmatizer=None, background_merge=True):
+    """Подхватывает изменения в pages/ новым сегментом и пометками об удалении.
+
+    Весь индекс не переписывается: разбираются только новые и изменённые страницы. Файлы TF-IDF
+    не трогаются — IDF по текущему корпусу применяет load_vectors при загрузке.
+    """
+    os.makedirs(segments_dir, exist_ok=True)
+    with _DirLock(segments_dir):
+        manifest = load_manifest(segments_dir)
+        pages_state = _load_json(_path(segments_dir, PAGES_STATE), {})
+
+        changed, deleted, refreshed = scan_changes(pages_dir, pages_state)
+        if not changed and not deleted:
+            if refreshed:
+                _save_json(_path(segments_dir, PAGES_STATE), pages_state)
+            if manifest["segments"] and not is_active(segments_dir, os.path.join(output_dir, INDEX_BIN)):
+                # Полная сборка новее, но страницы с тех пор не менялись — сегменты снова становятся текущими
+                manifest["generation"] += 1
+                manifest["synced_ns"] = time.time_ns()
+                _save_json(_path(segments_dir, MANIFEST), manifest)
+            return SegmentedIndex(segments_dir)
+        started = time.perf_counter()
+
+        if lemmatizer is None:
+            lemmatizer = Lemmatizer()
+        with metrics.timer("analyze"):
+            results = analyze_files(changed, workers, lemmatizer=lemmatizer)
+        lemmatizer.save()
+        if results:
+            # Словоформы новых страниц дописываются в lemma_lookup.txt: по нему поиск лемматизирует запросы
+            # и подсвечивает сниппеты. Формы удалённых страниц остаются — лемма словоформы от этого не меняется
+            with metrics.timer("global_write"):
+                forms = read_lemma_forms(output_dir)
+                for result in results:
+                    add_lemma_forms(forms, result)
+                write_lemma_forms(forms, output_dir)
+
+        # Старые версии изменённых и удалённых страниц помечаются удалёнными в своих сегментах
+        segments = {segment["name"]: segment for segment in manifest["segments"]}
+        for doc_id in deleted + [doc_id for doc_id, _ in changed if doc_id in pages_state]:
+            name = pages_state.pop(doc_id)["segment"]
+            segments[name]["deleted"].append(int(doc_id))
+
+        if results:
+            name = f"seg_{manifest['next_segment']:06d}"
+            manifest["next_segment"] += 1
+            postings, positions, docs = {}, {}, {}
+            texts = [(result.doc_id, result.text) for result in results]
+            for result in results:
+                for lemma in result.index_lemmas:
+                    postings.setdefault(lemma, []).append(int(result.doc_id))
+                    positions.setdefault(lemma, {})[int(result.doc_id)] = result.positions[lemma]
+                docs[result.doc_id] = {
+                    "terms": dict(result.term_counts),
+                    "lemmas": dict(lemma_counts_of(result)),
+                }
+                st = os.stat(os.path.join(pages_dir, f"{result.doc_id}.html"))
+                pages_state[result.doc_id] = {"segment": name, "mtime": st.st_mtime_ns, "size": st.st_size,
+                                              "hash": text_hash(result.text)}
+            with metrics.timer("index_write"):
+                _write_segment(segments_dir, name, postings, docs, positions, texts)
+            manifest["segments"].append({"name": name, "docs": len(docs), "deleted": []})
+
+        # Манифест пишется последним: до этого момента читатели видят прежнее поколение
+        _save_json(_path(segments_dir, PAGES_STATE), pages_state)
+        manifest["generation"] += 1
+        manifest["synced_ns"] = time.time_ns()
+        _save_json(_path(segments_dir, MANIFEST), manifest)
+
+        print(f"Сегменты: +{len(results)} страниц, удалено {len(deleted)}, "
+              f"поколение {manifest['generation']}, {time.perf_counter() - started:.1f} с")
+
+    if background_merge:
+        threading.Thread(target=merge, args=(segments_dir,), name="segment-merge").start()
+    return SegmentedIndex(segments_dir)
+
+
+def is_active(segments_dir=SEGMENTS_DIR, build_path=INDEX_BIN):
+    """Текущий ли индекс — сегменты: они есть и последний sync не старше полной сборки build_path.
+
+    После indexer.py сегменты устаревают, пока их не догонит следующий sync; слияние момент sync
+    не сдвигает. Булев и векторный поиск решают по одному правилу и поэтому видят один корпус.
+    """
+    manifest_path = _path(segments_dir, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return False
+    manifest = load_manifest(segments_dir)
+    if not manifest["segments"]:
+        return False
+    if not os.path.exists(build_path):
+        return True
+    synced_ns = manifest.get("synced_ns", os.stat(manifest_path).st_mtime_ns)
+    return synced_ns >= os.stat(build_path).st_mtime_ns
+
+
+def _live_docs(segments_dir):
+    """Поколение и частоты живых документов {doc_id: {"terms", "lemmas"}} по одному снимку манифеста"""
+    while True:
+        manifest = load_manifest(segments_dir)
+        docs = {}
+        try:
+            for segment in manifest["segments"]:
+                deleted = set(segment["deleted"])
+                with open(_docs_file(segments_dir, segment["name"]), encoding="utf-8") as f:
+                    for doc_id, doc in json.load(f).items():
+                        if int(doc_id) not in deleted:
+                            docs[doc_id] = doc
+        except FileNotFoundError:
+            # Фоновое слияние успело удалить сегмент — перечитываем манифест
+            continue
+        return manifest["generation"], docs
+
+
+def load_vectors(segments_dir=SEGMENTS_DIR):
+    """TF-IDF лемм живых документов по частотам из сегментов (CompactVectors, как из tfidf_lemmas/).
+
+    IDF применяется здесь: документные частоты и число документов считаются по тому же снимку
+    сегментов, поэтому веса совпадают с полной сборкой, а sync не переписывает файлы всего корпуса.
+    """
+    generation, docs = _live_docs(segments_dir)
+    df = Counter()
+    for doc in docs.values():
+        df.update(doc["lemmas"].keys())
+    vectors = CompactVectors()
+    for doc_id in sorted(docs, key=int):
+        doc = docs[doc_id]
+        vectors.add(doc_id, tfidf_values(doc["lemmas"], df, len(docs), sum(doc["terms"].values())))
+    return generation, vectors
+
+
+def export_tfidf(segments_dir=SEGMENTS_DIR, output_dir="."):
+    """Переписывает tfidf_terms/, tfidf_lemmas/, нормы, границы и tfidf_store.bin по сегментам целиком —
+    для batch_search.py, shards.py и других читателей файлов; поиску этот шаг не нужен"""
+    _, docs = _live_docs(segments_dir)
+    df_terms, df_lemmas = Counter(), Counter()
+    for doc in docs.values():
+        df_terms.update(doc["terms"].keys())
+        df_lemmas.update(doc["lemmas"].keys())
+    for directory in (TFIDF_TERMS_DIR, TFIDF_LEMMAS_DIR):
+        path = os.path.join(output_dir, directory)
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.split("_", 1)[0] not in docs:
+                os.remove(os.path.join(path, name))
+    norms, bounds = {}, {}
+    with metrics.timer("tfidf_write"):
+        for doc_id, doc in docs.items():
+            norms[doc_id] = write_doc_tfidf(doc_id, Counter(doc["terms"]), Counter(doc["lemmas"]),
+                                            df_terms, df_lemmas, len(docs), output_dir, bounds)
+        write_norms(norms, output_dir)
+        write_bounds(bounds, output_dir)
+        build_store(os.path.join(output_dir, TFIDF_LEMMAS_DIR), os.path.join(output_dir, TFIDF_STORE))
+    print(f"TF-IDF записан для {len(docs)} документов")
+
+
+def pick_merge(segments):
+    """Выбирает сегменты для слияния по политике ярусов"""
+    tiers = {}
+    for segment in segments:
+        live = segment["docs"] - len(segment["deleted"])
+        if segment["docs"] and len(segment["deleted"]) / segment["docs"] > MAX_DELETED_RATIO:
+            return [segment]
+        tiers.setdefault(_tier(live), []).append(segment)
+    for tier in sorted(tiers):
+        if len(tiers[tier]) >= MERGE_FACTOR:
+            return tiers[tier][:MERGE_FACTOR]
+    return []
+
+
+def merge(segments_dir=SEGMENTS_DIR):
+    """Сливает сегменты, пока политика находит кандидатов; удалённые документы вычищаются"""
+    with _merge_lock:
+        while True:
+            manifest = load_manifest(segments_dir)
+            picked = pick_merge(manifest["segments"])
+            if not picked:
+                return
+            names = [segment["name"] for segment in picked]
+            snapshot_deleted = {segment["name"]: set(segment["deleted"]) for segment in picked}
+
+            postings, docs = {}, {}
+            # Позиции переносятся, только если они есть во всех сливаемых сегментах
+            positions = {}
+            texts = []
+            for name in names:
+                binary = BinaryIndex(_path(segments_dir, f"{name}.bin"))
+                if not binary.has_positions:
+                    positions = None
+                deleted = snapshot_deleted[name]
+                for term, doc_ids in binary.items():
+                    live = [d for d in doc_ids if d not in deleted]
+                    if live:
+                        postings.setdefault(term, []).extend(live)
+                        if positions is not None:
+                            positions.setdefault(term, {}).update(binary.positions(term, live))
+                binary.close()
+                for doc_id, doc in _load_json(_docs_file(segments_dir, name), {}).items():
+                    if int(doc_id) not in deleted:
+                        docs[doc_id] = doc
+                store = _open_texts(segments_dir, name)
+                if store is not None:
+                    texts.extend((doc_id, text) for doc_id, text in store.items() if doc_id not in deleted)
+                    store.close()
+
+            with _DirLock(segments_dir):
+                manifest = load_manifest(segments_dir)
+                current = {segment["name"]: segment for segment in manifest["segments"]}
+                if not all(name in current for name in names):
+                    continue
+                new_name = f"seg_{manifest['next_segment']:06d}"
+                manifest["next_segment"] += 1
+                _write_segment(segments_dir, new_name, postings, docs, positions, texts)
+
+                # Документы, удалённые, пока шло слияние, переносятся в пометки нового сегмента
+                late_deleted = []
+                for name in names:
+                    late_deleted.extend(d for d in current[name]["deleted"] if d not in snapshot_deleted[name])
+                pages_state = _load_json(_path(segments_dir, PAGES_STATE), {})
+                for doc_id, state in pages_state.items():
+                    if state["segment"] in names:
+                        state["segment"] = new_name
+
+                manifest["segments"] = [s for s in manifest["segments"] if s["name"] not in names]
+                manifest["segments"].append({"name": new_name, "docs": len(docs), "deleted": late_deleted})
+                manifest["generation"] += 1
+                _save_json(_path(segments_dir, PAGES_STATE), pages_state)
+                _save_json(_path(segments_dir, MANIFEST), manifest)
+
+            for name in names:
+                os.remove(_path(segments_dir, f"{name}.bin"))
+                os.remove(_docs_file(segments_dir, name))
+                if os.path.exists(_texts_file(segments_dir, name)):
+                    os.remove(_texts_file(segments_dir, name))
+            print(f"Слияние: {', '.join(names)} → {new_name} ({len(docs)} документов)")
+
+
+def status(segments_dir=SEGMENTS_DIR):
+    manifest = load_manifest(segments_dir)
+    print(f"Поколение {manifest['generation']}, сегментов: {len(manifest['segments'])}")
+    for segment in manifest["segments"]:
+        print(f"  {segment['name']}: документов {segment['docs']}, удалено {len(segment['deleted'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Инкрементальный индекс из сегментов")
+    parser.add_argument("command", choices=["sync", "merge", "status", "tfidf"])
+    parser.add_argument("--pages-dir", default=PAGES_DIR)
+    parser.add_argument("--segments-dir", default=SEGMENTS_DIR)
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--no-merge", action="store_true", help="не запускать фоновое слияние")
+    args = parser.parse_args()
+
+    if args.command == "sync":
+        sync(args.pages_dir, args.segments_dir, args.output_dir, args.workers,
+             background_merge=not args.no_merge).close()
+    elif args.command == "merge":
+        merge(args.segments_dir)
+    elif args.command == "tfidf":
+        export_tfidf(args.segments_dir, args.output_dir)
+    status(args.segments_dir)
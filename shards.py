@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import heapq
+import random
+import shutil
+import argparse
+import multiprocessing
+from collections import Counter
+from itertools import chain
+
+import query_planner
+import term_dict
+from bitmap import Bitmap
+from lemmatizer import Lemmatizer
+from binary_index import INDEX_BIN, BinaryIndex
+from tfidf_store import TFIDF_STORE, TfidfStore, build_store
+from indexer import (PAGES_DIR, TFIDF_TERMS_DIR, TFIDF_LEMMAS_DIR, analyze_pages, lemma_counts_of,
+                     write_doc_tfidf, write_norms, write_bounds, write_inverted_index,
+                     write_float_table, read_float_table)
+from boolean_search import tokenize_query, shunting_yard
+from vector_search import TOP_K, VectorIndex, query_to_vector, load_index
+
+SHARDS_DIR = "shards"
+SHARDS_FILE = "shards.json"
+# Глобальный IDF лемм: по нему строится вектор запроса, одинаковый для всех шардов
+GLOBAL_IDF_FILE = "idf.txt"
+N_SHARDS = 4
+
+
+def shard_of(doc_id, n_shards):
+    return int(doc_id) % n_shards
+
+
+def shard_path(shards_dir, i):
+    return os.path.join(shards_dir, f"shard_{i:03d}")
+
+
+def build_shards(pages_dir=PAGES_DIR, shards_dir=SHARDS_DIR, n_shards=N_SHARDS, workers=1, lemmatizer=None):
+    """Делит документы по шардам (номер документа по модулю n_shards); у каждого шарда — свой бинарный
+    индекс и свои TF-IDF файлы и хранилище.
+
+    Документные частоты и N считаются по всему корпусу, поэтому IDF и веса в шардах те же, что и при
+    сборке одного индекса, и score документа совпадает побитно.
+    """
+    if lemmatizer is None:
+        lemmatizer = Lemmatizer()
+    results = analyze_pages(pages_dir, workers, lemmatizer=lemmatizer)
+    lemmatizer.save()
+
+    df_terms, df_lemmas = Counter(), Counter()
+    lemma_counts = {}
+    for result in results:
+        lemma_counts[result.doc_id] = lemma_counts_of(result)
+        df_terms.update(result.term_counts.keys())
+        df_lemmas.update(lemma_counts[result.doc_id].keys())
+    N = len(results)
+
+    if os.path.exists(os.path.join(shards_dir, SHARDS_FILE)):
+        shutil.rmtree(shards_dir)
+    parts = [[] for _ in range(n_shards)]
+    for result in results:
+        parts[shard_of(result.doc_id, n_shards)].append(result)
+
+    global_idf = {}
+    for i, part in enumerate(parts):
+        shard_dir = shard_path(shards_dir, i)
+        for directory in (TFIDF_TERMS_DIR, TFIDF_LEMMAS_DIR):
+            os.makedirs(os.path.join(shard_dir, directory), exist_ok=True)
+        norms, bounds = {}, {}
+        for result in part:
+            norms[result.doc_id] = write_doc_tfidf(
+                result.doc_id, result.term_counts, lemma_counts[result.doc_id],
+                df_terms, df_lemmas, N, shard_dir, bounds)
+        write_norms(norms, shard_dir)
+        write_bounds(bounds, shard_dir)
+        build_store(os.path.join(shard_dir, TFIDF_LEMMAS_DIR), os.path.join(shard_dir, TFIDF_STORE))
+        write_inverted_index(part, shard_dir, json_export=False)
+
+        # IDF в том виде, в каком его прочитает поиск (из файлов шарда), — без повторного округления
+        store = TfidfStore(os.path.join(shard_dir, TFIDF_STORE))
+        for j in range(len(store)):
+            term = store.term(j)
+            global_idf.setdefault(term, store.idf[term])
+        store.close()
+
+    write_float_table(os.path.join(shards_dir, GLOBAL_IDF_FILE), global_idf)
+    with open(os.path.join(shards_dir, SHARDS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"n_shards": n_shards, "n_docs": N, "docs": [len(part) for part in parts]}, f)
+    print(f"Шардов: {n_shards}, документов: {N} ({', '.join(str(len(part)) for part in parts)})")
+    return n_shards
+
+
+class Shard:
+    """Один шард: бинарный индекс и хранилище TF-IDF поверх mmap"""
+
+    def __init__(self, shard_dir):
+        self.binary = BinaryIndex(os.path.join(shard_dir, INDEX_BIN))
+        self.universe = Bitmap.from_sorted(self.binary.doc_ids)
+        self.store = TfidfStore(os.path.join(shard_dir, TFIDF_STORE))
+        self.vectors = VectorIndex.from_store(self.store)
+
+    def boolean(self, rpn):
+        """Документы шарда по запросу в ОПЗ; NOT — дополнение до документов этого шарда"""
+        return query_planner.run(rpn, self.binary, self.universe)
+
+    def top_k(self, q_vector, k):
+        """k лучших (score, doc_id) шарда; q_vector построен по глобальному IDF"""
+        return self.vectors.top_k(q_vector, k)
+
+    def close(self):
+        self.binary.close()
+
+
+def _serve_shard(shard_dir, conn):
+    """Цикл процесса шарда: (операция, аргументы) → (успех, результат); None — завершение"""
+    shard = Shard(shard_dir)
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        op, args = message
+        try:
+            conn.send((True, getattr(shard, op)(*args)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+    shard.close()
+    conn.close()
+
+
+class ShardedIndex:
+    """Координатор: разбирает запрос один раз, рассылает его всем шардам и собирает ответы.
+
+    processes=True — каждый шард в своём процессе (запросы к шардам выполняются параллельно,
+    память процесса — один шард); False — все шарды в текущем процессе.
+    """
+
+    def __init__(self, shards_dir=SHARDS_DIR, processes=True):
+        with open(os.path.join(shards_dir, SHARDS_FILE), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.idf = read_float_table(os.path.join(shards_dir, GLOBAL_IDF_FILE))
+        paths = [shard_path(shards_dir, i) for i in range(self.manifest["n_shards"])]
+        self.paths = paths
+        # Словари лемм для шаблонов и нечёткого поиска строятся при первом таком запросе
+        self.term_dictionary = None
+        self.boolean_dictionary = None
+        self.doc_freqs = None
+        self.shards, self.conns, self.processes = [], [], []
+        if not processes:
+            self.shards = [Shard(path) for path in paths]
+            return
+        for path in paths:
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_serve_shard, args=(path, child), daemon=True)
+            process.start()
+            child.close()
+            self.conns.append(parent)
+            self.processes.append(process)
+
+    def _scatter(self, op, *args):
+        if self.shards:
+            return [getattr(shard, op)(*args) for shard in self.shards]
+        for conn in self.conns:
+            conn.send((op, args))
+        replies = [conn.recv() for conn in self.conns]
+        for ok, value in replies:
+            if not ok:
+                raise RuntimeError(f"ошибка в шарде: {value}")
+        return [value for _, value in replies]
+
+    def boolean(self, query):
+        """Номера документов по возрастанию — объединение ответов шардов"""
+        if not query.strip():
+            return []
+        dictionary = self.boolean_terms() if term_dict.has_patterns(query) else None
+        rpn = shunting_yard(tokenize_query(query, dictionary, self.doc_freqs.get if dictionary else None))
+        # Некорректный запрос отвергается здесь, до рассылки
+        query_planner.build_tree(rpn)
+        return list(heapq.merge(*self._scatter("boolean", rpn)))
+
+    def top_k(self, query, k=TOP_K):
+        """k лучших (score, doc_id) по всем шардам, в том же порядке, что и VectorIndex.top_k"""
+        dictionary = term_dict.of(self) if term_dict.has_patterns(query) else None
+        q_vector = query_to_vector(query, self.idf, dictionary)
+        return sorted(chain.from_iterable(self._scatter("top_k", q_vector, k)), reverse=True)[:k]
+
+    def terms(self):
+        return self.idf.keys()
+
+    def boolean_terms(self):
+        """Словарь лемм булева поиска — объединение словарей бинарных индексов шардов, с документными частотами"""
+        if self.boolean_dictionary is None:
+            doc_freqs = Counter()
+            for path in self.paths:
+                binary = BinaryIndex(os.path.join(path, INDEX_BIN))
+                for term in binary.terms():
+                    doc_freqs[term] += binary.doc_freq(term)
+                binary.close()
+            self.doc_freqs = doc_freqs
+            self.boolean_dictionary = term_dict.TermDictionary(doc_freqs)
+        return self.boolean_dictionary
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        for conn in self.conns:
+            conn.send(None)
+            conn.close()
+        for process in self.processes:
+            process.join()
+
+
+def make_queries(idf, n, seed=0):
+    rng = random.Random(seed)
+    lemmas = sorted(lemma for lemma in idf if lemma not in ("and", "or", "not"))
+    boolean, vector = [], []
+    for _ in range(n):
+        a, b, c = rng.sample(lemmas, 3)
+        boolean.append(rng.choice((f"{a} and {b}", f"{a} or {b}", f"{a} and not {b}", f"not {a}",
+                                   f"({a} or {b}) and not {c}")))
+        vector.append(" ".join(rng.sample(lemmas, rng.randint(1, 4))))
+    return boolean, vector
+
+
+def check(shards_dir, n_queries, processes=True):
+    """Сверяет ответы шардов с единым индексом (inverted_index.bin и tfidf_store.bin в корне)"""
+    sharded = ShardedIndex(shards_dir, processes)
+    binary = BinaryIndex(INDEX_BIN)
+    universe = Bitmap.from_sorted(binary.doc_ids)
+    vectors = load_index()
+    boolean_queries, vector_queries = make_queries(sharded.idf, n_queries)
+    # Лемматизация запросов кешируется: прогреваем кеш, чтобы она не досталась первому из сравниваемых
+    for query in boolean_queries + vector_queries:
+        tokenize_query(query)
+
+    mismatches = 0
+    timings = Counter()
+    for query in boolean_queries:
+        started = time.perf_counter()
+        expected = query_planner.run(shunting_yard(tokenize_query(query)), binary, universe)
+        timings["boolean_single"] += time.perf_counter() - started
+        started = time.perf_counter()
+        got = sharded.boolean(query)
+        timings["boolean_sharded"] += time.perf_counter() - started
+        mismatches += got != expected
+    for query in vector_queries:
+        started = time.perf_counter()
+        expected = vectors.top_k(query_to_vector(query, vectors.idf_dict), TOP_K)
+        timings["vector_single"] += time.perf_counter() - started
+        started = time.perf_counter()
+        got = sharded.top_k(query, TOP_K)
+        timings["vector_sharded"] += time.perf_counter() - started
+        mismatches += got != expected
+    sharded.close()
+    binary.close()
+
+    for name, seconds in timings.items():
+        print(f"{name:<16}{seconds / n_queries * 1000:>8.3f} мс/запрос")
+    print(f"Запросов: {2 * n_queries}, расхождений с единым индексом: {mismatches}")
+    return mismatches == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Индекс, разделённый по документам на шарды")
+    parser.add_argument("command", choices=["build", "check", "search"])
+    parser.add_argument("query", nargs="?", default="", help="запрос для search")
+    parser.add_argument("--pages-dir", default=PAGES_DIR)
+    parser.add_argument("--shards-dir", default=SHARDS_DIR)
+    parser.add_argument("--shards", type=int, default=N_SHARDS, help="число шардов для build")
+    parser.add_argument("--workers", type=int, default=1, help="процессов для разбора страниц")
+    parser.add_argument("--mode", choices=["boolean", "vector"], default="boolean")
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--queries", type=int, default=300, help="запросов каждого вида для check")
+    parser.add_argument("--in-process", action="store_true", help="шарды в текущем процессе, без процессов шардов")
+    args = parser.parse_intermixed_args()
+
+    if args.command == "build":
+        build_shards(args.pages_dir, args.shards_dir, args.shards, args.workers)
+    elif args.command == "check":
+        raise SystemExit(0 if check(args.shards_dir, args.queries, not args.in_process) else 1)
+    else:
+        index = ShardedIndex(args.shards_dir, not args.in_process)
+        try:
+            if args.mode == "boolean":
+                try:
+                    results = index.boolean(args.query)
+                except ValueError as e:
+                    raise SystemExit(f"Некорректный запрос: {e}")
+                print(f"Найдено документов: {len(results)}")
+                print("Первые 15:", results[:15])
+            else:
+                for i, (score, doc_id) in enumerate(index.top_k(args.query, args.top_k), 1):
+                    print(f"{i:2d}. [{doc_id}] score={score:.4f}")
+        finally:
+            index.close()
@@ -0,0 +1,155 @@
+import os
+import re
+import html
+import time
+from collections import Counter
+
+import metrics
+from lemmatizer import LOOKUP_FILE
+from doc_store import DOC_STORE, DocStore
+
+SNIPPET_CHARS = 240
+# Бюджет на сниппеты одной страницы выдачи, с: результаты, до которых очередь не дошла, остаются без сниппета
+PAGE_BUDGET = 0.05
+# Дальше этого числа совпадений в тексте окно не ищется: лучшее окно почти всегда уже среди них
+MAX_MATCHES = 500
+# Подсветка в терминале — жирный шрифт
+TERMINAL_MARKS = ("\033[1m", "\033[0m")
+
+_forms = None
+
+
+def load_forms(path=LOOKUP_FILE):
+    """Лемма → словоформы корпуса по файлу в формате lemmas.txt: «лемма словоформа словоформа …»"""
+    forms = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                lemma, *words = line.split()
+                forms[lemma] = words
+    return forms
+
+
+def forms():
+    """Словоформы лемм (lemma_lookup.txt) — читаются один раз на процесс"""
+    global _forms
+    if _forms is None:
+        _forms = load_forms()
+    return _forms
+
+
+def open_texts(path=DOC_STORE):
+    """Хранилище текстов или None, если индекс собран без него"""
+    return DocStore(path) if os.path.exists(path) else None
+
+
+class Highlighter:
+    """Сниппеты для лемм одного запроса: окно текста с наибольшим числом разных лемм запроса
+    и позиции их словоформ в нём.
+
+    Словоформы берутся из группировки лемм корпуса, поэтому текст не лемматизируется: по нему проходит
+    одно регулярное выражение из всех словоформ запроса.
+    """
+
+    def __init__(self, lemmas, forms_of=None, width=SNIPPET_CHARS):
+        forms_of = forms() if forms_of is None else forms_of
+        self.lemma_of = {}
+        for lemma in lemmas:
+            for word in (lemma, *forms_of.get(lemma, ())):
+                self.lemma_of.setdefault(word, lemma)
+        self.width = width
+        self.regex = None
+        if self.lemma_of:
+            # Длинные словоформы первыми: иначе «игр» совпадёт раньше «играх»
+            words = sorted(self.lemma_of, key=len, reverse=True)
+            self.regex = re.compile(rf"(?<![а-яёa-z])(?:{'|'.join(map(re.escape, words))})(?![а-яёa-z])", re.I)
+
+    def _best_window(self, matches):
+        """(первое, последнее) совпадение окна шириной width с наибольшим числом разных лемм, затем совпадений"""
+        keys = [self.lemma_of.get(m.group().lower()) for m in matches]
+        best, best_score = (0, 0), (0, 0)
+        lemmas = Counter()
+        j = 0
+        for i, m in enumerate(matches):
+            # lemmas — леммы совпадений matches[i:j]; окно содержит хотя бы само i-е совпадение
+            if j == i:
+                lemmas[keys[j]] += 1
+                j += 1
+            while j < len(matches) and matches[j].end() - m.start() <= self.width:
+                lemmas[keys[j]] += 1
+                j += 1
+            score = (len(lemmas), j - i)
+            if score > best_score:
+                best, best_score = (i, j - 1), score
+            lemmas[keys[i]] -= 1
+            if not lemmas[keys[i]]:
+                del lemmas[keys[i]]
+        return best
+
+    def snippet(self, text):
+        """(сниппет, [(начало, конец) подсвеченных словоформ в сниппете])"""
+        with metrics.timer("snippet"):
+            matches = []
+            if self.regex is not None:
+                for m in self.regex.finditer(text):
+                    matches.append(m)
+                    if len(matches) >= MAX_MATCHES:
+                        break
+            if not matches:
+                start, end = 0, min(len(text), self.width)
+                matches_in = []
+            else:
+                first, last = self._best_window(matches)
+                matches_in = matches[first:last + 1]
+                span_start, span_end = matches_in[0].start(), matches_in[-1].end()
+                # Совпадения — посередине окна
+                start = max(0, span_start - (self.width - (span_end - span_start)) // 2)
+                end = min(len(text), max(span_end, start + self.width))
+            # Окно расширяется до границ слов
+            if start > 0:
+                space = text.rfind(" ", 0, start)
+                start = space + 1 if space >= 0 else 0
+            if end < len(text):
+                space = text.find(" ", end)
+                end = space if space >= 0 else len(text)
+            # В хранилище текст как после clean_html, с HTML-сущностями; в сниппете они раскрываются
+            parts = ["…" if start > 0 else ""]
+            length = len(parts[0])
+            spans = []
+            pos = start
+            for m in matches_in:
+                if start <= m.start() and m.end() <= end:
+                    before = html.unescape(text[pos:m.start()])
+                    spans.append((length + len(before), length + len(before) + len(m.group())))
+                    parts += [before, m.group()]
+                    length = spans[-1][1]
+                    pos = m.end()
+            parts += [html.unescape(text[pos:end]), "…" if end < len(text) else ""]
+        return "".join(parts), spans
+
+
+def mark(snippet, spans, marks=TERMINAL_MARKS):
+    """Сниппет с подсвеченными словоформами: каждая обрамляется парой marks"""
+    parts, pos = [], 0
+    for start, end in spans:
+        parts += [snippet[pos:start], marks[0], snippet[start:end], marks[1]]
+        pos = end
+    parts.append(snippet[pos:])
+    return "".join(parts)
+
+
+def page_snippets(doc_ids, texts, highlighter, budget=PAGE_BUDGET):
+    """[(сниппет, подсветка) или None] для страницы выдачи по порядку; texts — что угодно с text(doc_id).
+
+    Когда бюджет страницы исчерпан, остальные результаты остаются без сниппета, а не задерживают ответ.
+    """
+    deadline = time.perf_counter() + budget
+    result = []
+    for doc_id in doc_ids:
+        text = texts.text(doc_id) if time.perf_counter() < deadline else None
+        if text is None:
+            metrics.count("snippets_skipped")
+            result.append(None)
+        else:
+            result.append(highlighter.snippet(text))
+    return result
@@ -0,0 +1,173 @@
+import os
+import json
+import math
+import marshal
+import tempfile
+from array import array
+from collections import defaultdict, Counter
+
+import metrics
+from lemmatizer import Lemmatizer, CACHE_FILE
+from binary_index import INDEX_BIN, BinaryIndexWriter, encode_positions
+from tfidf_store import TFIDF_STORE, TfidfStoreWriter
+from doc_store import DOC_STORE, DocStoreWriter
+from runs import Runs
+from indexer import (PAGES_DIR, TOKENS_DIR, LEMMAS_DIR, TFIDF_TERMS_DIR, TFIDF_LEMMAS_DIR, INDEX_FILE,
+                     TFIDF_NORMS_FILE, page_files, iter_analyzed, write_page_files, add_lemma_groups,
+                     write_lemma_groups, add_lemma_forms, write_lemma_forms, lemma_counts_of,
+                     write_doc_tfidf, write_bounds)
+
+# Бюджет буферов списков по умолчанию, МБ
+MEMORY_MB = 64
+# Сколько страниц на процесс пула разбирается впрок
+WINDOW = 4
+
+
+def build(pages_dir=PAGES_DIR, output_dir=".", workers=1, cache_file=CACHE_FILE, json_export=True,
+          memory_mb=MEMORY_MB, with_index=True):
+    """Те же артефакты, что indexer.build, в ограниченной памяти (SPIMI).
+
+    Страницы разбираются по одной в порядке номеров: списки лемм дописываются в буфер Runs и, когда он
+    дорастает до memory_mb, сбрасываются на диск отсортированными прогонами; частоты страниц для TF-IDF
+    уходят во временный файл. В конце прогоны сливаются k-путевым слиянием прямо в inverted_index.bin,
+    а TF-IDF считается вторым проходом по временному файлу, когда известны документные частоты.
+    В памяти остаются только словари корпуса (леммы, словоформы, df, первое появление лемм для JSON) —
+    не списки и не страницы.
+    with_index=False — только TF-IDF (задание 4).
+    """
+    budget = int(memory_mb * 2 ** 20)
+    directories = (TOKENS_DIR, LEMMAS_DIR, TFIDF_TERMS_DIR, TFIDF_LEMMAS_DIR) if with_index else (
+        TFIDF_TERMS_DIR, TFIDF_LEMMAS_DIR)
+    for directory in directories:
+        os.makedirs(os.path.join(output_dir, directory), exist_ok=True)
+    files = page_files(pages_dir)
+    # Порядок имён файлов — порядок, в котором indexer.build встречает леммы впервые (ключи inverted_index.json)
+    ranks = {doc_id: rank for rank, (doc_id, _) in enumerate(files)}
+    files.sort(key=lambda item: int(item[0]))
+    lemmatizer = Lemmatizer(cache_file)
+
+    with tempfile.TemporaryDirectory(prefix=".spimi_", dir=output_dir) as tmp:
+        postings = Runs(2, budget, tmp)
+        groups, forms = defaultdict(set), defaultdict(set)
+        df_terms, df_lemmas = Counter(), Counter()
+        first_seen = {} if json_export else None
+        doc_ids = []
+        counts_path = os.path.join(tmp, "counts.bin")
+        texts = DocStoreWriter(os.path.join(output_dir, DOC_STORE)) if with_index else None
+        with metrics.timer("analyze"), open(counts_path, "wb") as counts:
+            for result in iter_analyzed(files, workers, with_index, lemmatizer, WINDOW):
+                lemma_counts = lemma_counts_of(result)
+                df_terms.update(result.term_counts.keys())
+                df_lemmas.update(lemma_counts.keys())
+                marshal.dump((result.doc_id, dict(result.term_counts), dict(lemma_counts)), counts)
+                doc_ids.append(int(result.doc_id))
+                if not with_index:
+                    continue
+                with metrics.timer("page_write"):
+                    write_page_files(result, output_dir)
+                add_lemma_groups(groups, result)
+                add_lemma_forms(forms, result)
+                if first_seen is not None:
+                    # Одно число (номер страницы, место леммы в ней) вместо кортежа — вдвое меньше памяти
+                    base = ranks[result.doc_id] << 32
+                    for i, lemma in enumerate(result.index_lemmas, base):
+                        if first_seen.get(lemma, i + 1) > i:
+                            first_seen[lemma] = i
+                with metrics.timer("spimi.invert"):
+                    doc = array("I", [int(result.doc_id)]).tobytes()
+                    for lemma in result.index_lemmas:
+                        positions = bytearray()
+                        encode_positions(result.positions[lemma], positions)
+                        postings.add(lemma, doc, positions)
+                with metrics.timer("doc_store_write"):
+                    texts.add(result.doc_id, result.text)
+        lemmatizer.save()
+
+        n_tokens = n_lemmas = n_terms = n_blocks = 0
+        if with_index:
+            n_blocks = texts.close()
+            with metrics.timer("global_write"):
+                n_tokens, n_lemmas = write_lemma_groups(groups, output_dir)
+                write_lemma_forms(forms, output_dir)
+            del groups, forms
+            with metrics.timer("index_write"):
+                n_terms = write_index(postings, doc_ids, output_dir, first_seen, tmp)
+        with metrics.timer("tfidf_write"):
+            store_runs = write_tfidf(counts_path, df_terms, df_lemmas, len(doc_ids), output_dir, budget, tmp)
+
+    if with_index:
+        print(f"Документов: {len(doc_ids)}")
+        print(f"Уникальных токенов всего: {n_tokens}")
+        print(f"Групп лемм всего: {n_lemmas}")
+        print(f"Индекс: терминов={n_terms:,}")
+        print(f"Хранилище текстов: блоков={n_blocks}")
+    own, children = metrics.peak_rss_mb()
+    print(f"Бюджет буферов: {memory_mb:g} МБ, прогонов на диске: индекс {postings.flushed}, TF-IDF {store_runs}")
+    print(f"Пик RSS: {own} МБ" + (f" (процессы разбора: {children} МБ)" if workers > 1 else ""))
+    print(lemmatizer.stats())
+    return len(doc_ids)
+
+
+def write_index(postings, doc_ids, output_dir, first_seen=None, tmp=None):
+    """Сливает прогоны в inverted_index.bin; возвращает число терминов.
+
+    С first_seen (лемма → номер страницы в порядке имён файлов << 32 | место в её index_lemmas) пишется
+    и inverted_index.json — байт в байт как у indexer.write_inverted_index. Из слияния термины выходят
+    по алфавиту, поэтому их записи сначала ложатся во временный файл, а в JSON копируются в порядке
+    первого появления лемм; в памяти — только смещения записей.
+    """
+    writer = BinaryIndexWriter(os.path.join(output_dir, INDEX_BIN), doc_ids, with_positions=True)
+    entries = tempfile.TemporaryFile(dir=tmp) if first_seen is not None else None
+    spans = []
+    n_terms = offset = 0
+    for term, (docs, positions) in postings.merged():
+        docs = array("I", docs)
+        writer.add(term, docs, positions)
+        n_terms += 1
+        if entries is not None:
+            # Запись термина так же, как её пишет json.dump(..., ensure_ascii=False, indent=2)
+            data = (f'    {json.dumps(term, ensure_ascii=False)}: [\n'
+                    + ",\n".join(f'      "{doc_id}"' for doc_id in docs) + "\n    ]").encode("utf-8")
+            entries.write(data)
+            spans.append((first_seen[term], offset, len(data)))
+            offset += len(data)
+    writer.close()
+    if entries is None:
+        return n_terms
+
+    spans.sort()
+    ids = ",\n".join(f'    "{doc_id}"' for doc_id in sorted(doc_ids))
+    with entries, open(os.path.join(output_dir, INDEX_FILE), "wb") as f:
+        f.write(b'{\n  "index": {')
+        for i, (_, start, length) in enumerate(spans):
+            entries.seek(start)
+            f.write((b",\n" if i else b"\n") + entries.read(length))
+        tail = ("\n  }" if spans else "}") + ',\n  "all_doc_ids": ' + (f"[\n{ids}\n  ]" if ids else "[]") + "\n}"
+        f.write(tail.encode("utf-8"))
+    return n_terms
+
+
+def write_tfidf(counts_path, df_terms, df_lemmas, N, output_dir, budget, tmp):
+    """Второй проход: tfidf_terms/, tfidf_lemmas/, нормы, границы и tfidf_store.bin по частотам страниц;
+    возвращает число прогонов списков хранилища"""
+    # IDF в том виде, в каком write_doc_tfidf пишет его в tfidf_lemmas/
+    idf_dict = {lemma: float(f"{math.log(N / df):.6f}") for lemma, df in df_lemmas.items()}
+    store = TfidfStoreWriter(os.path.join(output_dir, TFIDF_STORE), idf_dict, budget, tmp)
+    bounds = {}
+    with open(counts_path, "rb") as counts, \
+            open(os.path.join(output_dir, TFIDF_NORMS_FILE), "w", encoding="utf-8") as norms:
+        while True:
+            try:
+                doc_id, term_counts, lemma_counts = marshal.load(counts)
+            except EOFError:
+                break
+            vector = {}
+            norm = write_doc_tfidf(doc_id, term_counts, lemma_counts, df_terms, df_lemmas, N, output_dir,
+                                   bounds, vector)
+            # Документы идут по возрастанию номеров — порядок write_norms
+            norms.write(f"{doc_id} {norm!r}\n")
+            store.add(doc_id, vector)
+    write_bounds(bounds, output_dir)
+    store.close()
+    return store.postings.flushed
+
@@ -0,0 +1,291 @@
+import re
+import time
+import heapq
+import argparse
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from collections import Counter
+from os.path import commonprefix
+
+import metrics
+from binary_index import INDEX_BIN, BinaryIndex, encode_varint, read_varint
+
+# Сколько лемм может дать один шаблон или нечёткое слово: больше — запрос дольше, а выдача не лучше
+MAX_EXPANSIONS = 50
+# Сколько секунд можно перебирать подходящие под шаблон леммы, выбирая из них MAX_EXPANSIONS самых частых
+MAX_SCAN_SECONDS = 0.05
+MAX_DISTANCE = 2
+BLOCK_SIZE = 16
+# Слова, которые --check проверяет со знаком вопроса на конце
+CHECK_WORDS = ("сочи", "олимпиаду", "олимпийские", "игры")
+# Слово в запросе: олимп*, ол?мп*, *ский — шаблон; алимпийский~ или алимпийский~1 — нечёткий поиск.
+# «?» в конце слова — знак вопроса, а не шаблон: «сочи?» — обычное слово
+PATTERN_RE = re.compile(r'(?=[а-яёa-z]*(?:\*|\?[а-яёa-z*?]*[а-яёa-z*]))[а-яёa-z*?]*[а-яёa-z*]|[а-яёa-z]+~\d?')
+
+
+def has_patterns(text):
+    return any(c in text for c in "*?~")
+
+
+def is_pattern(token):
+    return PATTERN_RE.fullmatch(token) is not None
+
+
+def auto_distance(word):
+    """Допустимое число опечаток по длине слова: в коротком слове одна правка уже даёт другое слово"""
+    if len(word) <= 2:
+        return 0
+    return 1 if len(word) <= 5 else 2
+
+
+def edit_distance(a, b, limit):
+    """Расстояние Левенштейна с перестановкой соседних букв или limit + 1, если оно больше limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        row = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            row[j] = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + cost)
+            if cost and prev2 is not None and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], prev2[j - 2] + 1)
+        if min(row) > limit:
+            return limit + 1
+        prev2, prev = prev, row
+    return prev[-1] if prev[-1] <= limit else limit + 1
+
+
+def _grams(word):
+    """Различные биграммы слова с границами: «^о», «ол», …, «й$»"""
+    padded = f"^{word}$"
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+class FrontCoded:
+    """Отсортированные строки блоками по BLOCK_SIZE: первая строка блока целиком, остальные — длина
+    общего с предыдущей префикса и хвост (в UTF-8, varint). Первые строки блоков — для двоичного поиска."""
+
+    def __init__(self, terms):
+        self.heads = []
+        self.offsets = array("Q")
+        blob = bytearray()
+        prev = b""
+        for i, term in enumerate(terms):
+            key = term.encode("utf-8")
+            if i % BLOCK_SIZE == 0:
+                self.heads.append(term)
+                self.offsets.append(len(blob))
+                shared = 0
+            else:
+                shared = len(commonprefix((prev, key)))
+            encode_varint(shared, blob)
+            encode_varint(len(key) - shared, blob)
+            blob += key[shared:]
+            prev = key
+        self.blob = bytes(blob)
+        self.n = len(terms)
+
+    def __len__(self):
+        return self.n
+
+    def block(self, b):
+        """Строки блока b"""
+        terms = []
+        pos = self.offsets[b]
+        key = b""
+        for _ in range(min(BLOCK_SIZE, self.n - b * BLOCK_SIZE)):
+            shared, pos = read_varint(self.blob, pos)
+            length, pos = read_varint(self.blob, pos)
+            key = key[:shared] + self.blob[pos:pos + length]
+            pos += length
+            terms.append(key.decode("utf-8"))
+        return terms
+
+    def __getitem__(self, i):
+        return self.block(i // BLOCK_SIZE)[i % BLOCK_SIZE]
+
+    def lower_bound(self, key):
+        """Номер первой строки, не меньшей key"""
+        b = bisect_right(self.heads, key) - 1
+        if b < 0:
+            return 0
+        return b * BLOCK_SIZE + bisect_left(self.block(b), key)
+
+    def prefix_range(self, prefix):
+        """[lo, hi) — строки, начинающиеся с prefix"""
+        return self.lower_bound(prefix), self.lower_bound(prefix + "\U0010ffff")
+
+    def iter_range(self, lo, hi):
+        b = lo // BLOCK_SIZE
+        i = b * BLOCK_SIZE
+        while i < hi:
+            for term in self.block(b):
+                if lo <= i < hi:
+                    yield term
+                i += 1
+            b += 1
+
+
+class TermDictionary:
+    """Словарь лемм индекса для шаблонов и нечёткого поиска.
+
+    Леммы хранятся дважды в сжатом виде (FrontCoded): как есть — для «олимп*», и перевёрнутыми — для «*ский».
+    Биграммный индекс для нечёткого поиска строится при первом нечётком запросе.
+    """
+
+    def __init__(self, terms):
+        terms = sorted(set(terms))
+        self.forward = FrontCoded(terms)
+        self.reverse = FrontCoded(sorted(term[::-1] for term in terms))
+        self._grams = None
+        self._lengths = None
+
+    def __len__(self):
+        return len(self.forward)
+
+    def _build_grams(self):
+        grams = {}
+        self._lengths = array("H")
+        for term_id, term in enumerate(self.forward.iter_range(0, len(self.forward))):
+            self._lengths.append(min(len(term), 0xFFFF))
+            for gram in _grams(term):
+                ids = grams.get(gram)
+                if ids is None:
+                    ids = grams[gram] = array("I")
+                ids.append(term_id)
+        self._grams = grams
+
+    def prefix(self, prefix):
+        lo, hi = self.forward.prefix_range(prefix)
+        return self.forward.iter_range(lo, hi)
+
+    def wildcard(self, pattern):
+        """Леммы по шаблону с * (любые буквы) и ? (одна буква); перебор ограничен префиксом или суффиксом шаблона"""
+        regex = re.compile("".join(".*" if c == "*" else "." if c == "?" else re.escape(c) for c in pattern))
+        head = re.match(r"[^*?]*", pattern).group()
+        tail = re.search(r"[^*?]*$", pattern).group()
+        if len(tail) > len(head):
+            candidates = (term[::-1] for term in self.reverse.iter_range(*self.reverse.prefix_range(tail[::-1])))
+        else:
+            candidates = self.prefix(head)
+        return (term for term in candidates if regex.fullmatch(term))
+
+    def fuzzy(self, word, max_distance=MAX_DISTANCE):
+        """[(расстояние, лемма)] — леммы не дальше max_distance правок от word (и не дальше, чем позволяет его длина).
+
+        Кандидаты — леммы, у которых достаточно общих биграмм: одна правка меняет не больше трёх биграмм.
+        """
+        max_distance = min(max_distance, auto_distance(word))
+        if self._grams is None:
+            self._build_grams()
+        grams = _grams(word)
+        counts = Counter()
+        for gram in grams:
+            counts.update(self._grams.get(gram, ()))
+        need = len(grams) - 3 * max_distance
+        found = []
+        for term_id, common in counts.items():
+            if common >= need and abs(self._lengths[term_id] - len(word)) <= max_distance:
+                term = self.forward[term_id]
+                distance = edit_distance(word, term, max_distance)
+                if distance <= max_distance:
+                    found.append((distance, term))
+        return sorted(found)
+
+    def expand(self, token, popularity=None, limit=MAX_EXPANSIONS, lemmatize=None):
+        """Леммы для шаблона или нечёткого слова, не больше limit.
+
+        popularity(лемма) — чем больше, тем лучше (например, документная частота): из всех подходящих
+        под шаблон берутся limit самых частых, нечёткие совпадения — сначала ближайшие. Перебор шаблона
+        ограничен временем MAX_SCAN_SECONDS, а не числом лемм: самые общие шаблоны (а*) на большом
+        словаре выбирают из просмотренного за это время. Без popularity берутся первые limit совпадений.
+        Нечёткое слово ищется и как есть, и его лемма (lemmatize), если она другая: в индексе леммы,
+        а в запросе — словоформа с опечаткой.
+        """
+        rank = popularity or (lambda term: 0)
+        with metrics.timer("terms.expand"):
+            if "~" in token:
+                word, _, distance = token.partition("~")
+                distance = int(distance) if distance else MAX_DISTANCE
+                best = {}
+                for variant in {word, lemmatize(word) if lemmatize else word}:
+                    for d, term in self.fuzzy(variant, distance):
+                        best[term] = min(d, best.get(term, d))
+                terms = sorted(best, key=lambda term: (best[term], -rank(term), term))
+            elif popularity is None:
+                terms = list(islice(self.wildcard(token), limit))
+            else:
+                terms = heapq.nlargest(limit, _until(self.wildcard(token), time.perf_counter() + MAX_SCAN_SECONDS),
+                                       key=popularity)
+            terms = terms[:limit]
+        metrics.count("term_expansions", len(terms))
+        return terms
+
+
+def _until(items, deadline, every=256):
+    """items, пока не наступил deadline (time.perf_counter); время проверяется раз в every элементов"""
+    for i, item in enumerate(items, start=1):
+        yield item
+        if not i % every and time.perf_counter() > deadline:
+            metrics.count("term_expansions_truncated")
+            return
+
+
+def of(index):
+    """Словарь лемм индекса (BinaryIndex, SegmentedIndex, VectorIndex…) — строится один раз на объект индекса"""
+    dictionary = getattr(index, "term_dictionary", None)
+    if dictionary is None:
+        dictionary = index.term_dictionary = TermDictionary(index.terms())
+    return dictionary
+
+
+def check(index_path, words):
+    """Сверяет выдачу обоих поисков по «слово?» и «слово»: знак вопроса в конце — не шаблон"""
+    import boolean_search
+    import vector_search
+
+    index = BinaryIndex(index_path)
+    dictionary = TermDictionary(index.terms())
+    vectors = vector_search.load_index()
+    failures = 0
+    for word in words:
+        question = f"{word}?"
+        same_boolean = (boolean_search.tokenize_query(question, dictionary, index.doc_freq)
+                        == boolean_search.tokenize_query(word, dictionary, index.doc_freq))
+        same_vector = (vector_search.query_to_vector(question, vectors.idf_dict, vectors.dictionary_for(question))
+                       == vector_search.query_to_vector(word, vectors.idf_dict, vectors.dictionary_for(word)))
+        print(f"{question}: булев {'совпадает' if same_boolean else 'РАСХОЖДЕНИЕ'}, "
+              f"векторный {'совпадает' if same_vector else 'РАСХОЖДЕНИЕ'}")
+        failures += not (same_boolean and same_vector)
+    index.close()
+    return failures == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Словарь лемм: шаблоны (олимп*, *ский) и нечёткий поиск (слово~)")
+    parser.add_argument("patterns", nargs="*")
+    parser.add_argument("--index", default=INDEX_BIN)
+    parser.add_argument("--limit", type=int, default=MAX_EXPANSIONS,
+                        help="сколько самых частых лемм брать из всех подходящих под шаблон "
+                             f"(перебор ограничен {MAX_SCAN_SECONDS * 1000:.0f} мс)")
+    parser.add_argument("--check", action="store_true",
+                        help="сверить выдачу по «слово?» и «слово» (по умолчанию: сочи, олимпиаду)")
+    args = parser.parse_args()
+
+    if args.check:
+        raise SystemExit(0 if check(args.index, args.patterns or CHECK_WORDS) else 1)
+
+    index = BinaryIndex(args.index)
+    started = time.perf_counter()
+    dictionary = TermDictionary(index.terms())
+    print(f"Словарь: {len(dictionary)} лемм, {len(dictionary.forward.blob) / 1024:.1f} КБ, "
+          f"построен за {(time.perf_counter() - started) * 1000:.1f} мс")
+    for pattern in args.patterns:
+        started = time.perf_counter()
+        terms = dictionary.expand(pattern.lower(), index.doc_freq, args.limit)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"{pattern} ({elapsed:.2f} мс): {', '.join(f'{t} ({index.doc_freq(t)})' for t in terms) or '—'}")
+    index.close()
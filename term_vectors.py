@@ -0,0 +1,171 @@
+import os
+import sys
+import math
+from array import array
+from itertools import accumulate
+
+TFIDF_LEMMAS_DIR = "tfidf_lemmas"
+
+
+class TermTable:
+    """Общая таблица лемм: каждая строка хранится один раз, дальше везде используется её номер"""
+
+    __slots__ = ("ids", "terms")
+
+    def __init__(self):
+        self.ids = {}
+        self.terms = []
+
+    def intern(self, term):
+        term_id = self.ids.get(term)
+        if term_id is None:
+            term = sys.intern(term)
+            term_id = self.ids[term] = len(self.terms)
+            self.terms.append(term)
+        return term_id
+
+    def get(self, term, default=None):
+        return self.ids.get(term, default)
+
+    def __contains__(self, term):
+        return term in self.ids
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __getitem__(self, term_id):
+        return self.terms[term_id]
+
+
+class DocVector:
+    """Вектор документа: номера лемм и веса в двух массивах, в порядке файла tfidf_lemmas/"""
+
+    __slots__ = ("term_ids", "weights")
+
+    def __init__(self):
+        self.term_ids = array("I")
+        self.weights = array("d")
+
+    def __len__(self):
+        return len(self.term_ids)
+
+    def norm(self):
+        # Тот же порядок суммирования, что и в indexer.write_doc_tfidf
+        return math.sqrt(sum(v * v for v in self.weights))
+
+
+class PostingLists:
+    """Обращённые списки всех лемм в трёх сплошных массивах: границы списков по номерам лемм,
+    порядковые номера документов (по возрастанию внутри списка) и веса.
+
+    lists[term_id] — пара срезов (номера документов, веса) без копирования.
+    """
+
+    __slots__ = ("offsets", "ordinals", "weights", "_ordinals_view", "_weights_view")
+
+    def __init__(self, offsets, ordinals, weights):
+        self.offsets = offsets
+        self.ordinals = ordinals
+        self.weights = weights
+        self._ordinals_view = memoryview(ordinals)
+        self._weights_view = memoryview(weights)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, term_id):
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self._ordinals_view[start:end], self._weights_view[start:end]
+
+    def __iter__(self):
+        return (self[term_id] for term_id in range(len(self)))
+
+
+class TermValues:
+    """Отображение лемма → значение поверх TermTable и списка/массива по номерам лемм (только чтение)"""
+
+    __slots__ = ("table", "values")
+
+    def __init__(self, table, values):
+        self.table = table
+        self.values = values
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, term):
+        return term in self.table
+
+    def __getitem__(self, term):
+        return self.values[self.table.ids[term]]
+
+    def get(self, term, default=None):
+        term_id = self.table.get(term)
+        return default if term_id is None else self.values[term_id]
+
+    def keys(self):
+        return self.table.ids.keys()
+
+
+class CompactVectors:
+    """TF-IDF лемм всего корпуса без словарей на документ: TermTable, DocVector по порядковым номерам
+    документов (по возрастанию doc_id) и массив IDF по номерам лемм"""
+
+    __slots__ = ("terms", "doc_ids", "vectors", "idf")
+
+    def __init__(self):
+        self.terms = TermTable()
+        self.doc_ids = []
+        self.vectors = []
+        self.idf = array("d")
+
+    @classmethod
+    def from_dir(cls, lemmas_dir=TFIDF_LEMMAS_DIR):
+        self = cls()
+        names = [name for name in os.listdir(lemmas_dir) if name.endswith("_lemmas.txt")]
+        for name in sorted(names, key=lambda name: int(name.replace("_lemmas.txt", ""))):
+            with open(os.path.join(lemmas_dir, name), encoding="utf-8") as f:
+                self.add(name.replace("_lemmas.txt", ""), (parts for parts in map(str.split, f) if len(parts) == 3))
+        return self
+
+    def add(self, doc_id, values):
+        """Дописывает документ по тройкам (лемма, idf, tf-idf) в строковом виде, как в tfidf_lemmas/"""
+        vector = DocVector()
+        for lemma, idf, tfidf in values:
+            term_id = self.terms.intern(lemma)
+            if term_id == len(self.idf):
+                self.idf.append(float(idf))
+            vector.term_ids.append(term_id)
+            vector.weights.append(float(tfidf))
+        self.doc_ids.append(doc_id)
+        self.vectors.append(vector)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def n_postings(self):
+        return sum(len(vector) for vector in self.vectors)
+
+    def postings(self):
+        """Обращённые списки по номерам лемм; раскладка подсчётом, без дозаписи в массивы"""
+        counts = array("Q", bytes(8 * (len(self.terms) + 1)))
+        for vector in self.vectors:
+            for term_id in vector.term_ids:
+                counts[term_id + 1] += 1
+        offsets = array("Q", accumulate(counts))
+        positions = array("Q", offsets)
+        total = offsets[-1]
+        ordinals = array("I", bytes(4 * total))
+        weights = array("d", bytes(8 * total))
+        for ordinal, vector in enumerate(self.vectors):
+            for term_id, weight in zip(vector.term_ids, vector.weights):
+                position = positions[term_id]
+                ordinals[position] = ordinal
+                weights[position] = weight
+                positions[term_id] = position + 1
+        return PostingLists(offsets, ordinals, weights)
+
+    def vector_dict(self, ordinal):
+        """Вектор документа словарём {лемма: вес} — для кода, которому нужен старый формат"""
+        vector = self.vectors[ordinal]
+        return {self.terms[t]: w for t, w in zip(vector.term_ids, vector.weights)}
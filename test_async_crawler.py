@@ -0,0 +1,129 @@
+import os
+import json
+import asyncio
+import tempfile
+import unittest
+
+from aiohttp import web
+
+import async_crawler
+
+ETAG = '"v1"'
+LAST_MODIFIED = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+
+class CrawlTest(unittest.IsolatedAsyncioTestCase):
+    """async_crawler.crawl против локального aiohttp.web сервера вместо настоящего сайта"""
+
+    async def asyncSetUp(self):
+        self.requests = []
+        self.manifest_seen = []
+        self.failures = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        app = web.Application()
+        app.router.add_get("/page/{name}", self.page)
+        app.router.add_get("/slow/{name}", self.slow)
+        app.router.add_get("/flaky/{name}", self.flaky)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.base = "http://{}:{}".format(*self.runner.addresses[0][:2])
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pages_dir = os.path.join(self.tmp.name, "pages")
+        self.index_file = os.path.join(self.tmp.name, "index.txt")
+        self.manifest_file = os.path.join(self.tmp.name, "crawl_manifest.json")
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
+        self.tmp.cleanup()
+
+    async def page(self, request):
+        self.requests.append(request)
+        self.manifest_seen.append(os.path.exists(self.manifest_file))
+        if (request.headers.get("If-None-Match") == ETAG
+                or request.headers.get("If-Modified-Since") == LAST_MODIFIED):
+            return web.Response(status=304)
+        return web.Response(text=f"<html>{request.match_info['name']}</html>",
+                            headers={"ETag": ETAG, "Last-Modified": LAST_MODIFIED})
+
+    async def slow(self, request):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.02)
+        self.in_flight -= 1
+        return web.Response(text="<html>slow</html>")
+
+    async def flaky(self, request):
+        # Сначала отвечает статусами из self.failures[name], потом 200
+        statuses = self.failures[request.match_info["name"]]
+        if statuses:
+            return web.Response(status=statuses.pop(0), headers={"Retry-After": "0"})
+        return web.Response(text="<html>ok</html>")
+
+    def crawl(self, urls, **kwargs):
+        kwargs.setdefault("backoff", 0.01)
+        return async_crawler.crawl(urls, self.pages_dir, self.index_file, self.manifest_file, **kwargs)
+
+    async def test_second_crawl_is_conditional(self):
+        urls = [f"{self.base}/page/a", f"{self.base}/page/b"]
+        stats = await self.crawl(urls)
+        self.assertEqual(stats, {"downloaded": 2, "not_modified": 0, "errors": 0})
+        with open(os.path.join(self.pages_dir, "1.html"), encoding="utf-8") as f:
+            self.assertEqual(f.read(), "<html>a</html>")
+        with open(self.manifest_file, encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest[urls[1]], {"file": "2.html", "etag": ETAG, "last_modified": LAST_MODIFIED})
+
+        mtime = os.stat(os.path.join(self.pages_dir, "1.html")).st_mtime_ns
+        self.requests.clear()
+        stats = await self.crawl(urls)
+        self.assertEqual(stats, {"downloaded": 0, "not_modified": 2, "errors": 0})
+        for request in self.requests:
+            self.assertEqual(request.headers["If-None-Match"], ETAG)
+            self.assertEqual(request.headers["If-Modified-Since"], LAST_MODIFIED)
+        self.assertEqual(os.stat(os.path.join(self.pages_dir, "1.html")).st_mtime_ns, mtime)
+        with open(self.index_file, encoding="utf-8") as f:
+            self.assertEqual(f.read(), f"1.html {urls[0]}\n2.html {urls[1]}")
+
+    async def test_no_conditional_get_without_page_on_disk(self):
+        url = f"{self.base}/page/a"
+        await self.crawl([url])
+        os.remove(os.path.join(self.pages_dir, "1.html"))
+        self.requests.clear()
+        stats = await self.crawl([url])
+        self.assertEqual(stats["downloaded"], 1)
+        self.assertNotIn("If-None-Match", self.requests[0].headers)
+
+    async def test_retries_429_and_5xx(self):
+        self.failures = {"a": [429, 503, 500], "b": [502, 502, 502, 502]}
+        stats = await self.crawl([f"{self.base}/flaky/a", f"{self.base}/flaky/b"], retries=3)
+        # a проходит с четвёртой попытки, у b попытки кончаются раньше, чем ошибки
+        self.assertEqual(stats, {"downloaded": 1, "not_modified": 0, "errors": 1})
+        self.assertEqual(self.failures, {"a": [], "b": []})
+        with open(self.index_file, encoding="utf-8") as f:
+            self.assertEqual(f.read(), f"1.html {self.base}/flaky/a")
+
+    async def test_per_host_limit(self):
+        urls = [f"{self.base}/slow/{i}" for i in range(20)]
+        stats = await self.crawl(urls, concurrency=8, per_host=3)
+        self.assertEqual(stats["downloaded"], 20)
+        self.assertEqual(self.max_in_flight, 3)
+
+    async def test_lazy_urls_and_checkpoint(self):
+        urls = (f"{self.base}/page/{i}" for i in range(10))
+        stats = await self.crawl(urls, concurrency=1, checkpoint_every=3)
+        self.assertEqual(stats["downloaded"], 10)
+        # Манифест появляется на диске после первых трёх страниц, не в конце обхода
+        self.assertEqual(self.manifest_seen, [False] * 3 + [True] * 7)
+        with open(self.index_file, encoding="utf-8") as f:
+            self.assertEqual(f.read().splitlines(), [f"{i + 1}.html {self.base}/page/{i}" for i in range(10)])
+        with open(self.manifest_file, encoding="utf-8") as f:
+            self.assertEqual(len(json.load(f)), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,261 @@
+import re
+
+import metrics
+
+STOP_WORDS = {
+    'и', 'в', 'во', 'не', 'что', 'он', 'на', 'я', 'с', 'со', 'как', 'а', 'то', 'все', 'она', 'так', 'его', 'но', 'да', 'ты', 'к', 'у', 'же', 'вы', 'за', 'бы', 'по', 'только', 'ее', 'мне', 'было', 'вот', 'от', 'меня', 'еще', 'нет', 'о', 'из', 'ему', 'теперь', 'когда', 'даже', 'ну', 'вдруг', 'ли', 'если', 'уже', 'или', 'ни', 'быть', 'был', 'него', 'до', 'вас', 'нибудь', 'опять', 'уж', 'вам', 'ведь', 'там', 'потом', 'себя', 'ничто', 'ей', 'может', 'они', 'тут', 'где', 'есть', 'надо', 'ней', 'для', 'мы', 'тебя', 'их', 'чем', 'была', 'сам', 'чтоб', 'без', 'будто', 'чего', 'раз', 'тоже', 'себе', 'под', 'будет', 'ж', 'тогда', 'кто', 'этот', 'того', 'потому', 'этого', 'какой', 'совсем', 'ним', 'здесь', 'этом', 'один', 'почти', 'мой', 'тем', 'чтобы', 'нее', 'сейчас', 'были', 'куда', 'зачем', 'всех', 'никогда', 'можно', 'при', 'наконец', 'два', 'об', 'другой', 'хоть', 'после', 'над', 'больше', 'тот', 'через', 'эти', 'нас', 'про', 'всего', 'них', 'какая', 'много', 'разве', 'три', 'эту', 'моя', 'впрочем', 'хорошо', 'свою', 'этой', 'перед', 'иногда', 'лучше', 'чуть', 'том', 'нельзя', 'такой', 'им', 'более', 'всегда', 'конечно', 'всю', 'между',
+    'the', 'and', 'or', 'but', 'if', 'in', 'on', 'at', 'to', 'of', 'for', 'with', 'by', 'from', 'as', 'is', 'are', 'was', 'were', 'be', 'have', 'has', 'had', 'do', 'does', 'did', 'this', 'that', 'these', 'those', 'it', 'its', 'their', 'our', 'we', 'you', 'he', 'she', 'they',
+    'amp', 'nbsp', 'hellip', 'ndash', 'mdash', 'laquo', 'raquo', 'quot', 'apos', 'lt', 'gt', 'http', 'https', 'www', 'com', 'ru', 'org', 'net', 'io', 'co', 'tv'
+}
+
+WORD_RE = re.compile(r'\b[а-яё]+\b')
+INDEX_WORD_RE = re.compile(r'\b[а-яёa-z]{2,}\b')
+
+
+def clean_html(html):
+    """Убирает скрипты, стили, комментарии и теги, схлопывает пробелы"""
+    html = re.sub(r'<script.*?</script>|<style.*?</style>|<!--.*?-->', '', html, flags=re.DOTALL | re.I)
+    text = re.sub(r'<[^>]+>', ' ', html)
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text
+
+
+def page_tokens(text):
+    """Токены страницы для заданий 2 и 4: кириллица, без стоп-слов, не короче 3 букв"""
+    return [t for t in WORD_RE.findall(text.lower())
+            if t not in STOP_WORDS and len(t) >= 3]
+
+
+def index_tokens(text):
+    """Токены для инвертированного индекса: кириллица и латиница от 2 букв, без стоп-слов"""
+    return [t for t in INDEX_WORD_RE.findall(text.lower()) if t not in STOP_WORDS]
+
+
+def index_token_positions(text, positions, start=0):
+    """Добавляет в positions (токен → список позиций) токены индекса из text; возвращает позицию следующего слова.
+
+    Позиция — номер слова среди всех слов индекса, стоп-слова тоже занимают позицию: «игры в сочи»
+    и «игры сочи» — разные расстояния. start — позиция первого слова text (при разборе по кускам).
+    """
+    words = INDEX_WORD_RE.findall(text.lower())
+    for i, t in enumerate(words, start):
+        if t not in STOP_WORDS:
+            token_positions = positions.get(t)
+            if token_positions is None:
+                positions[t] = [i]
+            else:
+                token_positions.append(i)
+    return start + len(words)
+
+
+# Потоковое извлечение текста: то же, что clean_html + findall, но страница читается кусками по CHUNK_SIZE
+# символов и в памяти никогда не лежит целиком
+CHUNK_SIZE = 1 << 16
+# Без групп: у шаблона остаётся литеральный префикс «<», и поиск идёт в разы быстрее
+BLOCK_OPEN_RE = re.compile(r'<(?:script|style|!--)', re.I)
+BLOCK_CLOSE_RES = {1: re.compile(r'</script>', re.I), 2: re.compile(r'</style>', re.I), 3: re.compile(r'-->')}
+BLOCK_OPEN_LENGTHS = {1: 7, 2: 6, 3: 4}
+TAG_RE = re.compile(r'<[^>]+>')
+SPACES_RE = re.compile(r'\s+')
+WORD_CHAR_RE = re.compile(r'\w')
+NON_WORD_RE = re.compile(r'\W')
+INDEX_WORD_FULL_RE = re.compile(r'[а-яёa-z]{2,}')
+# Слово длиннее этого, в котором есть символ не из алфавитов токенов, дальше не накапливается
+MAX_CARRY = 256
+
+
+class _Source:
+    """Окно в файле: непрочитанная часть — buf[i:], base — позиция buf[0] в символах от начала файла"""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.base = 0
+        self.i = 0
+        self.eof = False
+
+    @property
+    def pos(self):
+        return self.base + self.i
+
+    def __len__(self):
+        return len(self.buf) - self.i
+
+    def fill(self):
+        with metrics.timer("html_read"):
+            data = self.f.read(self.chunk_size)
+        metrics.count("html_chars", len(data))
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.i:] + data
+        self.base += self.i
+        self.i = 0
+        return True
+
+    def drop(self, pos):
+        """Забывает всё до позиции pos"""
+        self.i = pos - self.base
+
+    def rewind(self, pos):
+        """Перечитывает файл с позиции pos — когда закрывающая конструкция так и не нашлась"""
+        self.f.seek(0)
+        self.buf, self.base, self.i, self.eof = "", 0, 0, False
+        while self.fill() and self.base + len(self.buf) <= pos:
+            self.base += len(self.buf)
+            self.buf = ""
+        self.drop(pos)
+
+
+def _skip_block(src, kind, pos):
+    """Ищет закрывающую часть блока начиная с pos; при успехе окно встаёт сразу за ней"""
+    close_re = BLOCK_CLOSE_RES[kind]
+    keep = len(close_re.pattern) - 1
+    while True:
+        m = close_re.search(src.buf, max(pos - src.base, src.i))
+        if m:
+            src.drop(src.base + m.end())
+            return True
+        if src.eof:
+            return False
+        pos = max(pos, src.base + len(src.buf) - keep)
+        src.drop(pos)
+        src.fill()
+
+
+def _without_blocks(src, unclosed):
+    """Первый проход clean_html: вырезает <script>, <style> и комментарии; выдаёт (позиция, текст)"""
+    while True:
+        if not len(src) and not src.fill():
+            return
+        m = BLOCK_OPEN_RE.search(src.buf, src.i)
+        if m is None:
+            end = len(src.buf) if src.eof else max(src.i, len(src.buf) - 6)
+            if end > src.i:
+                yield src.pos, src.buf[src.i:end]
+                src.drop(src.base + end)
+            if not src.fill() and not len(src):
+                return
+            continue
+        if m.start() > src.i:
+            yield src.pos, src.buf[src.i:m.start()]
+        opener = m.group()
+        kind = 3 if opener[1] == "!" else 1 if opener[2] in "cC" else 2
+        opened = src.base + m.start()
+        src.drop(opened)
+        # Если после прошлого такого же открывающего тега закрывающего не нашлось, после этого его нет тем более
+        if opened < unclosed.get(kind, opened + 1):
+            if _skip_block(src, kind, opened + BLOCK_OPEN_LENGTHS[kind]):
+                continue
+            unclosed[kind] = opened
+            src.rewind(opened)
+        # Незакрытый блок regex оставляет как есть: «<» идёт в текст, поиск продолжается со следующего символа
+        yield opened, "<"
+        src.drop(opened + 1)
+
+
+def _strip_tags(piece):
+    """Заменяет теги куска на пробелы; возвращает (текст, начало незакрытого в куске тега или -1).
+
+    Тег <[^>]+> заканчивается на первом «>» после «<», поэтому все «<» до последнего «>» куска
+    обрабатываются регулярным выражением целиком, а ждать продолжения нужно только для первого «<» после него.
+    """
+    open_at = piece.find("<", piece.rfind(">") + 1)
+    if open_at < 0:
+        return TAG_RE.sub(" ", piece), -1
+    return TAG_RE.sub(" ", piece[:open_at]), open_at
+
+
+def iter_text(f, chunk_size=CHUNK_SIZE):
+    """Текст страницы по кускам — как clean_html, но без схлопывания пробелов (на токены оно не влияет)"""
+    src = _Source(f, chunk_size)
+    unclosed = {}
+    tags_closed = True
+    while True:
+        tag_at = None
+        tag_empty = False
+        for pos, piece in _without_blocks(src, unclosed):
+            if not tags_closed:
+                yield piece
+                continue
+            if tag_at is not None:
+                if tag_empty and piece[0] == ">":
+                    # <[^>]+> требует хотя бы один символ внутри: «<>» — не тег
+                    yield "<"
+                    tag_at = None
+                else:
+                    tag_empty = False
+                    k = piece.find(">")
+                    if k < 0:
+                        continue
+                    yield " "
+                    tag_at = None
+                    pos, piece = pos + k + 1, piece[k + 1:]
+            text, open_at = _strip_tags(piece)
+            if text:
+                yield text
+            if open_at >= 0:
+                tag_at, tag_empty = pos + open_at, open_at == len(piece) - 1
+        if tag_at is None or tag_empty:
+            if tag_at is not None:
+                yield "<"
+            return
+        # До конца файла «>» нет: этот и все следующие «<» остаются в тексте, читаем заново с символа после «<»
+        tags_closed = False
+        src.rewind(tag_at + 1)
+        yield "<"
+
+
+def iter_segments(f, chunk_size=CHUNK_SIZE, original=None):
+    """Текст страницы в нижнем регистре кусками примерно по chunk_size символов.
+
+    Куски режутся только после символа, не входящего в \\w: граница слова \\b там та же, что и в целом
+    тексте, поэтому page_tokens / index_tokens по кускам дают ровно те же токены, что и по clean_html(html).
+    В список original, если он передан, складываются куски текста в исходном регистре (для clean_text).
+    """
+    pending, size = [], 0
+    dead = False
+    for piece in iter_text(f, chunk_size):
+        if original is not None:
+            original.append(piece)
+        # Регистр понижается сразу: page_tokens / index_tokens всё равно делают lower(), а границы слов
+        # нужно искать в том тексте, по которому они будут считаться
+        piece = piece.lower()
+        if dead:
+            # Хвост слишком длинного «слова», которое заведомо не токен, — пропускаем до конца серии
+            m = NON_WORD_RE.search(piece)
+            if m is None:
+                continue
+            piece, dead = piece[m.start():], False
+        pending.append(piece)
+        size += len(piece)
+        if size < chunk_size:
+            continue
+        text = "".join(pending)
+        cut = len(text)
+        while cut and WORD_CHAR_RE.match(text, cut - 1):
+            cut -= 1
+        if cut:
+            # Схлопывание пробелов, как в clean_html: на токены не влияет, но сокращает текст для findall
+            yield SPACES_RE.sub(" ", text[:cut])
+        rest = text[cut:]
+        if len(rest) > MAX_CARRY and not INDEX_WORD_FULL_RE.fullmatch(rest):
+            rest, dead = "", True
+        pending, size = ([rest], len(rest)) if rest else ([], 0)
+    if pending:
+        yield SPACES_RE.sub(" ", "".join(pending))
+
+
+def clean_text(pieces):
+    """Куски iter_text → тот же текст, что clean_html: пробелы схлопнуты, по краям обрезаны.
+
+    str.split() делит по тем же пробельным символам, что и \\s, и втрое быстрее re.sub
+    """
+    return " ".join("".join(pieces).split())
+
+
+def stream_page_tokens(f, chunk_size=CHUNK_SIZE):
+    """Генератор токенов page_tokens по файлу страницы, без чтения её целиком"""
+    for segment in iter_segments(f, chunk_size):
+        yield from page_tokens(segment)
@@ -0,0 +1,297 @@
+import os
+import sys
+import math
+import mmap
+import time
+import struct
+import argparse
+import tempfile
+from array import array
+from bisect import bisect_left
+
+from binary_index import _pad, _write_section, _TermKeys
+from runs import Runs
+
+TFIDF_STORE = "tfidf_store.bin"
+TFIDF_LEMMAS_DIR = "tfidf_lemmas"
+
+# Формат tfidf_store.bin (little-endian, секции выровнены по 8 байт):
+#   заголовок HEADER
+#   doc_ids        — uint32[n_docs], номера документов по возрастанию (порядковый номер = позиция)
+#   doc_offsets    — uint64[n_docs + 1], границы векторов документов в entry_*
+#   norms          — float64[n_docs], нормы векторов документов
+#   term_offsets   — uint64[n_terms + 1], смещения лемм в term_blob
+#   idf            — float64[n_terms], IDF в том виде, в каком он записан в tfidf_lemmas/
+#   bounds         — float64[n_terms], max(вес / норма документа) по лемме
+#   post_offsets   — uint64[n_terms + 1], границы списков лемм в post_*
+#   post_docs      — uint32[n_entries], порядковые номера документов в списках лемм
+#   post_weights   — float64[n_entries]
+#   entry_terms    — uint32[n_entries], номера лемм в векторах документов (в порядке файлов)
+#   entry_weights  — float64[n_entries]
+#   term_blob      — UTF-8 леммы подряд, в порядке возрастания
+MAGIC = b"TFST"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIQ12Q")
+
+
+def read_tfidf_dir(lemmas_dir=TFIDF_LEMMAS_DIR):
+    """Векторы документов и IDF из tfidf_lemmas/ — так же, как их читает vector_search.load_tfidf_data"""
+    doc_vectors = {}
+    idf_dict = {}
+    for filename in os.listdir(lemmas_dir):
+        if not filename.endswith("_lemmas.txt"):
+            continue
+        vector = {}
+        with open(os.path.join(lemmas_dir, filename), encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 3:
+                    continue
+                lemma, idf, tfidf = parts
+                vector[lemma] = float(tfidf)
+                idf_dict.setdefault(lemma, float(idf))
+        doc_vectors[filename.replace("_lemmas.txt", "")] = vector
+    return doc_vectors, idf_dict
+
+
+def write_tfidf_store(path, doc_vectors, idf_dict):
+    """Пишет векторы документов {документ: {лемма: вес}} и IDF в один колоночный файл"""
+    writer = TfidfStoreWriter(path, idf_dict)
+    for doc_id in sorted(doc_vectors, key=int):
+        writer.add(doc_id, doc_vectors[doc_id])
+    writer.close()
+
+
+class TfidfStoreWriter:
+    """Пишет tfidf_store.bin по одному документу (по возрастанию номеров); IDF известен заранее.
+
+    Векторы документов сразу уходят во временные файлы, а списки лемм копятся в Runs: с budget (байт)
+    они сбрасываются на диск прогонами и в конце сливаются, так что память не растёт с размером корпуса.
+    """
+
+    def __init__(self, path, idf_dict, budget=None, directory=None):
+        self.path = path
+        self.terms = sorted(idf_dict)
+        self.term_ids = {term: i for i, term in enumerate(self.terms)}
+        self.idf = array("d", (idf_dict[term] for term in self.terms))
+        self.doc_ids = array("I")
+        self.doc_offsets = array("Q", [0])
+        self.norms = array("d")
+        self.bounds = array("d", bytes(8 * len(self.terms)))
+        self.postings = Runs(2, budget, directory)
+        self._entries = [tempfile.TemporaryFile(dir=directory or os.path.dirname(path) or ".") for _ in range(2)]
+
+    def add(self, doc_id, vector):
+        ordinal = struct.pack("<I", len(self.doc_ids))
+        # Норма и границы считаются в том же порядке, что и в indexer.write_doc_tfidf, — совпадают побитно
+        norm = math.sqrt(sum(v * v for v in vector.values()))
+        self.doc_ids.append(int(doc_id))
+        self.norms.append(norm)
+        entry_terms = array("I")
+        entry_weights = array("d")
+        for lemma, weight in vector.items():
+            term_id = self.term_ids[lemma]
+            entry_terms.append(term_id)
+            entry_weights.append(weight)
+            self.postings.add(lemma, ordinal, struct.pack("<d", weight))
+            if norm:
+                self.bounds[term_id] = max(self.bounds[term_id], weight / norm)
+        self.doc_offsets.append(self.doc_offsets[-1] + len(entry_terms))
+        for f, column in zip(self._entries, (entry_terms, entry_weights)):
+            if sys.byteorder != "little":
+                column.byteswap()
+            f.write(column)
+
+    def close(self):
+        directory = os.path.dirname(self.path) or "."
+        term_offsets = array("Q", [0])
+        post_offsets = array("Q", [0])
+        term_blob = bytearray()
+        post_docs, post_weights = (tempfile.TemporaryFile(dir=directory) for _ in range(2))
+        merged = self.postings.merged()
+        key, fields = next(merged, (None, None))
+        for term in self.terms:
+            term_blob += term.encode("utf-8")
+            term_offsets.append(len(term_blob))
+            count = 0
+            if key == term:
+                post_docs.write(fields[0])
+                post_weights.write(fields[1])
+                count = len(fields[0]) // 4
+                key, fields = next(merged, (None, None))
+            post_offsets.append(post_offsets[-1] + count)
+
+        columns = (self.doc_ids, self.doc_offsets, self.norms, term_offsets, self.idf, self.bounds, post_offsets)
+        if sys.byteorder != "little":
+            for column in columns:
+                column.byteswap()
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"\0" * HEADER.size)
+            sections = []
+            for data in columns + (post_docs, post_weights, *self._entries, term_blob):
+                _pad(f)
+                sections.append(f.tell())
+                _write_section(f, data)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.doc_ids), len(self.terms), self.doc_offsets[-1], *sections))
+        os.replace(tmp_path, self.path)
+
+
+def build_store(lemmas_dir=TFIDF_LEMMAS_DIR, path=TFIDF_STORE):
+    """Собирает tfidf_store.bin из уже записанных tfidf_lemmas/"""
+    doc_vectors, idf_dict = read_tfidf_dir(lemmas_dir)
+    write_tfidf_store(path, doc_vectors, idf_dict)
+
+
+class TfidfStore:
+    """TF-IDF лемм поверх mmap: открывается за O(1), несколько процессов делят одни страницы кеша ОС"""
+
+    def __init__(self, path=TFIDF_STORE):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_docs, n_terms, n_entries, *sections = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: неизвестный формат хранилища TF-IDF")
+        if sys.byteorder != "little":
+            raise ValueError("Хранилище TF-IDF читается только на little-endian машинах")
+
+        view = memoryview(self._mm)
+
+        def column(at, count, fmt, size):
+            return view[at:at + size * count].cast(fmt)
+
+        (doc_ids_at, doc_offsets_at, norms_at, term_offsets_at, idf_at, bounds_at,
+         post_offsets_at, post_docs_at, post_weights_at, entry_terms_at, entry_weights_at, self._terms_at) = sections
+        self.n_docs = n_docs
+        self._n_terms = n_terms
+        self._doc_ids = column(doc_ids_at, n_docs, "I", 4)
+        self._doc_offsets = column(doc_offsets_at, n_docs + 1, "Q", 8)
+        self.norms = column(norms_at, n_docs, "d", 8)
+        self._term_offsets = column(term_offsets_at, n_terms + 1, "Q", 8)
+        self._idf = column(idf_at, n_terms, "d", 8)
+        self._bounds = column(bounds_at, n_terms, "d", 8)
+        self._post_offsets = column(post_offsets_at, n_terms + 1, "Q", 8)
+        self._post_docs = column(post_docs_at, n_entries, "I", 4)
+        self._post_weights = column(post_weights_at, n_entries, "d", 8)
+        self._entry_terms = column(entry_terms_at, n_entries, "I", 4)
+        self._entry_weights = column(entry_weights_at, n_entries, "d", 8)
+        self._columns = (self._doc_ids, self._doc_offsets, self.norms, self._term_offsets, self._idf, self._bounds,
+                         self._post_offsets, self._post_docs, self._post_weights, self._entry_terms,
+                         self._entry_weights)
+        self.doc_ids = _DocIds(self._doc_ids)
+        self.idf = _TermMap(self, lambda i: self._idf[i])
+        self.bounds = _TermMap(self, lambda i: self._bounds[i])
+        self.postings = _TermMap(self, self.postings_at)
+
+    def __len__(self):
+        return self._n_terms
+
+    def term(self, i):
+        return self._term_bytes(i).decode("utf-8")
+
+    def _term_bytes(self, i):
+        return self._mm[self._terms_at + self._term_offsets[i]:self._terms_at + self._term_offsets[i + 1]]
+
+    def find(self, term):
+        """Номер леммы в словаре (двоичный поиск) или -1"""
+        key = term.encode("utf-8")
+        i = bisect_left(_TermKeys(self), key)
+        if i < self._n_terms and self._term_bytes(i) == key:
+            return i
+        return -1
+
+    def postings_at(self, i):
+        """(порядковые номера документов, веса) — срезы mmap без копирования"""
+        start, end = self._post_offsets[i], self._post_offsets[i + 1]
+        return self._post_docs[start:end], self._post_weights[start:end]
+
+    def vector(self, ordinal):
+        """Вектор документа {лемма: вес} в порядке файла tfidf_lemmas/"""
+        start, end = self._doc_offsets[ordinal], self._doc_offsets[ordinal + 1]
+        return {self.term(t): w for t, w in zip(self._entry_terms[start:end], self._entry_weights[start:end])}
+
+    def close(self):
+        for column in self._columns:
+            column.release()
+        self._mm.close()
+
+
+class _DocIds:
+    """Порядковый номер → номер документа строкой, как в именах файлов"""
+
+    __slots__ = ("_ids",)
+
+    def __init__(self, ids):
+        self._ids = ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, ordinal):
+        return str(self._ids[ordinal])
+
+
+class _TermMap:
+    """Отображение лемма → значение поверх словаря хранилища (только чтение)"""
+
+    __slots__ = ("_store", "_value")
+
+    def __init__(self, store, value):
+        self._store = store
+        self._value = value
+
+    def __len__(self):
+        return len(self._store)
+
+    def __contains__(self, term):
+        return self._store.find(term) >= 0
+
+    def __getitem__(self, term):
+        i = self._store.find(term)
+        if i < 0:
+            raise KeyError(term)
+        return self._value(i)
+
+    def get(self, term, default=None):
+        i = self._store.find(term)
+        return self._value(i) if i >= 0 else default
+
+    def keys(self):
+        return (self._store.term(i) for i in range(len(self._store)))
+
+    def __iter__(self):
+        return self.keys()
+
+
+def check(lemmas_dir, path):
+    """Сверяет хранилище с tfidf_lemmas/ и сравнивает время загрузки"""
+    started = time.perf_counter()
+    doc_vectors, idf_dict = read_tfidf_dir(lemmas_dir)
+    text_load = time.perf_counter() - started
+    started = time.perf_counter()
+    store = TfidfStore(path)
+    store_load = time.perf_counter() - started
+
+    same = (store.n_docs == len(doc_vectors) and len(store) == len(idf_dict)
+            and all(store.vector(i) == doc_vectors.get(store.doc_ids[i]) for i in range(store.n_docs))
+            and all(store.idf[term] == idf for term, idf in idf_dict.items()))
+    store.close()
+    print(f"{'tfidf_lemmas/':<16}загрузка {text_load * 1000:.2f} мс")
+    print(f"{path:<16}загрузка {store_load * 1000:.2f} мс, {os.path.getsize(path) / 1024:.1f} КБ")
+    print("Содержимое совпадает" if same else "РАСХОЖДЕНИЕ с tfidf_lemmas/")
+    return same
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Колоночное хранилище TF-IDF лемм")
+    parser.add_argument("--lemmas-dir", default=TFIDF_LEMMAS_DIR)
+    parser.add_argument("--store", default=TFIDF_STORE)
+    parser.add_argument("--check", action="store_true", help="сверить хранилище с tfidf_lemmas/")
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(0 if check(args.lemmas_dir, args.store) else 1)
+    build_store(args.lemmas_dir, args.store)
+    print(f"Записан {args.store}: {os.path.getsize(args.store) / 1024:.1f} КБ")
@@ -1,84 +1,32 @@
 import os
 import re
 import math
+import heapq
+import argparse
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
 from collections import Counter
-import pymorphy2
+
+import metrics
+from lemmatizer import Lemmatizer, LOOKUP_FILE
+from text_utils import STOP_WORDS
+from indexer import TFIDF_NORMS_FILE, read_norms, read_bounds
+from query_cache import QueryCache, normalize_query
+from tfidf_store import TFIDF_STORE, TfidfStore
+from term_vectors import CompactVectors, TermValues
+import term_dict
+import snippets
+import segments
 
 TFIDF_LEMMAS_DIR = "tfidf_lemmas"
 INDEX_TXT = "index.txt"
+TOP_K = 15
+# Запас на погрешность округления при сравнении верхней границы с порогом кучи
+BOUND_SLACK = 1e-9
 
-morph = pymorphy2.MorphAnalyzer()
-
-STOP_WORDS = {
-    'и', 'в', 'во', 'не',
-    'что', 'он', 'на', 'я',
-    'с', 'со', 'как', 'а',
-    'то', 'все', 'она', 'так',
-    'его', 'но', 'да', 'ты',
-    'к', 'у', 'же', 'вы',
-    'за', 'бы', 'по',
-    'только', 'ее', 'мне',
-    'было', 'вот', 'от',
-    'меня', 'еще', 'нет', 'о',
-    'из', 'ему', 'теперь',
-    'когда', 'даже', 'ну',
-    'вдруг', 'ли', 'если',
-    'уже', 'или', 'ни',
-    'быть', 'был', 'него',
-    'до', 'вас', 'нибудь',
-    'опять', 'уж', 'вам',
-    'ведь', 'там', 'потом',
-    'себя', 'ничто', 'ей',
-    'может', 'они', 'тут',
-    'где', 'есть', 'надо',
-    'ней', 'для', 'мы',
-    'тебя', 'их', 'чем',
-    'была', 'сам', 'чтоб',
-    'без', 'будто', 'чего',
-    'раз', 'тоже', 'себе',
-    'под', 'будет', 'ж',
-    'тогда', 'кто', 'этот',
-    'того', 'потому', 'этого',
-    'какой', 'совсем', 'ним',
-    'здесь', 'этом', 'один',
-    'почти', 'мой', 'тем',
-    'чтобы', 'нее', 'сейчас',
-    'были', 'куда', 'зачем',
-    'всех', 'никогда',
-    'можно', 'при', 'наконец',
-    'два', 'об', 'другой',
-    'хоть', 'после', 'над',
-    'больше', 'тот', 'через',
-    'эти', 'нас', 'про',
-    'всего', 'них', 'какая',
-    'много', 'разве', 'три',
-    'эту', 'моя', 'впрочем',
-    'хорошо', 'свою', 'этой',
-    'перед', 'иногда',
-    'лучше', 'чуть', 'том',
-    'нельзя', 'такой', 'им',
-    'более', 'всегда',
-    'конечно', 'всю', 'между',
-    'the', 'and', 'or', 'but',
-    'if', 'in', 'on', 'at',
-    'to', 'of', 'for', 'with',
-    'by', 'from', 'as', 'is',
-    'are', 'was', 'were',
-    'be', 'have', 'has',
-    'had', 'do', 'does',
-    'did', 'this', 'that',
-    'these', 'those', 'it',
-    'its', 'their', 'our',
-    'we', 'you', 'he', 'she',
-    'they',
-    'amp', 'nbsp', 'hellip',
-    'ndash', 'mdash', 'laquo',
-    'raquo', 'quot', 'apos',
-    'lt', 'gt', 'http',
-    'https', 'www', 'com',
-    'ru', 'org', 'net', 'io',
-    'co', 'tv'
-}
+# Словоформы корпуса лемматизируются по готовому словарю, pymorphy2 грузится только для новых слов
+lemmatizer = Lemmatizer(lookup_file=LOOKUP_FILE)
 
 
 def clean_and_lemmatize(text):
@@ -90,9 +38,8 @@ def clean_and_lemmatize(text):
         if token in STOP_WORDS or len(
                 token) < 2:
             continue
-        lemma = \
-        morph.parse(token)[
-            0].normal_form
+        lemma = lemmatizer(
+            token)
         if lemma not in STOP_WORDS:
             lemmas.append(
                 lemma)
@@ -143,16 +90,31 @@ def load_tfidf_data():
 
 
 def query_to_vector(query,
-                    idf_dict):
-    """Превращает запрос в TF-IDF вектор"""
+                    idf_dict,
+                    dictionary=None):
+    """Превращает запрос в TF-IDF вектор.
+
+    С dictionary (TermDictionary) «олимп*» и «алимпийский~» раскрываются в леммы словаря; одно такое слово
+    весит в запросе как одно обычное: его единица TF делится поровну между найденными леммами.
+    """
+    expansions = []
+    if dictionary is not None:
+        query = query.lower()
+        for pattern in term_dict.PATTERN_RE.findall(query):
+            expansions.append(dictionary.expand(pattern, lambda lemma: -idf_dict[lemma], lemmatize=lemmatizer))
+        query = term_dict.PATTERN_RE.sub(" ", query)
     lemmas = clean_and_lemmatize(
         query)
-    if not lemmas:
+    if not lemmas and not expansions:
         return {}
 
     term_counts = Counter(
         lemmas)
-    total = len(lemmas)
+    total = len(lemmas) + len(expansions)
+    for expanded in expansions:
+        for lemma in expanded:
+            if lemma not in STOP_WORDS:
+                term_counts[lemma] += 1 / len(expanded)
     q_vector = {}
 
     for lemma, count in term_counts.items():
@@ -190,6 +152,260 @@ def cosine_similarity(vec1,
                 norm1 * norm2)
 
 
+def compute_bounds(postings, norms):
+    """max(вес / норма документа) по каждой лемме — если tfidf_bounds.txt нет или он устарел"""
+    bounds = array("d")
+    for ordinals, weights in postings:
+        bound = 0.0
+        for ordinal, weight in zip(ordinals, weights):
+            if norms[ordinal] and weight / norms[ordinal] > bound:
+                bound = weight / norms[ordinal]
+        bounds.append(bound)
+    return bounds
+
+
+class VectorIndex:
+    """Векторы документов, обращённые в списки лемма → (номера документов, веса), нормы документов
+    и верхние границы вклада каждой леммы для отсечения MaxScore.
+
+    Документы нумеруются по возрастанию doc_id, списки лемм упорядочены по этим номерам.
+    Данные берутся либо из компактных массивов (from_compact), либо прямо из mmap-хранилища (from_store).
+    """
+
+    __slots__ = ("idf_dict", "doc_ids", "norms", "postings", "bounds", "postings_touched", "generation",
+                 "term_dictionary", "store")
+
+    def __init__(self, idf_dict, doc_ids, norms, postings, bounds, generation=None):
+        self.idf_dict = idf_dict
+        self.doc_ids = doc_ids
+        self.norms = norms
+        self.postings = postings
+        self.bounds = bounds
+        self.postings_touched = 0
+        self.generation = generation
+        self.term_dictionary = None
+        self.store = None
+
+    @classmethod
+    def from_compact(cls, vectors, norms=None, bounds=None):
+        """Индекс из CompactVectors; нормы и границы из tfidf_norms.txt / tfidf_bounds.txt, если они актуальны"""
+        terms = vectors.terms
+        postings = vectors.postings()
+        if norms is not None and norms.keys() == set(vectors.doc_ids):
+            norms = array("d", (norms[doc_id] for doc_id in vectors.doc_ids))
+        else:
+            norms = array("d", (vector.norm() for vector in vectors.vectors))
+        if bounds is not None and bounds.keys() == terms.ids.keys():
+            bounds = array("d", (bounds[term] for term in terms.terms))
+        else:
+            bounds = compute_bounds(postings, norms)
+        return cls(TermValues(terms, vectors.idf), vectors.doc_ids, norms,
+                   TermValues(terms, postings), TermValues(terms, bounds))
+
+    @classmethod
+    def from_store(cls, store):
+        """Индекс поверх TfidfStore: ничего не копируется, списки читаются из mmap по запросу"""
+        index = cls(store.idf, store.doc_ids, store.norms, store.postings, store.bounds)
+        index.store = store
+        return index
+
+    def close(self):
+        """Закрывает mmap хранилища, если индекс открыт поверх него"""
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def terms(self):
+        return self.idf_dict.keys()
+
+    def dictionary_for(self, query):
+        """Словарь лемм, если в запросе есть шаблон или нечёткое слово; строится при первом таком запросе"""
+        return term_dict.of(self) if term_dict.has_patterns(query) else None
+
+    def score(self, q_vector):
+        """Косинусное сходство «термин за термином»: трогаются только документы из списков лемм запроса.
+
+        Скалярное произведение накапливается в том же порядке, что и в cosine_similarity,
+        поэтому значения совпадают с полным перебором побитно.
+        """
+        norm1 = math.sqrt(sum(v * v for v in q_vector.values()))
+        if norm1 == 0:
+            return {}
+        dots = {}
+        for lemma, q_weight in q_vector.items():
+            ordinals, weights = self.postings.get(lemma, ((), ()))
+            self.postings_touched += len(ordinals)
+            for ordinal, weight in zip(ordinals, weights):
+                dots[ordinal] = dots.get(ordinal, 0.0) + q_weight * weight
+        scores = {}
+        for ordinal, dot in dots.items():
+            norm2 = self.norms[ordinal]
+            if norm2 != 0:
+                scores[self.doc_ids[ordinal]] = dot / (norm1 * norm2)
+        return scores
+
+    def _exact(self, q_vector, norm1, ordinal):
+        """Score документа, посчитанный в том же порядке операций, что и в score()"""
+        norm2 = self.norms[ordinal]
+        if norm2 == 0:
+            return 0.0
+        dot = 0.0
+        for lemma, q_weight in q_vector.items():
+            entry = self.postings.get(lemma)
+            if entry is None:
+                continue
+            ordinals, weights = entry
+            i = bisect_left(ordinals, ordinal)
+            if i < len(ordinals) and ordinals[i] == ordinal:
+                dot = dot + q_weight * weights[i]
+        return dot / (norm1 * norm2)
+
+    def top_k(self, q_vector, k):
+        """k лучших документов алгоритмом MaxScore: [(score, doc_id)] в порядке search().
+
+        Леммы запроса упорядочены по верхней границе вклада. Леммы, суммарная граница которых
+        меньше порога (k-го score в куче), «необязательные»: документы берутся только из списков
+        обязательных лемм, а в необязательных ищутся двоичным поиском, пока граница кандидата
+        не опустится ниже порога.
+        """
+        norm1 = math.sqrt(sum(v * v for v in q_vector.values()))
+        if norm1 == 0 or k <= 0:
+            return []
+        terms = sorted(
+            ((q_weight * self.bounds[lemma] / norm1, self.postings[lemma])
+             for lemma, q_weight in q_vector.items() if lemma in self.postings),
+            key=lambda t: t[0])
+        # upto[i] — сумма границ лемм terms[:i + 1]
+        upto = list(accumulate(bound for bound, _ in terms))
+        lists = [postings for _, postings in terms]
+        cursors = [0] * len(lists)
+
+        heap = []
+        threshold = 0.0
+        first_essential = 0
+        while True:
+            candidate = None
+            for i in range(first_essential, len(lists)):
+                ordinals = lists[i][0]
+                if cursors[i] < len(ordinals) and (candidate is None or ordinals[cursors[i]] < candidate):
+                    candidate = ordinals[cursors[i]]
+            if candidate is None:
+                break
+
+            bound = 0.0
+            for i in range(first_essential, len(lists)):
+                ordinals = lists[i][0]
+                if cursors[i] < len(ordinals) and ordinals[cursors[i]] == candidate:
+                    bound += terms[i][0]
+                    cursors[i] += 1
+                    self.postings_touched += 1
+            if first_essential:
+                bound += upto[first_essential - 1]
+            # Необязательные леммы: снимаем границу тех, в чьих списках кандидата нет
+            for i in range(first_essential - 1, -1, -1):
+                if bound * (1 + BOUND_SLACK) < threshold:
+                    break
+                ordinals = lists[i][0]
+                cursors[i] = bisect_left(ordinals, candidate, cursors[i])
+                self.postings_touched += 1
+                if cursors[i] == len(ordinals) or ordinals[cursors[i]] != candidate:
+                    bound -= terms[i][0]
+            if bound * (1 + BOUND_SLACK) < threshold:
+                continue
+
+            score = self._exact(q_vector, norm1, candidate)
+            if score <= 0:
+                continue
+            item = (score, self.doc_ids[candidate])
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+            else:
+                continue
+            if len(heap) == k:
+                threshold = heap[0][0]
+                while first_essential < len(lists) and upto[first_essential] * (1 + BOUND_SLACK) < threshold:
+                    first_essential += 1
+        return sorted(heap, reverse=True)
+
+    def search(self, query, url_map):
+        """Все документы с положительным сходством, по убыванию score"""
+        with metrics.timer("vector.parse"):
+            q_vector = query_to_vector(query, self.idf_dict, self.dictionary_for(query))
+        with metrics.timer("vector.rank"):
+            results = []
+            for doc_id, score in self.score(q_vector).items():
+                if score > 0:
+                    results.append((score, doc_id, url_map.get(doc_id, f"pages/{doc_id}.html")))
+            results.sort(reverse=True)  # по убыванию score
+        return results
+
+    def search_top_k(self, query, url_map, k=TOP_K, cache=None):
+        """Первые k результатов search() без полного перебора.
+
+        С cache (QueryCache) вектор запроса и выдача берутся из кеша: ключ — леммы запроса с весами
+        в порядке появления и k, так что словоформы одного запроса делят запись, а score совпадает побитно.
+        """
+        if cache is None:
+            with metrics.timer("vector.parse"):
+                q_vector = query_to_vector(query, self.idf_dict, self.dictionary_for(query))
+            with metrics.timer("vector.rank"):
+                hits = self.top_k(q_vector, k)
+        else:
+            cache.sync(self.generation)
+            text = normalize_query(query)
+            q_vector = cache.parsed.get(text)
+            if q_vector is None:
+                with metrics.timer("vector.parse"):
+                    q_vector = query_to_vector(query, self.idf_dict, self.dictionary_for(query))
+                cache.parsed.put(text, q_vector)
+            key = (k, tuple(q_vector.items()))
+            hits = cache.results.get(key)
+            if hits is None:
+                metrics.count("query_cache_misses")
+                with metrics.timer("vector.rank"):
+                    hits = self.top_k(q_vector, k)
+                cache.results.put(key, hits)
+            else:
+                metrics.count("query_cache_hits")
+        return [(score, doc_id, url_map.get(doc_id, f"pages/{doc_id}.html")) for score, doc_id in hits]
+
+
+def index_generation():
+    """Поколение векторного индекса: поколение сегментов, если они текущий индекс, иначе меняется
+    при каждой перезаписи tfidf_store.bin (или tfidf_norms.txt без него)"""
+    if segments.is_active():
+        return "segments", segments.load_manifest(segments.SEGMENTS_DIR)["generation"]
+    path = TFIDF_STORE if os.path.exists(TFIDF_STORE) else TFIDF_NORMS_FILE
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_index():
+    """Индекс из сегментов, если они новее полной сборки, иначе из tfidf_store.bin (mmap, без разбора
+    файлов), а без него — из tfidf_lemmas/"""
+    if segments.is_active():
+        generation, vectors = segments.load_vectors()
+        print(f"Загружено из сегментов {len(vectors)} документов, словарь: {len(vectors.terms)} лемм")
+        index = VectorIndex.from_compact(vectors)
+        index.generation = "segments", generation
+        return index
+    generation = index_generation()
+    if os.path.exists(TFIDF_STORE):
+        store = TfidfStore(TFIDF_STORE)
+        print(f"Открыто хранилище {TFIDF_STORE}: {store.n_docs} документов, словарь: {len(store)} лемм")
+        index = VectorIndex.from_store(store)
+    else:
+        vectors = CompactVectors.from_dir(TFIDF_LEMMAS_DIR)
+        print(f"Загружено {len(vectors)} документов, словарь: {len(vectors.terms)} лемм")
+        index = VectorIndex.from_compact(vectors, read_norms(), read_bounds())
+    index.generation = generation
+    return index
+
+
 def load_url_map():
     """Загружает соответствие doc_id → URL"""
     url_map = {}
@@ -212,15 +428,30 @@ def load_url_map():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Векторный поиск (TF-IDF + Cosine Similarity)")
+    parser.add_argument("--top-k", type=int, default=TOP_K, help="сколько результатов показывать")
+    parser.add_argument("--exhaustive", action="store_true",
+                        help="считать score всех документов вместо отсечения MaxScore")
+    parser.add_argument("--verify", action="store_true",
+                        help="сверять top-k с полным перебором на каждом запросе")
+    parser.add_argument("--no-snippets", action="store_true", help="не показывать фрагменты текста")
+    args = parser.parse_args()
+
     print(
         "Загрузка векторного индекса...")
-    doc_vectors, idf_dict = load_tfidf_data()
+    index = load_index()
     url_map = load_url_map()
+    cache = QueryCache()
+    texts = None if args.no_snippets else snippets.open_texts()
+    if texts is None and not args.no_snippets:
+        print(f"Нет {snippets.DOC_STORE} — результаты без фрагментов текста (пересоберите индекс: python indexer.py)")
 
     print(
         "\nВекторный поиск (TF-IDF + Cosine Similarity)")
     print(
-        "Введите запрос или 'exit' для выхода\n")
+        "Шаблоны и опечатки: олимп* игры, алимпийский~ (до 2 опечаток)")
+    print(
+        "Введите запрос или 'exit' для выхода, 'stats' — статистика кеша, 'metrics' — таймеры этапов\n")
 
     while True:
         query = input(
@@ -228,37 +459,49 @@ if __name__ == "__main__":
         if query.lower() in (
         "exit", "выход",
         "quit"):
+            lemmatizer.save()
             break
         if not query:
             continue
+        if query.lower() == "stats":
+            print(cache.report())
+            print("-" * 80)
+            continue
+        if query.lower() == "metrics":
+            print(metrics.prometheus_text() if metrics.enabled() else f"Инструментирование выключено ({metrics.ENV_ENABLED}=1)")
+            continue
+
+        index.postings_touched = 0
+        if args.exhaustive:
+            results = index.search(query, url_map)
+            print(
+                f"\nНайдено релевантных документов: {len(results)}")
+            results = results[:args.top_k]
+        else:
+            results = index.search_top_k(query, url_map, args.top_k, cache)
+        touched = index.postings_touched
+        metrics.log("query", engine="vector", query=query, results=len(results), postings_touched=touched)
+
+        if args.verify:
+            expected = index.search(query, url_map)[:args.top_k]
+            if results == expected:
+                print("Проверка: совпадает с полным перебором")
+            else:
+                print("Проверка: РАСХОЖДЕНИЕ с полным перебором")
+                for i, (score, doc_id, url) in enumerate(expected, 1):
+                    print(f"  {i:2d}. [{doc_id}] score={score:.4f}")
 
-        q_vector = query_to_vector(
-            query, idf_dict)
-
-        results = []
-        for doc_id, d_vector in doc_vectors.items():
-            score = cosine_similarity(
-                q_vector,
-                d_vector)
-            if score > 0:
-                url = url_map.get(
-                    doc_id,
-                    f"pages/{doc_id}.html")
-                results.append(
-                    (score,
-                     doc_id,
-                     url))
-
-        results.sort(
-            reverse=True)  # по убыванию score
-
-        print(
-            f"\nНайдено релевантных документов: {len(results)}")
-        print("Топ-15:")
-        for i, (score, doc_id,
-                url) in enumerate(
-                results[:15],
+        page = [None] * len(results)
+        if texts is not None:
+            highlighter = snippets.Highlighter(query_to_vector(query, index.idf_dict, index.dictionary_for(query)))
+            page = snippets.page_snippets([doc_id for _, doc_id, _ in results], texts, highlighter)
+        print(f"Топ-{args.top_k} (просмотрено элементов списков: {touched}):")
+        for i, ((score, doc_id,
+                 url), snippet) in enumerate(
+                zip(results, page),
                 1):
             print(
                 f"{i:2d}. [{doc_id}] score={score:.4f} → {url}")
-        print("-" * 80)
\ No newline at end of file
+            if snippet is not None:
+                print(f"    {snippets.mark(*snippet)}")
+        print("-" * 80)